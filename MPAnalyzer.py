@@ -5,21 +5,36 @@ Created on Mon Dec 17 19:51:21 2018
 @author: Bob
 """
 
-from sklearn.preprocessing import StandardScaler
-from sklearn.cluster import DBSCAN
-from nltk.tokenize import word_tokenize
-from nltk.stem import PorterStemmer
-from nltk.corpus import stopwords
 from sqlalchemy import create_engine
 from config import config
 import pandas as pd
 import numpy as np
-import unidecode
 import psycopg2
 import re
+import time
 import click
 from tqdm import tqdm
 from mpproj.routefinder.StyleInformation import *
+from mpproj.routefinder.TextSplitter import ARCHETYPE_PUNCTUATION
+from mpproj.routefinder.TextSplitter import split_texts
+from MPTfidf import read_words
+from MPTfidf import term_matrix
+from MPTfidf import tfidf_matrix
+from MPTfidf import scale_tfidf
+from MPTfidf import tfidf_frame
+from MPTfidf import write_tfidf
+from MPTfidf import write_idf
+from MPTfidf import read_idf
+from MPTfidf import replace_tfidf
+from MPTfidf import cosine_scores
+from MPVocabulary import lookup_words
+from MPLocations import fill_null_locations
+from MPClusters import route_regions
+from MPClusters import cluster_regions
+from MPClusters import write_clusters
+from MPFrontier import create_reanalysis
+from MPFrontier import reanalysis_queue
+from MPFrontier import finish_reanalysis
 
 
 def MPAnalyzer():
@@ -33,10 +48,9 @@ def MPAnalyzer():
         - bayesian_rating: Calculates the weighted quality rating for each
             route
         - route_clusters: Groups routes together based on geographic distance
-        - idf: Calculates inverse-document-frequency for words in the route
-            descriptions
+            (see MPClusters)
         - tfidf: Calclates term-frequency-inverse-document-frequency for words
-            in route descriptions
+            in route descriptions, as sparse matrices (see MPTfidf)
         - normalize: Normalizes vectors for TFIDF values
         - find_route_styles: Compares routes to the ideal to help categorize
 
@@ -50,10 +64,12 @@ def MPAnalyzer():
     params = config.config()
     conn = psycopg2.connect(**params)
     cursor = conn.cursor()
+    create_reanalysis(cursor)
+    conn.commit()
     print('Connected')
     tqdm.pandas()
 
-    def tfidf(min_occur=0.001, max_occur=0.9):
+    def tfidf(min_occur=0.001, max_occur=0.9, changed_only=False):
         ''' Calculates Term-Frequency-Inverse-Document-Frequency for a body of
         documents.
 
@@ -70,6 +86,23 @@ def MPAnalyzer():
                           TF = Term Frequency
                           IDF = Inverse Document Frequency
 
+                                IDF = 1 + log(N / dfj)
+
+             N = Total number of documents in the corpus
+             dfj = Document frequency of a certain word, i.e., the number of
+                 documents that the word appears in.
+
+        The words are held in a sparse matrix with one row per route, so that
+        finding the IDF of every word and normalizing every route are each
+        one operation on the whole matrix.  See MPTfidf.  Words are read and
+        written by their word_id, and the IDF of each word is stored in the
+        Vocabulary (see MPVocabulary).
+
+        Routes queued by the crawler (see MPFrontier.reanalysis_queue) are
+        marked as done in the same transaction that writes their TFIDF.  When
+        only those routes are updated, they are scored with the IDF stored by
+        the last full run, and the TFIDF of every other route is left alone.
+
         Args:
             min_occur(int): The minimum number of documents that a word has to
                 appear in to be counted. Included to ignore words that only
@@ -78,93 +111,57 @@ def MPAnalyzer():
             max_occur(int): The maximum number of documents that a word can
                 appear in to be counted.  This is included to ignore highly
                 common words that don't help with categorization.
+            changed_only(Boolean, default = False): Only updates the routes
+                in the Reanalysis queue
 
         Returns:
             routes(pandas Dataframe): Holds route-document information,
-                including term-frequency, inverse-document-frequency, TFIDF,
-                and normalized TFIDF values
+                including word ids, inverse-document-frequency and normalized
+                TFIDF values
             Updated SQL Database: Updates the TFIDF table on main DB with the
-                routes dataframe
+                routes dataframe, and the IDF values in the Vocabulary
         '''
 
-        print('Getting number of routes', end=' ', flush=True)
-        cursor.execute('SELECT COUNT(route_id) FROM Routes')
-        num_docs = cursor.fetchone()[0]
-        print(num_docs)
-
-        print('Getting route text data', flush=True)        
-        min_occur *= num_docs
-        max_occur *= num_docs
-        query = 'SELECT route_id, word, tf FROM Words'
-        routes = pd.read_sql(query, con=conn, index_col='route_id')
-
-        print('Removing non-essential words.', flush=True)
-        routes = routes.groupby('word', group_keys=False)
-        routes = routes.progress_apply(
-            weed_out,
-            min_occur=min_occur,
-            max_occur=max_occur)\
-                       .set_index('route_id')
-
-        print('Getting IDF', flush=True)
-        routes = routes.groupby('word', group_keys=False)
-        routes = routes.progress_apply(
-            idf,
-            num_docs=num_docs).set_index('route_id')
-
+        queued = reanalysis_queue(cursor, 'tfidf')
+        if changed_only:
+            print(f'Getting route text data for {len(queued)} routes',
+                  flush=True)
+            words = read_words(conn, list(queued))
+        else:
+            print('Getting number of routes', end=' ', flush=True)
+            cursor.execute('SELECT COUNT(route_id) FROM Routes')
+            num_docs = cursor.fetchone()[0]
+            print(num_docs)
+
+            print('Getting route text data', flush=True)
+            min_occur *= num_docs
+            max_occur *= num_docs
+            words = read_words(conn)
+
+        print('Building term matrix', flush=True)
+        matrix, route_ids, vocabulary = term_matrix(
+            words['route_id'], words['word_id'], words['tf'])
+        del words
+
+        # Removes non-essential words, finds IDF and normalizes each route
         print('Calculating TFIDF', flush=True)
-        routes['tfidf'] = routes['tf'] * routes['idf']
-
-        print('Normalizing TFIDF values', flush=True)
-        routes = routes.groupby(routes.index, group_keys=False)
-        routes = routes.progress_apply(lambda x: normalize('tfidf', table=x))
+        if changed_only:
+            # Words left out of the last full run stay out until the next
+            idf = read_idf(conn, vocabulary)
+            tfidfn = scale_tfidf(matrix, idf)
+        else:
+            tfidfn, idf = tfidf_matrix(matrix, num_docs, min_occur, max_occur)
+        routes = tfidf_frame(tfidfn, idf, route_ids, vocabulary)
 
         print('Writing TFIDF scores to SQL', flush=True)
-        routes = routes.set_index('route_id')
-        routes = routes[['word', 'idf', 'tfidfn']]
-
-        # This will take a long time
-        routes.to_sql('TFIDF', con=engine, if_exists='replace', chunksize=1000)
-
-    def weed_out(table, min_occur, max_occur):
-        '''Removes words that are too common or too rare
-        
-        Args:
-            table(Series): Instances of a word
-            min_occur: Fewest number acceptable
-            max_occur: Greatest number acceptable
-            
-        Returns:
-            table: updated series'''
-        
-        if min_occur < len(table) < max_occur:
-            return table.reset_index()
-
-    def idf(word, num_docs):
-        ''' Finds inverse document frequency for each word in the selected
-        corpus.
-
-        Inverse document frequency(IDF) is a measure of how often a word
-        appears in a body of documents.  The value is calculated by:
-
-                            IDF = 1 + log(N / dfj)
-
-             N = Total number of documents in the corpus
-             dfj = Document frequency of a certain word, i.e., the number of
-                 documents that the word appears in.
-
-        Args:
-            word(pandas dataframe): A dataframe composed of all instances of a
-                word in a corpus.
-            num_docs(int): The total number of documents in the corpus
-
-        Returns:
-            word(pandas dataframe): The same document with the calculated IDF
-                score appended.
-        '''
-
-        word['idf'] = 1 + np.log(num_docs / len(word))
-        return word.reset_index()
+        if changed_only:
+            replace_tfidf(conn, routes, list(queued))
+        else:
+            write_tfidf(conn, routes, commit=False)
+            write_idf(conn, idf, vocabulary, commit=False)
+        finish_reanalysis(cursor, 'tfidf', queued)
+        conn.commit()
+        return routes
 
     def normalize(*columns, table, inplace=False):
         ''' Normalizes vector length.
@@ -198,66 +195,21 @@ def MPAnalyzer():
         """Fills empty route location data.
         
         Not all routes have latitude and longitude coordinates, so we must use
-        the coordinates of their parent area instead as a rough estimate.  This
-        function first grabs all routes with no data, then fills in the data
-        with the lowest level area it can, going up as many areas as needed
-        until it finds one with proper coordinates.
+        the coordinates of their parent area instead as a rough estimate.  The
+        area tree is read once, the lowest area with proper coordinates is
+        found for every area, and all routes are filled in with one UPDATE.
+        See MPLocations.
         
         Returns:
             Updated SQL Database
             """
         print('Filling in empty locations', flush=True)
-        # Select a route without location data
-        cursor.execute('''
-            SELECT route_id, area_id, name FROM Routes
-            WHERE latitude is Null OR longitude is Null
-            LIMIT 1''')
-        route = cursor.fetchone()
-        
-        while route is not None:
-            # Route ID
-            rid = route[0]
-            # From ID
-            fid = route[1]
-            name = route[2]
-            print(f'Finding location information for {name}')
-    
-            # Loops until it finds proper data
-            lat, long = None, None
-            while lat == None or long == None:
-                # Gets latitude and longitude from parent area
-                cursor.execute(f'''
-                    SELECT
-                        latitude,
-                        longitude,
-                        from_id
-                    FROM Areas
-                    WHERE id = {fid}
-                    LIMIT 1''')
-                loc = cursor.fetchone()
-                lat, long = loc[0], loc[1]
-                fid = loc[2]
-            # Updates DB
-            cursor.execute(f'''
-                UPDATE Routes
-                SET
-                    latitude = {lat},
-                    longitude = {long}
-                WHERE route_id = {rid}''')
-            conn.commit()
-            cursor.execute('''
-                SELECT
-                    route_id,
-                    area_id,
-                    name
-                FROM Routes
-                WHERE
-                    latitude is Null
-                    OR longitude is Null
-                LIMIT 1''')
-            route = cursor.fetchone()
+        start = time.perf_counter()
+        num_routes = fill_null_locations(conn)
+        print(f'Filled in {num_routes} routes in '
+              f'{time.perf_counter() - start:.1f}s', flush=True)
 
-    def route_clusters(routes):
+    def route_clusters(changed_only=False):
         ''' Clusters routes into area groups that are close enough to travel
         between when finding climbing areas.
 
@@ -281,60 +233,42 @@ def MPAnalyzer():
         a robust response to outliers and noise, and that the epsilon and min
         points variables can be adjusted.
 
-        This function returns the label/name for the cluster that a route
+        Distances are measured along the surface of the Earth, so epsilon is
+        in kilometres, and neighbors are found with a ball tree index.  Each
+        region is clustered on its own.  See MPClusters.
+
+        This function finds the label/name for the cluster that a route
         appears in, as well as the number of other routes in that same cluster.
         This will allow the sorting algorithm to more heavily weight routes
         that are clustered near others.
 
         Args:
-            routes(pandas df): Pulled from cleaned route SQL DB with columns:
-                - route_id (int, unique): Unique route identifies
-                - latitude (float)
-                - longitude (float)
+            changed_only(Boolean, default = False): Only clusters the regions
+                holding routes listed in the Reanalysis table.  Clusters in
+                other regions are left as they are.  Either way, the queued
+                routes are marked as clustered.
         Returns:
-            routes(pandas df): Updated with clustered area group number:
-                - route_id (int, unique): Unique route identifies
-                - area_group (int): Cluster id
+            Updated SQL Database: area_group (cluster id) and area_counts
+                (routes in the cluster) of each route
         '''
 
-        # Route location
-        lats = routes['latitude']
-        longs = routes['longitude']
-        locs = []
-        for x in range(len(lats)):
-            locs.append((lats.iloc[x], longs.iloc[x]))
-
-        # Converted into df
-        locs = StandardScaler().fit_transform(locs)
-        # Max distance in latitude
-        epsilon = 0.0007
-        # Min number of routes in a cluster
-        min_routes = 3
-        # Distance baced scan
-        db = DBSCAN(eps=epsilon, min_samples=min_routes).fit(locs)
-        core_samples_mask = np.zeros_like(db.labels_, dtype=bool)
-        core_samples_mask[db.core_sample_indices_] = True
-        # Cluster names
-        labels = db.labels_
-        unique, counts = np.unique(labels, return_counts=True)
-        counts = dict(zip(unique, counts))
-        # Number of routes in the same cluster as a given route
-        area_counts = []
-        
-        for label in labels:
-            if label >= 0:
-                # Counts number of routes
-                area_counts.append(counts[label])
-            # Areas are given a cluster id of -1 if the are not part of a
-            # cluster
-            elif label == -1:
-                # If so, there is only 1 route in their 'cluster'
-                area_counts.append(1)
-
-        routes['area_group'] = labels
-        routes['area_counts'] = area_counts
-        routes = routes[['area_group', 'area_counts']]
-        return routes
+        first_label = 0
+        route_ids = None
+        queued = reanalysis_queue(cursor, 'clusters')
+        if changed_only:
+            route_ids = list(queued)
+            # New clusters are numbered after every cluster that is kept
+            cursor.execute('SELECT MAX(area_group) FROM Routes')
+            first_label = (cursor.fetchone()[0] or 0) + 1
+
+        routes = route_regions(conn, route_ids)
+        print(f'Clustering {len(routes)} routes in '
+              f'{routes["region"].nunique()} regions', flush=True)
+        clusters = cluster_regions(routes, first_label=first_label)
+        # The queued routes are marked as clustered with their clusters
+        write_clusters(conn, clusters, commit=False)
+        finish_reanalysis(cursor, 'clusters', queued)
+        conn.commit()
 
     def bayesian_rating(routes):
         ''' Updates route quality with weighted average.
@@ -380,7 +314,7 @@ def MPAnalyzer():
                             + avg_stars * 10) / (routes['votes'] + 10)), 1)
         return routes['bayes'].to_frame()
     
-    def find_route_styles(*styles, path='Descriptions/'):
+    def find_route_styles(*styles, path='Descriptions/', changed_only=False):
         ''' Returns weighted scores that represent a route's likelihood of
         containing any of a series of features, e.g., a roof, arete, or crack.
     
@@ -404,49 +338,25 @@ def MPAnalyzer():
         More styles or archetypes can be added in the future by creating .txt
         files and adding them to the 'Descriptions' sub-folder, then adding the
         style to the *styles argument.
+
+        The raw cosine scores of every route are kept in 'Routes_cosine', so
+        that when only the routes in the Reanalysis queue are scored, the
+        weighted scores can still be found against every route.  Queued
+        routes are marked as done once their TFIDF is up to date and their
+        scores are written, in the same transaction.
     
         Args:
             *styles(str): The name of the files that each route will be
                 compared against.
             path(str): Folder location of the Database
+            changed_only(Boolean, default = False): Only scores the routes in
+                the Reanalysis queue, and reuses the stored scores of the
+                others
     
         Returns:
             Updated SQL Database with weighted route scores
         '''
     
-        def text_splitter(text):
-            '''Splits text into words and removes punctuation.
-    
-            Once the text has been scraped it must be split into individual
-            words for further processing.  The text is all put in lowercase,
-            then stripped of punctuation and accented letters. Tokenizing helps
-            to further standardize the text, then converts it to a list of
-            words. Each word is then stemmed using a Porter stemmer.  This
-            removes suffixes that make similar words look different, turning,
-            for example, 'walking' or 'walked' into 'walk'.  Stop words are
-            also filtered out at this stage.
-    
-            Args:
-                text(str): Single string of text to be handled
-    
-            Returns:
-                text(list): List of processed words.'''
-    
-            # Converts to lowercase
-            text = text.lower()
-            # Strips punctuation and converts accented characters to unaccented
-            text = re.sub(r"[^\w\s]", '', text)
-            text = unidecode.unidecode(text)
-            # Tokenizes words and returns a list
-            text = word_tokenize(text)
-            # Remove stopwords            
-            stop_words = set(stopwords.words('english'))
-            # Stems each word in the list
-            ps = PorterStemmer()
-            text = [ps.stem(word) for word in text if word not in stop_words]
-    
-            return text
-    
         def archetypal_tf(*styles, path):
             ''' Returns term-frequency data for descriptions of archetypal
             climbing routes and styles.  This will be used later to categorize
@@ -468,8 +378,8 @@ def MPAnalyzer():
                 archetypes(Pandas Dataframe): Holds words term-frequency values
                     for words in the files.'''
     
-            # Initializes Dataframe
-            archetypes = pd.DataFrame()
+            # Reads every description first, so they can be split at once
+            texts = {}
             for style in styles:
                 # Formats suffix
                 if style.endswith('.txt'):
@@ -486,14 +396,17 @@ def MPAnalyzer():
                     except OSError as e:
                         return e
     
-    
                 # Creates single block of text
-                text = ''
-                for line in file:
-                    text += line
-                # Splits and processes text
-                text = text_splitter(text)
-    
+                with file:
+                    texts[style] = file.read()
+
+            # Splits and processes text.  Unlike route text, apostrophes are
+            # removed from archetype descriptions
+            split = split_texts(texts.values(), ARCHETYPE_PUNCTUATION)
+
+            # Initializes Dataframe
+            archetypes = pd.DataFrame()
+            for style, text in zip(texts, split):
                 # Length of document in words
                 length = len(text)
                 # Counts appearances of each word
@@ -533,15 +446,17 @@ def MPAnalyzer():
                 archetypes(pandas dataframe): IDF values for each word pulled
                     from the Database.'''
     
-            # Formats query to include list of unique words
-            query = f'''
+            # Words that were not scored have no IDF
+            query = '''
                 SELECT
-                    DISTINCT(word),
+                    word,
                     idf
-                FROM "TFIDF"
-                WHERE word IN {words}'''
+                FROM Vocabulary
+                WHERE word = ANY(%s)
+                AND idf IS NOT NULL'''
             # Pulls SQL data into Pandas dataframe
-            archetypes = pd.read_sql(query, con=conn, index_col='word')
+            archetypes = pd.read_sql(
+                query, con=conn, params=(list(words),), index_col='word')
     
             return archetypes
     
@@ -553,31 +468,27 @@ def MPAnalyzer():
                 route_ids: Optional.  Allows for a slice to be parsed.
             Returns:
                 routes(Pandas Series): MultiIndex series with indexes
-                'route_id' and 'word' and column 'tfidfn' - Normalized TFIDF'''
-    
-            # Pulls route_id, word, and normalized TFIDF value
-            if route_ids is None:
-                query = '''
-                    SELECT
-                        route_id,
-                        word,
-                        tfidfn
-                    FROM "TFIDF"'''
-            else:
-                route_ids = tuple(route_ids)
-                query = f'''
-                    SELECT
-                        route_id,
-                        word,
-                        tfidfn
-                    FROM "TFIDF"
-                    WHERE route_id in {route_ids}'''
+                'route_id' and 'word_id' and column 'tfidfn' - Normalized
+                TFIDF'''
+    
+            # Pulls route_id, word_id, and normalized TFIDF value
+            query = '''
+                SELECT
+                    route_id,
+                    word_id,
+                    tfidfn
+                FROM "TFIDF"'''
+            params = None
+            if route_ids is not None:
+                query += ' WHERE route_id = ANY(%s)'
+                params = (list(route_ids),)
     
             # Creates Pandas Dataframe
             routes = pd.read_sql(
                 query,
-                con=engine,
-                index_col=['route_id', 'word'])
+                con=conn,
+                params=params,
+                index_col=['route_id', 'word_id'])
             routes = routes.squeeze()
 
             return routes
@@ -588,75 +499,30 @@ def MPAnalyzer():
             Args:
                 route_ids: Optional. Allows for a slice to be parsed
             Returns:
-                word_count(Pandas dataframe): Dataframe with index route_id and
-                    column 'word_count' - length of a route description in
-                    words'''
+                word_count(Pandas series): Series named 'word_count' with
+                    index route_id - length of a route description in words'''
     
             # Pulls route_id and word_count for each route
-            if route_ids is None:
-                query = 'SELECT route_id, word_count FROM Words'
-            else:
-                route_ids = tuple(route_ids)
-                query = f'''
-                    SELECT
-                        route_id,
-                        word_count
-                    FROM Words
-                    WHERE route_id in {route_ids}'''
+            query = 'SELECT route_id, word_count FROM Words'
+            params = None
+            if route_ids is not None:
+                query += ' WHERE route_id = ANY(%s)'
+                params = (list(route_ids),)
     
             # Calculates document length
             word_count = pd.read_sql(query,
                                      con=conn,
-                                     index_col='route_id').groupby(level=0)
+                                     params=params,
+                                     index_col='route_id')
+            word_count = word_count.groupby(level=0)['word_count'].sum()
 
             # We will take the log of the word count later, so we cannot leave
             # zeroes in the series
-            word_count = word_count.progress_apply(lambda x: np.sum(x) + 0.01)
+            word_count = word_count + 0.01
             word_count.fillna(0.01, inplace=True)
             
             return word_count
     
-        def cosine_similarity(route, archetypes):
-            '''Compares routes to archetypes to help categorize route style.
-    
-            Cosine similarity is the angle between two vectors.  Here, the
-            normalized TFIDF values for each word in the route description and
-            archetype documents serve as the coordinates of the vector. Finding
-            the cosine similarity is therefore simply their dot-product.
-    
-                    Cosine Similarity = Σ(ai * bi)
-    
-                    ai = TFIDF for a word in the route description
-                    bi = TFIDF for the same word in the archetype document.
-    
-            The similarity will range between 0 and 1, 1 being identical and 0
-            having no similarity.
-    
-            Args:
-                route(Pandas dataframe): MultiIndex frame with indexes route_id
-                    and word and columns normalized TFDIF values
-                archetypes(Pandas dataframe): Frame with index word and columns
-                    normalized TFIDF values.
-    
-            Returns:
-                terrain(Pandas dataframe): Frame with columns for each style,
-                    holding cosine simlarity values.'''
-
-            try:
-                rid = route.index[0][0]
-            except:
-                return
-
-            route = archetypes.multiply(route, axis=0)
-            terrain = pd.DataFrame(index=[rid])
-
-            for column in route:
-                cosine_sim = np.sum(route[column])
-                terrain[column] = cosine_sim
-
-            return terrain
-
-    
         def score_routes(*styles, word_count, path, routes):
             '''Gets TF, IDF data for archetypes, then finds TFIDF and cosine
             similarity for each route/style combination.
@@ -664,6 +530,15 @@ def MPAnalyzer():
             Finding the raw cosine similarity scores requires the functions
             archetypal_tf, archetypal_idf, and normalize.  This function helps
             organize the retrieval and processing of the data for those functions.
+
+            Cosine similarity is the angle between two vectors.  Here, the
+            normalized TFIDF values for each word in the route description and
+            archetype documents serve as the coordinates of the vector, so the
+            similarity is their dot product.  It ranges between 0 and 1, 1
+            being identical and 0 having no similarity.  Every route is scored
+            against every style at once, as the product of a sparse
+            route x word matrix and a word x style matrix (see
+            MPTfidf.cosine_scores).
     
             Args:
                 word_count(Pandas dataframe): Dataframe with index route_id and
@@ -702,14 +577,14 @@ def MPAnalyzer():
                 archetypes.to_csv(path + 'TFIDF.csv')
     
             archetypes = pd.read_csv(path + 'TFIDF.csv', index_col='word')
-    
-            # Groups words by route_id, then finds cosine similarity for each
-            # route-style combination
-            routes = routes.groupby('route_id').progress_apply(
-                cosine_similarity,
-                archetypes=archetypes)
-            # Reformats routes dataframe
-            routes.index = routes.index.droplevel(1)
+            # Routes hold word ids, so the archetypes are looked up by them
+            word_ids = lookup_words(cursor, archetypes.index)
+            archetypes = archetypes[archetypes.index.isin(list(word_ids))]
+            archetypes.index = archetypes.index.map(word_ids)
+            archetypes.index.name = 'word_id'
+    
+            # Finds cosine similarity for each route-style combination
+            routes = cosine_scores(routes, archetypes)
             routes = pd.concat([routes, word_count], axis=1, sort=False)
             routes.fillna(0, inplace=True)
 
@@ -859,14 +734,41 @@ def MPAnalyzer():
                                     - threshold))))
 
             return table
-    
+
+        def stored_scores():
+            '''Reads the raw cosine scores written by the last run.
+
+            Returns:
+                routes(Pandas dataframe): Cosine similarity for each
+                    route/style combination and word count, or None if no
+                    scores were stored for these styles'''
+
+            cursor.execute("SELECT to_regclass('\"Routes_cosine\"')")
+            if cursor.fetchone()[0] is None:
+                return None
+            routes = pd.read_sql(
+                'SELECT * FROM "Routes_cosine"',
+                con=conn,
+                index_col='route_id')
+            if not set(styles + ('word_count',)) <= set(routes.columns):
+                return None
+            return routes
+
         # Run functions
 
+        # Routes still waiting on their TFIDF are scored again once it is
+        # updated
+        queued = reanalysis_queue(cursor, 'terrain', after='tfidf')
+        stored = stored_scores() if changed_only else None
+        if changed_only and stored is None:
+            print('No stored scores for these styles, scoring every route')
+
         print('Getting route information')
-        routes = get_routes()
+        route_ids = list(queued) if stored is not None else None
+        routes = get_routes(route_ids)
 
         print('Getting word count')
-        word_count = get_word_count()
+        word_count = get_word_count(route_ids)
 
         print('Scoring routes')
         routes = score_routes(
@@ -874,6 +776,16 @@ def MPAnalyzer():
             word_count=word_count,
             path=path,
             routes=routes)
+        if stored is not None:
+            # Queued routes without any scored words are scored at 0
+            routes = routes.reindex(route_ids, fill_value=0)
+            routes.loc[routes['word_count'] == 0, 'word_count'] = 0.01
+            routes = pd.concat(
+                [stored[~stored.index.isin(route_ids)][list(routes.columns)],
+                 routes],
+                sort=False)
+        routes.index.name = 'route_id'
+        cosine = routes.copy()
         
         print('Getting weighted scores')
         routes = weighted_scores(*styles, table=routes, inplace=True)
@@ -902,11 +814,19 @@ def MPAnalyzer():
                                             updated[feature]
                                             - other_features.sum(axis=1))
 
-        # Write to Database        
-        updated.to_sql(
-            'Routes_scored',
-            con=engine,
-            if_exists='replace')
+        # Writes to the Database and marks the queued routes as scored in
+        # one transaction
+        with engine.begin() as connection:
+            cosine.to_sql(
+                'Routes_cosine',
+                con=connection,
+                if_exists='replace')
+            updated.to_sql(
+                'Routes_scored',
+                con=connection,
+                if_exists='replace')
+            finish_reanalysis(
+                connection.connection.cursor(), 'terrain', queued)
         
         return
 
@@ -1311,11 +1231,8 @@ def MPAnalyzer():
         fill_null_loc()
 
         print('Getting climbing area clusters', flush=True)
-        cluster_text = '''
-            SELECT route_id, latitude, longitude
-            FROM Routes'''
-        clusters = pd.read_sql(cluster_text, con=conn, index_col='route_id')
-        clusters = route_clusters(clusters)
+        route_clusters(changed_only=click.confirm(
+            'Only recluster regions with new or changed routes?'))
 
         print('Getting Bayesian rating', flush=True)
         # Gets Bayesian rating for routes
@@ -1325,30 +1242,27 @@ def MPAnalyzer():
         bayes = bayesian_rating(bayes)
         
         print('Writing to SQL',flush=True)
-        # Combines metrics
-        add = pd.concat([bayes, clusters], axis=1)
         # Writes to the database
-        with click.progressbar(add.index) as bar:
+        with click.progressbar(bayes.index) as bar:
             for route in bar:
-                rate = add.loc[route]['bayes']
-                group = add.loc[route]['area_group']
-                cnt = add.loc[route]['area_counts']
+                rate = bayes.loc[route]['bayes']
 
                 cursor.execute(f'''
                     UPDATE Routes
                     SET
-                        bayes = {rate},
-                        area_group = {group},
-                        area_counts = {cnt}
+                        bayes = {rate}
                     WHERE route_id = {route}''')
         conn.commit()
 
     if click.confirm("Update TFIDF scores?"):
-        tfidf()
+        tfidf(changed_only=click.confirm(
+            'Only update new or changed routes?'))
 
     if click.confirm("Find route terrain scores?"):
         # Gets route scores for climbing styles
-        find_route_styles('arete', 'chimney', 'crack', 'slab', 'overhang')
+        find_route_styles(
+            'arete', 'chimney', 'crack', 'slab', 'overhang',
+            changed_only=click.confirm('Only score new or changed routes?'))
         
     if click.confirm("Get Route links"):
         query = "SELECT id, area_id FROM routes_scored"
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+"""
+Summary:
+On-disk archive of every page downloaded by the crawler.
+
+Details:
+Changing how a page is parsed, such as a grade pattern in get_route_diff or
+the text gathered by get_text, used to mean crawling the whole website again.
+Instead, the fetcher stores every page it downloads in a SQLite file, and the
+Routes and Words tables can be rebuilt from the archive without touching the
+network:
+
+    python MPWorker.py work --reparse
+
+Each page is one row in the 'Pages' table:
+
+    url - URL on Mountain Project
+    fetched - Unix time the page was downloaded
+    html - zlib compressed page HTML
+
+Only the latest download of each page is kept.  Writes are committed in
+batches, and the archive uses SQLite's write-ahead log so that several
+crawlers on one machine can share the same file.
+"""
+
+import sqlite3
+import time
+import zlib
+
+
+class PageArchive:
+    ''' Compressed store of downloaded pages, keyed by URL.
+
+    Args:
+        path(str): Location of the SQLite file.  It is created if it does not
+            exist.
+        commit_every(int): Number of pages stored between commits
+        level(int): zlib compression level
+    '''
+
+    def __init__(self, path='pages.sqlite', commit_every=100, level=6):
+        self.path = path
+        self.commit_every = commit_every
+        self.level = level
+        self.pending = 0
+        # Waits on other crawlers writing to the same file
+        self.conn = sqlite3.connect(path, timeout=60)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS Pages(
+                url TEXT PRIMARY KEY,
+                fetched REAL,
+                html BLOB)''')
+        self.conn.commit()
+
+    def store(self, url, html):
+        ''' Adds a page to the archive, replacing any earlier download.
+
+        Args:
+            url(str): URL of the page
+            html(bytes): Raw page HTML
+        '''
+
+        self.conn.execute(
+            'INSERT OR REPLACE INTO Pages(url, fetched, html) VALUES(?, ?, ?)',
+            (url, time.time(), zlib.compress(html, self.level)))
+        self.pending += 1
+        if self.pending >= self.commit_every:
+            self.commit()
+
+    def get(self, url):
+        ''' Finds the archived copy of a page.
+
+        Args:
+            url(str): URL of the page
+
+        Returns:
+            html(bytes): Raw page HTML, or None if the page is not archived
+        '''
+
+        row = self.conn.execute(
+            'SELECT html FROM Pages WHERE url = ?', (url,)).fetchone()
+        if row is None:
+            return None
+        return zlib.decompress(row[0])
+
+    def pages(self, batch_size=500):
+        ''' Reads every archived page in batches.
+
+        Args:
+            batch_size(int): Number of pages in each batch
+
+        Yields:
+            batch(list): (url, html) for each page in the batch
+        '''
+
+        self.commit()
+        cursor = self.conn.execute('SELECT url, html FROM Pages ORDER BY url')
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                return
+            yield [(url, zlib.decompress(html)) for url, html in rows]
+
+    def __len__(self):
+        return self.conn.execute('SELECT COUNT(*) FROM Pages').fetchone()[0]
+
+    def commit(self):
+        ''' Saves every page stored since the last commit.'''
+
+        if self.pending:
+            self.conn.commit()
+            self.pending = 0
+
+    def close(self):
+        ''' Saves any remaining pages and closes the file.'''
+
+        self.commit()
+        self.conn.close()
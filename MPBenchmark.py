@@ -0,0 +1,856 @@
+# -*- coding: utf-8 -*-
+"""
+Summary:
+Times the crawler against a local copy of Mountain Project, and parts of the
+crawler against what they replaced.
+
+Details:
+The crawl command starts MPTestServer in its own process, crawls it from
+scratch with MPScraper, and reports:
+
+    pages/sec - Pages downloaded per second over the whole crawl
+    p50, p99 - Median and 99th percentile time to download a page
+    DB write rate - Routes and words written per second spent writing
+
+The crawl writes to its own database, given by a section of the config file,
+and every crawler table in that database is dropped before the crawl starts.
+Runs with the same options crawl the same site, so results can be compared
+before and after a change:
+
+    python MPBenchmark.py crawl --section benchmark --routes 50 \\
+        --latency 0.05 --output before.json
+
+The code that was replaced is kept here, rather than in the modules that
+replaced it, so it can be timed and tested against the new code.  The
+grades command times GradeParser against get_route_diff as it was before,
+which scanned the grade header with every pattern and looked grades up in
+lists:
+
+    python MPBenchmark.py grades --repeat 20000
+
+The records command measures the memory each route takes up as a
+RouteRecord and as the dictionary it replaced:
+
+    python MPBenchmark.py records --count 100000
+
+The tfidf command checks MPTfidf's sparse TFIDF against the three pandas
+groupby passes MPAnalyzer used to make, on a made-up corpus, and times
+both:
+
+    python MPBenchmark.py tfidf --routes 20000
+
+The cosine command checks the cosine similarity of MPTfidf.cosine_scores
+against scoring one route at a time, the way MPAnalyzer used to, on a
+made-up corpus, and times both:
+
+    python MPBenchmark.py cosine --routes 20000
+
+The clusters command clusters made-up routes with MPClusters and with the
+standardized brute force DBSCAN MPAnalyzer used to run, and times them over
+a number of corpus sizes to show how each scales:
+
+    python MPBenchmark.py clusters --routes 20000 --routes 180000
+
+The locations command times MPLocations.fill_null_locations against filling
+in locations one route at a time, the way MPAnalyzer used to, against the
+routes database.  Both run inside a transaction that is rolled back, so
+nothing is changed.  The route at a time walk is only run on a sample of
+routes, and its time for every route is estimated from the sample:
+
+    python MPBenchmark.py locations --sample 200
+"""
+
+from MPRouteCrawler import MPScraper
+from MPTfidf import term_matrix
+from MPTfidf import tfidf_matrix
+from MPTfidf import tfidf_frame
+from MPTfidf import cosine_scores
+from MPClusters import cluster_locations
+from MPClusters import EPSILON
+from MPLocations import fill_null_locations
+from mpproj.routefinder.GradeParser import fill_grades
+from mpproj.routefinder.GradeParser import parse_grades
+from mpproj.routefinder.RouteRecord import RouteRecord
+from sklearn.preprocessing import StandardScaler
+from sklearn.cluster import DBSCAN
+from urllib.request import urlopen
+import tracemalloc
+import subprocess
+import psycopg2
+import pandas as pd
+import numpy as np
+import socket
+import click
+import json
+import time
+import sys
+import os
+import re
+
+
+SERVER = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                      'MPTestServer.py')
+
+# Every table the crawler creates
+TABLES = ['Areas', 'Routes', 'Words', 'TFIDF', 'Vocabulary',
+          'Frontier', 'DeadLetters', 'Workers', 'Sessions', 'Reanalysis']
+
+
+def start_server(port, options, timeout=30):
+    ''' Starts MPTestServer and waits until it accepts connections.
+
+    Args:
+        port(int): Port the server listens on
+        options(list): Command line options passed on to the server
+        timeout(float): Seconds to wait for the server
+
+    Returns:
+        process(Popen): The running server
+    '''
+
+    process = subprocess.Popen(
+        [sys.executable, SERVER, 'serve', '--port', str(port)] + options)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), 1).close()
+            return process
+        except OSError:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError('Test server did not start')
+
+
+def reset_database(params):
+    ''' Drops every crawler table so the crawl starts from scratch.
+
+    Args:
+        params(dict): Connection parameters for the benchmark database
+    '''
+
+    conn = psycopg2.connect(**params)
+    cursor = conn.cursor()
+    cursor.execute(f'DROP TABLE IF EXISTS {", ".join(TABLES)}')
+    conn.commit()
+    conn.close()
+
+
+def report(results):
+    ''' Prints the benchmark results.
+
+    Args:
+        results(dict): Results of the crawl
+    '''
+
+    fetch, write = results['fetch'], results['write']
+    print()
+    print(f"Crawl time:     {results['elapsed']:.1f}s")
+    print(f"Pages:          {fetch['requests']} "
+          f"({results['pages_per_sec']:.1f} pages/sec)")
+    print(f"Fetch latency:  p50 {fetch['p50_request_time'] * 1000:.0f}ms, "
+          f"p99 {fetch['p99_request_time'] * 1000:.0f}ms")
+    print(f"Parse time:     {fetch['avg_parse_time'] * 1000:.1f}ms per page")
+    print(f"DB writes:      {write['routes']} routes in {write['batches']} "
+          f"batches, {write['routes_per_sec']:.0f} routes/sec, "
+          f"{write['words_per_sec']:.0f} words/sec")
+    print(f"Server:         {results['server']}")
+
+
+@click.group()
+def cli():
+    pass
+
+
+@cli.command()
+@click.option('--section', default='benchmark',
+              help='Section of the config file for the benchmark database.')
+@click.option('--port', default=8765)
+@click.option('--regions', default=3, help='Number of regions.')
+@click.option('--branching', default=3, help='Sub-areas in each area.')
+@click.option('--depth', default=2, help='Levels of areas below a region.')
+@click.option('--routes', default=25, help='Routes in each bottom area.')
+@click.option('--archive', default=None,
+              help='Crawl pages recorded in this PageArchive instead.')
+@click.option('--latency', default=0.0,
+              help='Average seconds added to each response.')
+@click.option('--jitter', default=0.0,
+              help='Standard deviation of the added latency.')
+@click.option('--error-rate', default=0.0,
+              help='Share of requests answered with 503.')
+@click.option('--concurrency', default=16,
+              help='Maximum number of pages downloaded at once.')
+@click.option('--parse-workers', default=None, type=int,
+              help='Number of parser processes. Defaults to the CPU count.')
+@click.option('--output', default=None,
+              help='JSON file the results are saved to.')
+@click.option('--yes', is_flag=True,
+              help='Drop the crawler tables without asking.')
+def crawl(section, port, regions, branching, depth, routes, archive, latency,
+          jitter, error_rate, concurrency, parse_workers, output, yes):
+    ''' Crawls a local test server from scratch and reports throughput.'''
+
+    # Only needed to connect, so the helpers above can be imported without
+    # a local config
+    from config import config
+    params = config.config(section=section)
+    if not yes:
+        click.confirm(f'Drop every crawler table in {params.get("database")}?',
+                      abort=True)
+    reset_database(params)
+
+    options = [
+        '--regions', str(regions),
+        '--branching', str(branching),
+        '--depth', str(depth),
+        '--routes', str(routes),
+        '--latency', str(latency),
+        '--jitter', str(jitter),
+        '--error-rate', str(error_rate)]
+    if archive:
+        options += ['--archive', archive]
+    base_url = f'http://127.0.0.1:{port}'
+    server = start_server(port, options)
+    try:
+        start = time.perf_counter()
+        results = MPScraper(
+            concurrency=concurrency,
+            delay=0,
+            parse_workers=parse_workers,
+            archive=None,
+            cache=None,
+            base_url=base_url,
+            db_params=params)
+        results['elapsed'] = time.perf_counter() - start
+        with urlopen(base_url + '/_stats') as response:
+            results['server'] = json.load(response)
+    finally:
+        server.terminate()
+        server.wait()
+
+    results['pages_per_sec'] = (
+        results['fetch']['requests'] / results['elapsed'])
+    report(results)
+    if output:
+        with open(output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+
+# Grade headers in the common grading systems, used to time parse_grades
+SAMPLE_GRADES = [
+    '5.10a YDS 6a French 18 Ewbanks VI+ UIAA 19 ZA E1 5b British PG13',
+    'V3 YDS 6A Font',
+    '5.8 YDS 5b French 16 Ewbanks VI- UIAA 16 ZA HVS 4c British',
+    'WI4 M5 R',
+    'A2+ C1 5.9 YDS 5c French 17 Ewbanks VI UIAA 17 ZA HVS 5a British',
+    'Mod. Snow AI2 Easy 5th YDS',
+    '5.12b YDS 7b French 26 Ewbanks IX- UIAA 26 ZA E5 6a British X',
+    'V-easy YDS 3 Font',
+]
+
+# Conversions GradeParser looks up in the StyleInformation lists the analyzer
+# reads them with, rather than the crawler's own lists.  Those had lost a
+# comma between aid grades '1+' and '2', and stopped at mixed grade M11-12.
+CORRECTED_CONVERSIONS = ('aid_conv', 'mixed_conv')
+
+
+def same_grades(legacy, parsed):
+    ''' Checks that two sets of grades agree, apart from the corrected
+    conversions.
+
+    Args:
+        legacy(dict): Grades from legacy_grades
+        parsed(dict): Grades from parse_grades
+
+    Returns:
+        same(bool): True if every other grade and conversion is the same
+    '''
+
+    return ({key: value for key, value in legacy.items()
+             if key not in CORRECTED_CONVERSIONS}
+            == {key: value for key, value in parsed.items()
+                if key not in CORRECTED_CONVERSIONS})
+
+
+def legacy_grades(grades):
+    ''' Finds grades the way get_route_diff did before GradeParser, to time
+    parse_grades against.
+
+    The body is get_route_diff as it was, with its own patterns and grade
+    lists, apart from comparing rating names with == rather than is, and
+    catching only the errors a failed lookup raises.
+
+    Args:
+        grades(str): Text of the grade header of a route page
+
+    Returns:
+        difficulty(dict): Same as parse_grades
+    '''
+
+    # Returns 'V' followed by any combination of digits, the word 'easy',
+    # and the characters '-', and '+' if followed by whitespace and 'YDS'
+    hueco = re.findall(r'(V[\+\-\deasy]+)\s+YDS', grades)
+
+    # Returns any combination of digits, the letters 'A', 'B', and 'C',
+    # and the characters '-' and '+' if followed by whitespace and 'Font'.
+    # Returns only the letter/number rating
+    font = re.findall(r'([\d\-\+ABC]+)\s+Font', grades)
+
+    # Returns '5.' followed by any digits, the letters 'a' through 'd', and
+    # the characters '-' and '+' OR '3rd' OR 4th OR 'Easy 5th' if followed
+    # by whitespace and 'YDS'
+    yds = re.findall(r'(5\.[\d\+\-a-d/]+|3rd|4th|Easy 5th)\s+YDS', grades)
+
+    # Returns any digit followed by any combination of '-', '+', and the
+    # letters 'a' through 'd' if it is followed by whitespace and 'French'
+    french = re.findall(r'(\d[\-\+a-d]+)\s+French', grades)
+
+    # Returns any two consecutive digits if they are followed by whitespace
+    # and 'Ewbanks'
+    ewbanks = re.findall(r'(\d\d)\s+Ewbanks', grades)
+
+    # Returns any Roman Numeral using XVI and '-' and '+' if it is followed
+    # by whitespace and 'UIAA'
+    uiaa = re.findall(r'([XVI\+\-]+)\s+UIAA', grades)
+
+    # Returns any number if it is followed by whitespace and 'ZA'
+    za = re.findall(r'(\d+)\s+ZA', grades)
+
+    # Returns any combination of the letters 'MDVSHE' and any digit then a
+    # space, then any digit and the letters 'abc', if they are followed by
+    # whitespace and 'British'
+    brit = re.findall(r'([MDVSHE\d]+ [\dabc]+)\s+British', grades)
+
+    # Returns 'A' OR 'C' and any number or '-'
+    aid_rate = re.findall(r'[^\d](A[\d\+\-]+|C[\d\+\-]+)', grades)
+
+    # Returns 'M' followed by any number
+    mixed_rate = re.findall(r'(M[0-6\+\-]+)', grades)
+
+    # Returns X OR R OR PG13 as long as they aren't followed by UIAA
+    danger = re.findall(r'(X|R|PG13)(?![\s\+UIVX-]+)', grades)
+    if not danger:
+        danger = 0
+
+    # Returns any word if it is followed by 'Snow'
+    snow_rate = re.findall(r'([A-Za-z]+)\s+Snow', grades)
+
+    # Returns 'WI' or 'AI' followed by any number
+    ice_rate = re.findall(r'(AI[\d\+-]+|WI[\d\+-]+)', grades)
+
+    # Holds route difficulty information
+    difficulty = {
+        'hueco_rating': hueco,
+        'font_rating': font,
+        'yds_rating': yds, 'french_rating': french,
+        'ewbanks_rating': ewbanks, 'uiaa_rating': uiaa,
+        'za_rating': za, 'british_rating': brit,
+        'ice_rating': ice_rate, 'snow_rating': snow_rate,
+        'aid_rating': aid_rate, 'mixed_rating': mixed_rate,
+        'danger_rating': danger}
+
+    rope_conv = [
+        '3rd', '4th', 'Easy 5th', '5.0', '5.1', '5.2', '5.3', '5.4', '5.5',
+        '5.6', '5.7', '5.7+', '5.8-', '5.8', '5.8+', '5.9-', '5.9', '5.9+',
+        '5.10a', '5.10-', '5.10a/b', '5.10b', '5.10', '5.10b/c', '5.10c',
+        '5.10+', '5.10c/d', '5.10d', '5.11a', '5.11-', '5.11a/b', '5.11b',
+        '5.11', '5.11b/c', '5.11c', '5.11+', '5.11c/d', '5.11d', '5.12a',
+        '5.12-', '5.12a/b', '5.12b', '5.12', '5.12b/c', '5.12c', '5.12+',
+        '5.12c/d', '5.12d', '5.13a', '5.13-', '5.13a/b', '5.13b', '5.13',
+        '5.13b/c', '5.13c', '5.13+', '5.13c/d', '5.13d', '5.14a', '5.14-',
+        '5.14a/b', '5.14b', '5.14', '5.14b/c', '5.14c', '5.14+', '5.14c/d',
+        '5.14d', '5.15a', '5.15-', '5.15a/b', '5.15b', '5.15', '5.15c',
+        '5.15+', '5.15c/d', '5.15d']
+
+    boulder_conv = [
+        'V-easy', 'V0-', 'V0', 'V0+', 'V0-1', 'V1-', 'V1', 'V1+', 'V1-2',
+        'V2-', 'V2', 'V2+', 'V2-3', 'V3-', 'V3', 'V3+', 'V3-4', 'V4-',
+        'V4', 'V4+', 'V4-5', 'V5-', 'V5', 'V5+', 'V5-6', 'V6-', 'V6',
+        'V6+', 'V6-7', 'V7-', 'V7', 'V7+', 'V7-8', 'V8-', 'V8', 'V8+',
+        'V8-9', 'V9-', 'V9', 'V9+', 'V9-10', 'V10-', 'V10', 'V10+',
+        'V10-11', 'V11-', 'V11', 'V11+', 'V11-12', 'V12-', 'V12', 'V12+',
+        'V12-13', 'V13-', 'V13', 'V13+', 'V13-14', 'V14-', 'V14', 'V14+',
+        'V14-15', 'V15-', 'V15', 'V15+', 'V15-16', 'V16-', 'V16', 'V16+',
+        'V16-17', 'V17-', 'V17']
+
+    mixed_conv = [
+        'M0-', 'M0', 'M0+', 'M0-1', 'M1-', 'M1', 'M1+', 'M1-2', 'M2-',
+        'M2', 'M2+', 'M2-3', 'M3-', 'M3', 'M3+', 'M3-4', 'M4-', 'M4',
+        'M4+', 'M4-5', 'M5-', 'M5', 'M5+', 'M5-6', 'M6-', 'M6', 'M6+',
+        'M6-7', 'M7-', 'M7', 'M7+', 'M7-8', 'M8-', 'M8', 'M8+', 'M8-9',
+        'M9-', 'M9', 'M9+', 'M9-10', 'M10-', 'M10', 'M10+', 'M10-11',
+        'M11-', 'M11', 'M11+', 'M11-12']
+
+    aid_conv = [
+        '0', '0+', '1', '1+' '2', '2+', '3', '3+', '4', '4+', '5', '6']
+    
+    ice_conv = [
+        '1', '1+', '1-2', '2-', '2', '2+', '2-3', '3-', '3', '3+', '3-4',
+        '4-', '4','4+', '4-5', '5-', '5', '5+', '5-6', '6-', '6', '6+',
+        '6-7', '7', '7+', '7-8', '8']
+    
+    danger_conv = ['G', 'PG13', 'R', 'X']
+    snow_conv = ['Easy', 'Mod', 'Steep']
+
+    conversion = {
+        'boulder_conv': None,
+        'rope_conv': None,
+        'ice_conv': None,
+        'snow_conv': None,
+        'aid_conv': None,
+        'mixed_conv': None,
+        'danger_conv': 0}
+
+    # Converts [] to None and ['x'] to 'x'
+    for item in difficulty:
+        if not difficulty[item]:
+            difficulty[item] = None
+        else:
+            difficulty[item] = difficulty[item][0]
+            if item == 'yds_rating':
+                try:
+                    rope = rope_conv.index(difficulty[item])
+                    conversion['rope_conv'] = rope
+                except ValueError:
+                    conversion['rope_conv'] = -1
+            elif item == 'hueco_rating':
+                try:
+                    boulder = boulder_conv.index(difficulty[item])
+                    conversion['boulder_conv'] = boulder
+                except ValueError:
+                    conversion['boulder_conv'] = -1
+            elif item == 'ice_rating':
+                try:
+                    ice = ice_conv.index(difficulty[item].split('I')[1])
+                    conversion['ice_conv'] = ice
+                except (ValueError, IndexError):
+                    conversion['ice_conv'] = -1
+            elif item == 'snow_rating':
+                try:
+                    snow = snow_conv.index(difficulty[item])
+                    conversion['snow_conv'] = snow
+                except ValueError:
+                    conversion['snow_conv'] = -1
+            elif item == 'aid_rating':
+                try:
+                    aid = aid_conv.index(difficulty[item][1:])
+                    conversion['aid_conv'] = aid
+                except ValueError:
+                    conversion['aid_conv'] = -1
+            elif item == 'mixed_rating':
+                try:
+                    mixed = mixed_conv.index(difficulty[item])
+                    conversion['mixed_conv'] = mixed
+                except ValueError:
+                    conversion['mixed_conv'] = -1
+            elif item == 'danger_rating':
+                try:
+                    danger = danger_conv.index(difficulty[item])
+                    conversion['danger_conv'] = danger
+                except ValueError:
+                    conversion['danger_conv'] = -1
+    difficulty.update(conversion)
+
+    return difficulty
+
+
+@cli.command()
+@click.option('--repeat', default=20000,
+              help='Number of grade headers parsed by each method.')
+def grades(repeat):
+    ''' Times parse_grades against get_route_diff as it was.'''
+
+    samples = [SAMPLE_GRADES[i % len(SAMPLE_GRADES)] for i in range(repeat)]
+    for sample in SAMPLE_GRADES:
+        if not same_grades(legacy_grades(sample), parse_grades(sample)):
+            click.echo(f'Results differ for {sample!r}')
+            sys.exit(1)
+
+    rates = {}
+    for name, method in [('findall', legacy_grades),
+                         ('GradeParser', parse_grades)]:
+        start = time.perf_counter()
+        for sample in samples:
+            method(sample)
+        rates[name] = repeat / (time.perf_counter() - start)
+        click.echo(f'{name:<12}{rates[name]:>12,.0f} routes/sec')
+    click.echo(f'Speed-up: {rates["GradeParser"] / rates["findall"]:.1f}x')
+
+
+def sample_record(i):
+    ''' Builds a record like one parsed from a route page.
+
+    Args:
+        i(int): Number of the route
+
+    Returns:
+        record(RouteRecord): Record with every column filled in
+    '''
+
+    record = RouteRecord(f'https://www.mountainproject.com/route/{i}/route')
+    record.name = f'Route {i}'
+    record.stars = '3.4'
+    record.votes = str(i % 500)
+    record.latitude = 40.0 + i / 1e6
+    record.longitude = -105.0 - i / 1e6
+    record.area_id = i // 25
+    record.sport = True
+    record.pitches = 1
+    record.length = '90'
+    record.nccs_conv = 0
+    record.breadcrumbs = []
+    record.comments = 0
+    fill_grades(record, SAMPLE_GRADES[i % len(SAMPLE_GRADES)])
+    return record
+
+
+@cli.command()
+@click.option('--count', default=100000,
+              help='Number of routes held in memory.')
+def records(count):
+    ''' Measures the memory held by routes as records and as dictionaries.'''
+
+    sizes = {}
+    for name, build in [('dict', lambda i: sample_record(i).as_dict()),
+                        ('RouteRecord', sample_record)]:
+        tracemalloc.start()
+        routes = [build(i) for i in range(count)]
+        sizes[name] = tracemalloc.get_traced_memory()[0] / count
+        tracemalloc.stop()
+        del routes
+        click.echo(f'{name:<12}{sizes[name]:>10,.0f} bytes per route')
+    click.echo(f'Saving: {1 - sizes["RouteRecord"] / sizes["dict"]:.0%}')
+
+
+def legacy_tfidf(routes, num_docs, min_occur, max_occur):
+    ''' Finds normalized TFIDF with the groupby passes MPAnalyzer used to
+    make, to check tfidf_matrix against.
+
+    Args:
+        routes(pandas Dataframe): Index route_id and columns word_id and tf
+        num_docs(int): Number of routes in the corpus
+        min_occur(float): Words must be found in more than this many routes
+        max_occur(float): Words must be found in fewer than this many routes
+
+    Returns:
+        routes(pandas Dataframe): Index route_id and columns word_id, idf and
+            tfidfn
+    '''
+
+    def weed_out(table):
+        if min_occur < len(table) < max_occur:
+            return table.reset_index()
+
+    def idf(word):
+        word['idf'] = 1 + np.log(num_docs / len(word))
+        return word.reset_index()
+
+    def normalize(table):
+        length = np.sqrt(np.sum(table['tfidf'] ** 2))
+        table['tfidfn'] = table['tfidf'] / length
+        return table.reset_index()
+
+    # Grouped by the values of the column, so that pandas 3, which leaves
+    # grouping columns out of each group, still passes word_id on
+    routes = routes.groupby(routes['word_id'].values, group_keys=False)\
+                   .apply(weed_out).set_index('route_id')
+    routes = routes.groupby(routes['word_id'].values, group_keys=False)\
+                   .apply(idf).set_index('route_id')
+    routes['tfidf'] = routes['tf'] * routes['idf']
+    routes = routes.groupby(routes.index, group_keys=False).apply(normalize)
+    routes = routes.set_index('route_id')
+    return routes[['word_id', 'idf', 'tfidfn']]
+
+
+def sample_words(num_routes, vocabulary_size=5000, seed=0):
+    ''' Makes up a Words table with the long tail of real route text.
+
+    Args:
+        num_routes(int): Number of routes
+        vocabulary_size(int): Number of distinct words
+        seed(int): Seed for the random words
+
+    Returns:
+        words(pandas Dataframe): Columns route_id, word_id and tf, with a
+            row for each distinct word of each route
+    '''
+
+    rand = np.random.default_rng(seed)
+    lengths = rand.integers(5, 200, num_routes)
+    route_ids = np.repeat(np.arange(1, num_routes + 1), lengths)
+    word_ids = np.minimum(rand.zipf(1.3, lengths.sum()), vocabulary_size)
+    words = pd.DataFrame({'route_id': route_ids, 'word_id': word_ids})
+    counts = words.value_counts().rename('word_count').reset_index()
+    counts['tf'] = (counts['word_count']
+                    / counts['route_id'].map(pd.Series(
+                        lengths, index=np.arange(1, num_routes + 1))))
+    return counts[['route_id', 'word_id', 'tf']]
+
+
+@cli.command()
+@click.option('--routes', 'num_routes', default=20000,
+              help='Number of made-up routes.')
+@click.option('--min-occur', default=0.001,
+              help='Share of routes a word must be found in.')
+@click.option('--max-occur', default=0.9,
+              help='Share of routes a word must be found in fewer than.')
+def tfidf(num_routes, min_occur, max_occur):
+    ''' Checks the sparse TFIDF against the groupby passes and times both.'''
+
+    words = sample_words(num_routes)
+    min_occur *= num_routes
+    max_occur *= num_routes
+    click.echo(f'{len(words):,} words in {num_routes:,} routes')
+
+    start = time.perf_counter()
+    legacy = legacy_tfidf(words.set_index('route_id'), num_routes, min_occur,
+                          max_occur)
+    legacy_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    matrix, routes, vocabulary = term_matrix(
+        words['route_id'], words['word_id'], words['tf'])
+    tfidfn, idf = tfidf_matrix(matrix, num_routes, min_occur, max_occur)
+    result = tfidf_frame(tfidfn, idf, routes, vocabulary)
+    sparse_time = time.perf_counter() - start
+
+    both = legacy.reset_index().merge(
+        result.reset_index(), on=['route_id', 'word_id'], how='outer',
+        suffixes=('_legacy', '_sparse'))
+    difference = (both['tfidfn_legacy'] - both['tfidfn_sparse']).abs().max()
+    click.echo(f'groupby {legacy_time:>10.2f}s')
+    click.echo(f'sparse  {sparse_time:>10.2f}s')
+    click.echo(f'Speed-up: {legacy_time / sparse_time:.0f}x')
+    click.echo(f'Rows: {len(legacy):,} groupby, {len(result):,} sparse, '
+               f'largest difference {difference:.2e}')
+
+
+def legacy_cosine_scores(routes, archetypes):
+    ''' Finds cosine similarity one route at a time, the way MPAnalyzer used
+    to, to check cosine_scores against.
+
+    Args:
+        routes(pandas Series): Normalized TFIDF with index route_id and
+            word_id
+        archetypes(pandas Dataframe): Normalized TFIDF with index word_id and
+            a column for each style
+
+    Returns:
+        scores(pandas Dataframe): Index route_id and a column of cosine
+            similarity for each style
+    '''
+
+    def cosine_similarity(route):
+        rid = route.index[0][0]
+        route = archetypes.multiply(route, axis=0)
+        terrain = pd.DataFrame(index=[rid])
+        for column in route:
+            terrain[column] = np.sum(route[column])
+        return terrain
+
+    scores = routes.groupby('route_id').apply(cosine_similarity)
+    scores.index = scores.index.droplevel(1)
+    return scores
+
+
+def sample_archetypes(words, styles=('arete', 'chimney', 'crack', 'slab',
+                                     'overhang'), size=300, seed=0):
+    ''' Makes up archetypes from words of a made-up corpus.
+
+    Args:
+        words(array): Word ids to choose the archetype words from
+        styles(tuple): Name of each archetype
+        size(int): Number of words in each archetype
+        seed(int): Seed for the random words
+
+    Returns:
+        archetypes(pandas Dataframe): Normalized TFIDF with index word_id
+            and a column for each style
+    '''
+
+    rand = np.random.default_rng(seed)
+    archetypes = pd.concat(
+        [pd.Series(rand.random(size),
+                   index=rand.choice(np.unique(words), size, replace=False),
+                   name=style)
+         for style in styles], axis=1)
+    archetypes.index.name = 'word_id'
+    return archetypes / np.sqrt((archetypes ** 2).sum())
+
+
+@cli.command()
+@click.option('--routes', 'num_routes', default=20000,
+              help='Number of made-up routes.')
+def cosine(num_routes):
+    ''' Checks the matrix cosine similarity against scoring one route at a
+    time, and times both.'''
+
+    words = sample_words(num_routes)
+    matrix, routes, vocabulary = term_matrix(
+        words['route_id'], words['word_id'], words['tf'])
+    tfidfn, idf = tfidf_matrix(matrix, num_routes, 0, num_routes)
+    routes = tfidf_frame(tfidfn, idf, routes, vocabulary)
+    routes = routes.set_index('word_id', append=True)['tfidfn']
+    archetypes = sample_archetypes(words['word_id'])
+    click.echo(f'{len(routes):,} words in {num_routes:,} routes')
+
+    start = time.perf_counter()
+    legacy = legacy_cosine_scores(routes, archetypes)
+    legacy_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    scores = cosine_scores(routes, archetypes)
+    matrix_time = time.perf_counter() - start
+
+    difference = (legacy - scores.loc[legacy.index]).abs().max().max()
+    click.echo(f'per route {legacy_time:>10.2f}s')
+    click.echo(f'matrix    {matrix_time:>10.2f}s')
+    click.echo(f'Speed-up: {legacy_time / matrix_time:.0f}x')
+    click.echo(f'Largest difference {difference:.2e}')
+
+
+def legacy_clusters(latitudes, longitudes):
+    ''' Clusters standardized coordinates by brute force, the way MPAnalyzer
+    used to, to time cluster_locations against.
+
+    Args:
+        latitudes(array): Latitude of each route in degrees
+        longitudes(array): Longitude of each route in degrees
+
+    Returns:
+        labels(array): Cluster of each route, or -1
+    '''
+
+    locs = StandardScaler().fit_transform(
+        np.column_stack([latitudes, longitudes]))
+    return DBSCAN(eps=0.0007, min_samples=3).fit(locs).labels_
+
+
+def sample_routes(num_routes, seed=0):
+    ''' Makes up routes gathered into crags across North America.
+
+    Args:
+        num_routes(int): Number of routes
+        seed(int): Seed for the random locations
+
+    Returns:
+        latitudes(array): Latitude of each route
+        longitudes(array): Longitude of each route
+    '''
+
+    rand = np.random.default_rng(seed)
+    num_crags = max(num_routes // 40, 1)
+    crag_lats = rand.uniform(25, 60, num_crags)
+    crag_longs = rand.uniform(-125, -65, num_crags)
+    crags = rand.integers(0, num_crags, num_routes)
+    # Routes are spread over a few hundred metres of their crag, and some
+    # only have the coordinates of the crag itself
+    spread = rand.normal(0, 0.002, (num_routes, 2))
+    spread[rand.random(num_routes) < 0.3] = 0
+    return crag_lats[crags] + spread[:, 0], crag_longs[crags] + spread[:, 1]
+
+
+@cli.command()
+@click.option('--routes', 'sizes', default=[20000, 180000], multiple=True,
+              help='Number of made-up routes.  Can be given more than once.')
+@click.option('--epsilon', default=EPSILON,
+              help='Kilometres between routes in one cluster.')
+def clusters(sizes, epsilon):
+    ''' Times the haversine ball tree clustering against the standardized
+    brute force clustering.'''
+
+    click.echo(f'{"routes":>10}{"brute force":>14}{"ball tree":>12}'
+               f'{"clusters":>10}')
+    for num_routes in sizes:
+        latitudes, longitudes = sample_routes(num_routes)
+
+        start = time.perf_counter()
+        legacy_clusters(latitudes, longitudes)
+        legacy_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        labels, _ = cluster_locations(latitudes, longitudes, epsilon)
+        tree_time = time.perf_counter() - start
+
+        click.echo(f'{num_routes:>10,}{legacy_time:>13.2f}s'
+                   f'{tree_time:>11.2f}s{labels.max() + 1:>10,}')
+
+
+def legacy_fill_null_loc(cursor, limit):
+    ''' Fills in routes one at a time, walking up one area per query, the
+    way MPAnalyzer used to, to time fill_null_locations against.  Unlike
+    MPAnalyzer, it does not commit after each route.
+
+    Args:
+        cursor(psycopg2 cursor): Cursor on the routes database
+        limit(int): Number of routes to fill in
+
+    Returns:
+        num_routes(int): Number of routes filled in
+    '''
+
+    num_routes = 0
+    while num_routes < limit:
+        cursor.execute('''
+            SELECT route_id, area_id FROM Routes
+            WHERE latitude is Null OR longitude is Null
+            LIMIT 1''')
+        route = cursor.fetchone()
+        if route is None:
+            break
+        rid, fid = route
+        lat, long = None, None
+        while lat is None or long is None:
+            cursor.execute('''
+                SELECT latitude, longitude, from_id
+                FROM Areas
+                WHERE id = %s
+                LIMIT 1''', (fid,))
+            lat, long, fid = cursor.fetchone()
+        cursor.execute('''
+            UPDATE Routes
+            SET latitude = %s, longitude = %s
+            WHERE route_id = %s''', (lat, long, rid))
+        num_routes += 1
+    return num_routes
+
+
+@cli.command()
+@click.option('--section', default='postgresql',
+              help='Section of the config file for the routes database.')
+@click.option('--sample', default=200,
+              help='Number of routes filled in one at a time.')
+def locations(section, sample):
+    ''' Times filling in locations one route at a time and all at once.
+    Every change is rolled back.'''
+
+    from config import config
+    conn = psycopg2.connect(**config.config(section=section))
+    cursor = conn.cursor()
+    cursor.execute('''
+        SELECT COUNT(*) FROM Routes
+        WHERE latitude IS NULL OR longitude IS NULL''')
+    missing = cursor.fetchone()[0]
+    click.echo(f'{missing:,} routes without a location')
+
+    start = time.perf_counter()
+    num_routes = legacy_fill_null_loc(cursor, sample)
+    legacy_time = time.perf_counter() - start
+    conn.rollback()
+    # Estimated for every route from the routes filled in
+    legacy_time *= missing / max(num_routes, 1)
+
+    start = time.perf_counter()
+    num_routes = fill_null_locations(conn, commit=False)
+    bulk_time = time.perf_counter() - start
+    conn.rollback()
+
+    click.echo(f'one at a time {legacy_time:>10.2f}s (estimated)')
+    click.echo(f'set-based     {bulk_time:>10.2f}s '
+               f'({num_routes:,} routes filled in)')
+    click.echo(f'Speed-up: {legacy_time / bulk_time:.0f}x')
+    conn.close()
+
+
+if __name__ == '__main__':
+    cli()
@@ -0,0 +1,243 @@
+# -*- coding: utf-8 -*-
+"""
+Summary:
+HTTP validator cache for refreshing an existing crawl.
+
+Details:
+Most pages on Mountain Project do not change between two crawls.  The cache
+records the ETag and Last-Modified headers of every page that is downloaded,
+and the fetcher sends them back as If-None-Match and If-Modified-Since the
+next time the page is requested.  If the page has not changed, the server
+answers with 304 Not Modified and no body, and the page is neither parsed nor
+written again.
+
+A 304 only stands in for a page whose data is already saved, so validators
+are held in memory when a page is downloaded, and only stored once the
+crawler has parsed the page and written what was on it (see hold and keep).
+A page that fails to parse or write is downloaded in full next time.
+
+Validators are kept in the 'Validators' table of a SQLite file, which by
+default is the same file as the page archive:
+
+    url - URL on Mountain Project
+    etag - ETag header of the last download
+    last_modified - Last-Modified header of the last download
+    stored - Unix time the validators were saved
+    used - Unix time the validators were last sent
+
+Two eviction rules keep the cache from growing without bound:
+
+    max_entries - Once there are more entries than this, those that were
+        used longest ago are dropped
+    max_age - Entries older than this many seconds are not sent, so the page
+        is downloaded in full and its validators renewed
+
+The cache only stands in for pages that are already in the database, so it
+should be deleted if the database is rebuilt from scratch.
+"""
+
+import sqlite3
+import time
+
+
+class ValidatorCache:
+    ''' ETag and Last-Modified headers for every downloaded page.
+
+    Args:
+        path(str): Location of the SQLite file
+        max_entries(int): Optional. Maximum number of pages kept
+        max_age(float): Optional. Seconds before an entry is no longer used
+        commit_every(int): Number of changes between commits
+    '''
+
+    def __init__(self, path='pages.sqlite', max_entries=None, max_age=None,
+                 commit_every=100):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self.commit_every = commit_every
+        self.pending = 0
+        # Validators of downloaded pages that have not been written yet
+        self.held = {}
+        self.counters = {
+            'lookups': 0,
+            'conditional': 0,
+            'not_modified': 0,
+            'stored': 0,
+            'evicted': 0}
+        self.conn = sqlite3.connect(path, timeout=60)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS Validators(
+                url TEXT PRIMARY KEY,
+                etag TEXT,
+                last_modified TEXT,
+                stored REAL,
+                used REAL)''')
+        self.conn.execute('''
+            CREATE INDEX IF NOT EXISTS validators_used
+                ON Validators(used)''')
+        self.conn.commit()
+
+    def _changed(self):
+        ''' Commits once enough changes have been made.'''
+
+        self.pending += 1
+        if self.pending >= self.commit_every:
+            self.commit()
+
+    def headers(self, url):
+        ''' Builds the conditional request headers for a page.
+
+        Args:
+            url(str): URL about to be requested
+
+        Returns:
+            headers(dict): If-None-Match and If-Modified-Since headers, or an
+                empty dict if the page has no usable validators
+        '''
+
+        self.counters['lookups'] += 1
+        row = self.conn.execute('''
+            SELECT etag, last_modified, stored
+            FROM Validators
+            WHERE url = ?''', (url,)).fetchone()
+        if row is None:
+            return {}
+        etag, last_modified, stored = row
+        now = time.time()
+        if self.max_age is not None and now - stored > self.max_age:
+            return {}
+
+        headers = {}
+        if etag:
+            headers['If-None-Match'] = etag
+        if last_modified:
+            headers['If-Modified-Since'] = last_modified
+        if headers:
+            self.counters['conditional'] += 1
+            self.conn.execute(
+                'UPDATE Validators SET used = ? WHERE url = ?', (now, url))
+            self._changed()
+        return headers
+
+    def not_modified(self, url):
+        ''' Records that the server answered 304 Not Modified.
+
+        Args:
+            url(str): URL of the unchanged page
+        '''
+
+        self.counters['not_modified'] += 1
+
+    def hold(self, url, response_headers):
+        ''' Holds the validators of a downloaded page until it is written.
+
+        Args:
+            url(str): URL of the page
+            response_headers(Mapping): Headers of the response
+        '''
+
+        etag = response_headers.get('ETag')
+        last_modified = response_headers.get('Last-Modified')
+        if etag or last_modified:
+            self.held[url] = {'ETag': etag, 'Last-Modified': last_modified}
+
+    def keep(self, urls):
+        ''' Stores the held validators of pages once they are written.
+
+        Args:
+            urls(list): URLs of the written pages
+        '''
+
+        for url in urls:
+            response_headers = self.held.pop(url, None)
+            if response_headers is not None:
+                self.store(url, response_headers)
+
+    def drop(self, urls):
+        ''' Forgets the held validators of pages that were not written, so
+        they are downloaded in full next time.
+
+        Args:
+            urls(list): URLs of the pages
+        '''
+
+        for url in urls:
+            self.held.pop(url, None)
+
+    def store(self, url, response_headers):
+        ''' Saves the validators of a downloaded page.
+
+        Args:
+            url(str): URL of the page
+            response_headers(Mapping): Headers of the response
+        '''
+
+        etag = response_headers.get('ETag')
+        last_modified = response_headers.get('Last-Modified')
+        if not etag and not last_modified:
+            return
+        now = time.time()
+        self.conn.execute('''
+            INSERT OR REPLACE INTO Validators(
+                url, etag, last_modified, stored, used)
+            VALUES(?, ?, ?, ?, ?)''', (url, etag, last_modified, now, now))
+        self.counters['stored'] += 1
+        self._changed()
+
+    def forget(self, url):
+        ''' Drops the validators of a page, so it is downloaded in full.
+
+        Args:
+            url(str): URL of the page
+        '''
+
+        self.conn.execute('DELETE FROM Validators WHERE url = ?', (url,))
+        self._changed()
+
+    def evict(self):
+        ''' Drops the least recently used entries above max_entries.'''
+
+        if self.max_entries is None:
+            return
+        cursor = self.conn.execute('''
+            DELETE FROM Validators
+            WHERE url IN (
+                SELECT url
+                FROM Validators
+                ORDER BY used DESC
+                LIMIT -1 OFFSET ?)''', (self.max_entries,))
+        self.counters['evicted'] += cursor.rowcount
+
+    def hit_rate(self):
+        ''' Share of page requests that were answered with 304.
+
+        Returns:
+            hit_rate(float): Unchanged pages over all pages looked up
+        '''
+
+        return self.counters['not_modified'] / (self.counters['lookups'] or 1)
+
+    def report(self):
+        ''' Prints how many requests the cache has saved.'''
+
+        counters = self.counters
+        print(f"Cache: {counters['not_modified']} of "
+              f"{counters['lookups']} pages unchanged "
+              f"({self.hit_rate():.1%} hit rate), "
+              f"{counters['conditional']} conditional requests, "
+              f"{counters['evicted']} evicted")
+
+    def commit(self):
+        ''' Evicts old entries and saves every change.'''
+
+        self.evict()
+        self.conn.commit()
+        self.pending = 0
+
+    def close(self):
+        ''' Saves any remaining changes and closes the file.'''
+
+        self.commit()
+        self.conn.close()
@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+"""
+Summary:
+Groups routes into clusters that are close enough to travel between.
+
+Details:
+MPAnalyzer used to cluster routes by standardizing their latitude and
+longitude and running DBSCAN on them as flat coordinates.  Standardizing
+stretches the two axes differently, and a degree of longitude is much
+shorter near the poles than at the equator, so the same epsilon meant a
+different distance in every region.  The neighbors of each route were also
+found by brute force.
+
+Here routes are clustered by their great circle distance:
+
+    haversine - Distance between two points on a sphere, from their latitude
+        and longitude in radians.  Multiplied by the radius of the Earth, it
+        is in kilometres, so epsilon is a real distance, the same everywhere.
+    ball tree - Index of the locations that finds every location within
+        epsilon of a point without measuring the distance to every other
+        point.  It is one of the few indexes that work with the haversine
+        distance.
+
+Many routes share the coordinates of their area, either because they are
+listed that way or because MPLocations filled them in.  Each distinct
+location is clustered once, weighted by the number of routes there, which
+gives the same clusters as clustering every route.
+
+Routes are clustered one region at a time, since the routes of one region
+are never close enough to travel between with those of most others.  This
+keeps each clustering small.  It also means that when only some routes have
+changed, such as after MPRouteCrawler.whats_new, only the regions holding
+those routes need to be clustered again.  Clusters in the other regions
+keep their labels, and the new clusters are given labels after the highest
+label in use.  Either way, MPAnalyzer removes the clustered routes from the
+Reanalysis queue in the transaction that writes their clusters.
+
+See MPBenchmark for timing both ways of clustering.
+"""
+
+from sklearn.cluster import DBSCAN
+import pandas as pd
+import numpy as np
+import io
+
+
+# Mean radius of the Earth in kilometres
+EARTH_RADIUS = 6371.0088
+# Routes within this many kilometres of each other can be in one cluster
+EPSILON = 0.5
+# Minimum number of routes within epsilon of a route for it to start a
+# cluster
+MIN_ROUTES = 3
+
+
+def find_regions(parents):
+    ''' Finds the region at the top of the area tree above each area.
+
+    Args:
+        parents(dict): from_id of each area id, None for regions
+
+    Returns:
+        regions(dict): id of the region above each area, or of the highest
+            area that can be reached if its parent is missing
+    '''
+
+    regions = {}
+    for area_id in parents:
+        path = []
+        current = area_id
+        while current not in regions:
+            path.append(current)
+            # Marked as it is walked through, so a loop in the tree ends
+            regions[current] = current
+            parent = parents.get(current)
+            if parent is None or parent not in parents:
+                break
+            current = parent
+        region = regions[current]
+        for area in path:
+            regions[area] = region
+    return regions
+
+
+def cluster_locations(latitudes, longitudes, epsilon=EPSILON,
+                      min_routes=MIN_ROUTES):
+    ''' Clusters routes by the great circle distance between them.
+
+    Args:
+        latitudes(array): Latitude of each route in degrees
+        longitudes(array): Longitude of each route in degrees
+        epsilon(float): Routes within this many kilometres of each other can
+            be in one cluster
+        min_routes(int): Minimum number of routes within epsilon of a route
+            for it to start a cluster
+
+    Returns:
+        labels(array): Cluster of each route, numbered from 0, or -1 for
+            routes that are not in a cluster, including routes without a
+            location
+        counts(array): Number of routes in the cluster of each route, or 1
+            for routes that are not in a cluster
+    '''
+
+    coords = np.radians(np.column_stack([latitudes, longitudes]))
+    located = ~np.isnan(coords).any(axis=1)
+    labels = np.full(len(coords), -1)
+    if located.any():
+        # Each distinct location is clustered once, weighted by the number
+        # of routes there
+        locations, inverse, weights = np.unique(
+            coords[located], axis=0, return_inverse=True, return_counts=True)
+        scan = DBSCAN(eps=epsilon / EARTH_RADIUS, min_samples=min_routes,
+                      metric='haversine', algorithm='ball_tree')
+        scan.fit(locations, sample_weight=weights)
+        labels[located] = scan.labels_[inverse.ravel()]
+
+    # Shifted by one so that routes outside a cluster are counted at 0
+    counts = np.bincount(labels + 1)[labels + 1]
+    counts[labels < 0] = 1
+    return labels, counts
+
+
+def cluster_regions(routes, epsilon=EPSILON, min_routes=MIN_ROUTES,
+                    first_label=0):
+    ''' Clusters the routes of each region separately.
+
+    Args:
+        routes(pandas Dataframe): Index route_id and columns latitude,
+            longitude and region
+        epsilon(float): Routes within this many kilometres of each other can
+            be in one cluster
+        min_routes(int): Minimum number of routes within epsilon of a route
+            for it to start a cluster
+        first_label(int): Label of the first cluster.  Each region's
+            clusters are numbered after those of the region before it.
+
+    Returns:
+        clusters(pandas Dataframe): Index route_id and columns area_group,
+            the cluster of the route or -1, and area_counts, the number of
+            routes in its cluster
+    '''
+
+    labels = np.full(len(routes), -1)
+    counts = np.ones(len(routes), dtype=np.int64)
+    positions = routes.groupby('region', sort=False).indices
+    for region in positions.values():
+        region_labels, region_counts = cluster_locations(
+            routes['latitude'].values[region],
+            routes['longitude'].values[region], epsilon, min_routes)
+        clustered = region_labels >= 0
+        labels[region] = np.where(
+            clustered, region_labels + first_label, -1)
+        counts[region] = region_counts
+        if clustered.any():
+            first_label += region_labels.max() + 1
+    return pd.DataFrame({'area_group': labels, 'area_counts': counts},
+                        index=routes.index)
+
+
+def route_regions(conn, route_ids=None):
+    ''' Reads the location and region of routes.
+
+    Args:
+        conn(psycopg2 connection): Connection to the routes database
+        route_ids(list): Optional. Only routes in the regions of these
+            routes are read
+
+    Returns:
+        routes(pandas Dataframe): Index route_id and columns latitude,
+            longitude and region
+    '''
+
+    cursor = conn.cursor()
+    cursor.execute('SELECT id, from_id FROM Areas')
+    regions = find_regions(dict(cursor.fetchall()))
+    routes = pd.read_sql(
+        'SELECT route_id, latitude, longitude, area_id FROM Routes',
+        con=conn, index_col='route_id')
+    routes['region'] = routes['area_id'].map(regions)
+    if route_ids is not None:
+        changed = routes['region'].reindex(route_ids).dropna().unique()
+        routes = routes[routes['region'].isin(changed)]
+    return routes[['latitude', 'longitude', 'region']]
+
+
+def write_clusters(conn, clusters, commit=True):
+    ''' Writes the cluster of each route with one UPDATE.
+
+    Args:
+        conn(psycopg2 connection): Connection to the routes database
+        clusters(pandas Dataframe): Index route_id and columns area_group
+            and area_counts, from cluster_regions
+        commit(bool): Optional. Commits the clusters once they are written
+    '''
+
+    rows = io.StringIO()
+    clusters[['area_group', 'area_counts']].to_csv(rows, header=False)
+    rows.seek(0)
+
+    cursor = conn.cursor()
+    cursor.execute('''
+        CREATE TEMP TABLE RouteClusters(
+            route_id INTEGER PRIMARY KEY,
+            area_group INTEGER,
+            area_counts INTEGER)
+        ON COMMIT DROP''')
+    cursor.copy_expert(
+        'COPY RouteClusters(route_id, area_group, area_counts) '
+        'FROM STDIN WITH (FORMAT csv)', rows)
+    cursor.execute('''
+        UPDATE Routes
+        SET
+            area_group = RouteClusters.area_group,
+            area_counts = RouteClusters.area_counts
+        FROM RouteClusters
+        WHERE Routes.route_id = RouteClusters.route_id''')
+    if commit:
+        conn.commit()
@@ -0,0 +1,995 @@
+# -*- coding: utf-8 -*-
+"""
+Summary:
+Concurrent page fetching for the Mountain Project crawler.
+
+Details:
+Crawling every area and route on Mountain Project one page at a time means the
+crawl can never go faster than a single round-trip to the server.  This module
+runs many downloads at once using asyncio, while still being polite to the
+website.  Three things keep the crawl under control:
+
+    concurrency - The maximum number of pages being downloaded at any time
+    delay - The minimum number of seconds between two requests to the same
+        host.  If the host answers with 429 Too Many Requests or a server
+        error, requests to it are slowed further and then sped up again as
+        they succeed.  See AdaptiveRateLimiter.
+    queue_size - The maximum number of URLs waiting to be downloaded.  The
+        URLs are fed in as workers free up, so a very large list of routes
+        does not create a very large number of tasks.
+
+All requests share one HTTP session.  The session keeps a pool of open
+keep-alive connections, sized to the concurrency, so that the TCP and TLS
+handshakes are paid once per connection instead of once per page.  The
+session and its event loop stay open for the life of the fetcher, and must be
+closed with close() when the crawl is over.
+
+Downloaded pages are handed back one at a time to a handler function, which
+writes them to the database.  The handler always runs on the same thread, so
+it can safely share a database cursor.
+
+Parsing a page takes far longer than downloading it, so parsing can be moved
+off the event loop.  If the crawl is given a parse function, the workers put
+raw pages on a queue, and a set of parse tasks hand them to a pool of parser
+processes.  The handler then receives the parsed results instead of the HTML,
+and downloads carry on while pages are being parsed.  The parse function is
+sent to other processes, so it must be defined at the top level of a module.
+
+Pages that fail for a reason that may pass, such as a dropped connection,
+429 or a server error, are tried again after a random, growing wait (see
+RetryScheduler).  Other pages carry on downloading in the meantime.  Pages
+that still fail after every retry, or fail for a reason that will not pass,
+such as 404 Page Not Found, are passed to an on_error function rather than
+stopping the crawl.
+
+A crawl can also be given an extend function, which is run on each parsed
+page before it is handed back, by tasks of its own on the event loop.  It can
+download further pages that belong to the page, such as the later pages of a
+route's comments, while other pages carry on downloading.  stream downloads a
+page a piece at a time, so it can be read as it arrives without holding all
+of it.
+
+If the fetcher is given a PageArchive (see MPArchive), every downloaded page
+is also saved to disk so that it can be parsed again later without
+downloading it.
+
+If the fetcher is given a ValidatorCache (see MPCache), requests for pages
+that were downloaded before are sent with the page's ETag and Last-Modified
+headers.  Pages the server reports as unchanged are not parsed, and are
+passed to an on_unchanged function instead of the handler.  The validators
+of a page downloaded by a conditional request are held until the caller has
+written the page and keeps them, and are dropped if the page fails.
+"""
+
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
+from collections import deque
+import statistics
+import itertools
+import asyncio
+import aiohttp
+import random
+import heapq
+import time
+
+
+class FetchError(Exception):
+    ''' Raised when a page cannot be downloaded.
+
+    Args:
+        url(str): Page that failed
+        code(int): HTTP status code, or None if the server could not be
+            reached
+        reason(str): Description of the error
+        retry_after(float): Optional. Seconds the server asked to wait
+            before trying again
+    '''
+
+    def __init__(self, url, code=None, reason=None, retry_after=None):
+        super().__init__(f'{url}: {code or reason}')
+        self.url = url
+        self.code = code
+        self.reason = reason
+        self.retry_after = retry_after
+
+    @property
+    def transient(self):
+        ''' Whether the page may download if it is tried again later.
+
+        Returns:
+            transient(bool): True for connection errors, 429 Too Many
+                Requests and 5xx server errors
+        '''
+
+        return self.code is None or self.code == 429 or self.code >= 500
+
+
+class ParseError(Exception):
+    ''' Passed to on_error for a page that was downloaded but could not be
+    parsed.  Trying again will not help, since the page will not change.'''
+
+
+def retry_after(value):
+    ''' Reads the Retry-After header of a response.
+
+    Args:
+        value(str): Header value, either a number of seconds or an HTTP date
+
+    Returns:
+        seconds(float): Seconds to wait, or None if there is no usable value
+    '''
+
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(when.timestamp() - time.time(), 0.0)
+
+
+class TokenBucket:
+    ''' Request allowance for one host.
+
+    Args:
+        rate(float): Requests allowed per second, or inf for no limit
+        burst(float): Most requests that can be made at once after the host
+            has been idle
+    '''
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = asyncio.Lock()
+
+    def refill(self, now):
+        ''' Adds the tokens earned since the last refill.'''
+
+        if self.rate != float('inf'):
+            self.tokens = min(self.burst,
+                              self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+
+class AdaptiveRateLimiter:
+    ''' Token-bucket rate limiter that slows down when a host pushes back.
+
+    Each host gets its own bucket, which starts at one request per delay.  A
+    request takes one token, and tokens are added back at the current rate.
+    When the host answers with 429 Too Many Requests or a 5xx error, its rate
+    is cut by decrease and requests stop for as long as the server asked
+    with Retry-After.  Each successful request then raises the rate by
+    increase requests per second, until it is back to one request per delay.
+
+    Args:
+        delay(float): Minimum number of seconds between requests to a host.
+            With 0, hosts are not limited until they push back.
+        burst(float): Most requests that can be made at once after a host
+            has been idle
+        decrease(float): Share of the rate kept after the host pushes back
+        increase(float): Requests per second added back after each success
+        min_rate(float): Lowest rate a host is slowed to
+        start_rate(float): Rate an unlimited host is slowed to the first time
+            it pushes back
+    '''
+
+    def __init__(self, delay, burst=1, decrease=0.5, increase=0.1,
+                 min_rate=0.1, start_rate=10.0):
+        self.max_rate = 1 / delay if delay > 0 else float('inf')
+        self.burst = burst
+        self.decrease = decrease
+        self.increase = increase
+        self.min_rate = min_rate
+        self.start_rate = start_rate
+        self.buckets = {}
+        self.counters = {'throttled': 0}
+
+    def bucket(self, url):
+        ''' Finds the bucket of the host of a url.
+
+        Args:
+            url(str): URL on the host
+
+        Returns:
+            bucket(TokenBucket): Allowance of the host
+        '''
+
+        host = urlparse(url).netloc
+        bucket = self.buckets.get(host)
+        if bucket is None:
+            bucket = self.buckets[host] = TokenBucket(self.max_rate,
+                                                      self.burst)
+        return bucket
+
+    async def wait(self, url):
+        ''' Waits until a request to the host of the url is allowed.
+
+        Args:
+            url(str): URL about to be requested
+        '''
+
+        bucket = self.bucket(url)
+        # Requests to one host are let through in the order they arrive
+        async with bucket.lock:
+            while True:
+                now = time.monotonic()
+                if bucket.paused_until > now:
+                    await asyncio.sleep(bucket.paused_until - now)
+                    continue
+                bucket.refill(now)
+                # Unlimited hosts do not spend tokens, so no debt builds up
+                # to be paid off once the host pushes back
+                if bucket.rate == float('inf'):
+                    return
+                if bucket.tokens >= 1:
+                    bucket.tokens -= 1
+                    return
+                await asyncio.sleep((1 - bucket.tokens) / bucket.rate)
+
+    def throttle(self, url, wait=None):
+        ''' Slows down requests to a host that pushed back.
+
+        Args:
+            url(str): URL that was answered with 429 or a 5xx error
+            wait(float): Optional. Seconds the server asked to wait
+        '''
+
+        bucket = self.bucket(url)
+        self.counters['throttled'] += 1
+        if bucket.rate == float('inf'):
+            bucket.rate = self.start_rate
+        else:
+            bucket.rate = max(self.min_rate, bucket.rate * self.decrease)
+        # Tokens saved up before the host pushed back are not spent, so the
+        # next request waits one request at the new rate
+        bucket.tokens = 0.0
+        if wait:
+            bucket.paused_until = max(bucket.paused_until,
+                                      time.monotonic() + wait)
+
+    def success(self, url):
+        ''' Speeds up requests to a host again after a successful request.
+
+        Args:
+            url(str): URL that was downloaded
+        '''
+
+        bucket = self.bucket(url)
+        if bucket.rate < self.max_rate:
+            bucket.rate = min(self.max_rate, bucket.rate + self.increase)
+
+    def rates(self):
+        ''' Current rate for each host.
+
+        Returns:
+            rates(dict): Requests per second allowed, keyed by host
+        '''
+
+        # Copied first, since metrics are read from another thread
+        return {host: bucket.rate
+                for host, bucket in list(self.buckets.items())}
+
+
+class RetryScheduler:
+    ''' Decides when pages that failed for a passing reason are tried again.
+
+    Each failure of a page doubles the longest wait before it is tried
+    again, up to max_backoff.  The actual wait is picked at random between
+    zero and that longest wait, so pages that failed together are not all
+    tried again together.  If the server gave a Retry-After time, the page
+    waits at least that long.
+
+    Pages that are waiting are held in a heap ordered by the time they are
+    due, so the crawl can carry on with other pages in the meantime.
+
+    Args:
+        retries(int): Number of times a page is tried again
+        backoff(float): Longest wait in seconds after the first failure
+        max_backoff(float): Longest wait in seconds after any failure
+    '''
+
+    def __init__(self, retries=3, backoff=1.0, max_backoff=60.0):
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.attempts = {}
+        self.waiting = []
+        self.order = itertools.count()
+
+    def __len__(self):
+        return len(self.waiting)
+
+    def delay(self, url, error):
+        ''' Records a failure and finds how long to wait before trying again.
+
+        Args:
+            url(str): Page that failed
+            error(FetchError): Why the page failed
+
+        Returns:
+            delay(float): Seconds to wait, or None if the page should not be
+                tried again
+        '''
+
+        attempt = self.attempts.get(url, 0)
+        if not error.transient or attempt >= self.retries:
+            self.attempts.pop(url, None)
+            return None
+        self.attempts[url] = attempt + 1
+        delay = random.uniform(
+            0, min(self.max_backoff, self.backoff * 2 ** attempt))
+        if error.retry_after is not None:
+            delay = max(delay, error.retry_after)
+        return delay
+
+    def schedule(self, url, error):
+        ''' Holds a failed page until it is due to be tried again.
+
+        Args:
+            url(str): Page that failed
+            error(FetchError): Why the page failed
+
+        Returns:
+            scheduled(bool): False if the page has run out of retries or the
+                error will not go away
+        '''
+
+        delay = self.delay(url, error)
+        if delay is None:
+            return False
+        heapq.heappush(self.waiting,
+                       (time.monotonic() + delay, next(self.order), url))
+        return True
+
+    def done(self, url):
+        ''' Forgets the failures of a page that has been downloaded.
+
+        Args:
+            url(str): Page that was downloaded
+        '''
+
+        self.attempts.pop(url, None)
+
+    def due(self):
+        ''' Takes every page that is due to be tried again.
+
+        Returns:
+            urls(list): Pages to download again
+        '''
+
+        now = time.monotonic()
+        urls = []
+        while self.waiting and self.waiting[0][0] <= now:
+            urls.append(heapq.heappop(self.waiting)[2])
+        return urls
+
+    def wait_time(self):
+        ''' Seconds until the next page is due.
+
+        Returns:
+            wait_time(float): Seconds to wait, or None if no page is waiting
+        '''
+
+        if not self.waiting:
+            return None
+        return max(self.waiting[0][0] - time.monotonic(), 0.0)
+
+
+def timed_parse(parse, url, html):
+    ''' Parses a page and times the parse, in the process that parses it.
+
+    The time does not include the wait for a free process, so it measures
+    the parse stage alone.
+
+    Args:
+        parse(fn): Called with (url, html)
+        url(str): URL of the page
+        html(bytes): Raw page HTML
+
+    Returns:
+        result: Result of parse
+        parse_time(float): Seconds spent parsing
+    '''
+
+    start = time.perf_counter()
+    result = parse(url, html)
+    return result, time.perf_counter() - start
+
+
+class AsyncFetcher:
+    ''' Downloads many pages at once and passes them on to be parsed.
+
+    Args:
+        ctx(SSLContext): SSL context used for every connection
+        concurrency(int): Maximum number of downloads running at once.  This
+            is also the size of the connection pool.
+        delay(float): Minimum number of seconds between requests to one host
+        retries(int): Number of times a page that failed for a passing
+            reason is tried again
+        backoff(float): Longest wait in seconds before the first retry
+        max_backoff(float): Longest wait in seconds before any retry
+        queue_size(int): Maximum number of URLs waiting to be downloaded
+        timeout(float): Seconds before a download is abandoned
+        keepalive(float): Seconds an idle connection is kept open
+        parse_pool(Executor): Optional. Pool of processes that pages are
+            parsed in.  Without a pool, pages are parsed on the event loop.
+        parse_workers(int): Number of processes in parse_pool
+        archive(PageArchive): Optional. Archive that every downloaded page is
+            stored in
+        cache(ValidatorCache): Optional. Validators sent with conditional
+            requests
+    '''
+
+    def __init__(self, ctx, concurrency=16, delay=0.1, retries=3, backoff=1.0,
+                 max_backoff=60.0, queue_size=64, timeout=30, keepalive=30,
+                 parse_pool=None, parse_workers=1, archive=None, cache=None):
+        self.ctx = ctx
+        self.concurrency = concurrency
+        self.queue_size = queue_size
+        self.parse_pool = parse_pool
+        self.parse_workers = parse_workers
+        self.archive = archive
+        self.cache = cache
+        self.timeout = timeout
+        self.keepalive = keepalive
+        self.limiter = AdaptiveRateLimiter(delay)
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        # The session and its connections live on this loop, so the same loop
+        # is used for every crawl
+        self.loop = asyncio.new_event_loop()
+        self.session = None
+        # Per-request timing counters
+        self.counters = {
+            'requests': 0,
+            'bytes': 0,
+            'connections_opened': 0,
+            'connections_reused': 0,
+            'connect_time': 0.0,
+            'request_time': 0.0,
+            'parsed': 0,
+            'parse_time': 0.0,
+            'retries': 0,
+            'failed': 0,
+            'extended': 0,
+            'extend_failed': 0,
+            'extend_time': 0.0}
+        # Durations of the most recent requests, for latency percentiles
+        self.latencies = deque(maxlen=100000)
+        # Size of each queue of the running crawl, for metrics
+        self.queue_sizes = {}
+
+    def _trace_config(self):
+        ''' Hooks into the session to time requests and new connections.
+
+        Returns:
+            trace_config(aiohttp TraceConfig): Callbacks that update counters
+        '''
+
+        counters = self.counters
+        latencies = self.latencies
+
+        async def on_request_start(session, context, params):
+            context.request_start = time.perf_counter()
+
+        async def on_request_end(session, context, params):
+            duration = time.perf_counter() - context.request_start
+            counters['requests'] += 1
+            counters['request_time'] += duration
+            latencies.append(duration)
+
+        async def on_connection_create_start(session, context, params):
+            context.connect_start = time.perf_counter()
+
+        # Includes the TCP and TLS handshakes
+        async def on_connection_create_end(session, context, params):
+            counters['connections_opened'] += 1
+            counters['connect_time'] += (
+                time.perf_counter() - context.connect_start)
+
+        async def on_connection_reuseconn(session, context, params):
+            counters['connections_reused'] += 1
+
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_request_start.append(on_request_start)
+        trace_config.on_request_end.append(on_request_end)
+        trace_config.on_connection_create_start.append(
+            on_connection_create_start)
+        trace_config.on_connection_create_end.append(
+            on_connection_create_end)
+        trace_config.on_connection_reuseconn.append(on_connection_reuseconn)
+        return trace_config
+
+    async def _open(self):
+        ''' Creates the shared session and its connection pool.'''
+
+        if self.session is None:
+            connector = aiohttp.TCPConnector(
+                limit=self.concurrency,
+                limit_per_host=self.concurrency,
+                keepalive_timeout=self.keepalive,
+                ssl=self.ctx)
+            self.session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+                trace_configs=[self._trace_config()])
+
+    def _check(self, url, response):
+        ''' Slows the host down if it pushed back, or speeds it up again if
+        the page downloaded.
+
+        Args:
+            url(str): Page that was requested
+            response(aiohttp ClientResponse): Response to the request
+
+        Raises:
+            FetchError: If the response is not 200 OK
+        '''
+
+        if response.status == 429 or response.status >= 500:
+            wait = retry_after(response.headers.get('Retry-After'))
+            self.limiter.throttle(url, wait)
+            raise FetchError(url, code=response.status, retry_after=wait)
+        if response.status != 200:
+            raise FetchError(url, code=response.status)
+        self.limiter.success(url)
+
+    async def fetch(self, url, conditional=True):
+        ''' Downloads a single page once the host allows it.
+
+        The rate limiter is slowed down if the server pushes back, and sped
+        up again if the page downloads.
+
+        Args:
+            url(str): Page to download
+            conditional(bool): Optional. Send the cached validators of the
+                page, if there are any.  The validators of the response are
+                held in the cache until they are kept or dropped.
+
+        Returns:
+            html(bytes): Raw page HTML, or None if the server reported that
+                the page has not changed
+
+        Raises:
+            FetchError: If the page could not be downloaded
+        '''
+
+        await self._open()
+        headers = {}
+        if conditional and self.cache is not None:
+            headers = self.cache.headers(url)
+        await self.limiter.wait(url)
+        try:
+            async with self.session.get(url, headers=headers) as response:
+                if response.status == 304 and headers:
+                    self.limiter.success(url)
+                    self.cache.not_modified(url)
+                    return None
+                self._check(url, response)
+                html = await response.read()
+                # Stored by the caller once the page has been written
+                if conditional and self.cache is not None:
+                    self.cache.hold(url, response.headers)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as error:
+            raise FetchError(url, reason=repr(error))
+        self.counters['bytes'] += len(html)
+        if self.archive is not None:
+            self.archive.store(url, html)
+        return html
+
+    async def stream(self, url, chunk_size=16384):
+        ''' Downloads a page a piece at a time, once the host allows it.
+
+        The page is not cached, archived or retried.
+
+        Args:
+            url(str): Page to download
+            chunk_size(int): Largest piece of the page to pass on at once
+
+        Yields:
+            chunk(bytes): The next piece of the page, as it arrives
+
+        Raises:
+            FetchError: If the page could not be downloaded
+        '''
+
+        await self._open()
+        await self.limiter.wait(url)
+        try:
+            async with self.session.get(url) as response:
+                self._check(url, response)
+                async for chunk in response.content.iter_chunked(chunk_size):
+                    self.counters['bytes'] += len(chunk)
+                    yield chunk
+        except (aiohttp.ClientError, asyncio.TimeoutError) as error:
+            raise FetchError(url, reason=repr(error))
+
+    async def _get(self, url, conditional):
+        ''' Downloads a single page, retrying passing failures.
+
+        Args:
+            url(str): Page to download
+            conditional(bool): Send the cached validators of the page
+
+        Returns:
+            html(bytes): Raw page HTML, or None if the page has not changed
+        '''
+
+        retries = RetryScheduler(self.retries, self.backoff, self.max_backoff)
+        while True:
+            try:
+                return await self.fetch(url, conditional)
+            except FetchError as error:
+                delay = retries.delay(url, error)
+                if delay is None:
+                    self.counters['failed'] += 1
+                    raise
+                self.counters['retries'] += 1
+                await asyncio.sleep(delay)
+
+    def get(self, url, conditional=True):
+        ''' Downloads a single page outside of a crawl.
+
+        Pages that fail for a passing reason are tried again after a backoff.
+
+        Args:
+            url(str): Page to download
+            conditional(bool): Optional. Send the cached validators of the
+                page, if there are any
+
+        Returns:
+            html(bytes): Raw page HTML, or None if the page has not changed
+
+        Raises:
+            FetchError: If the page could not be downloaded
+        '''
+
+        return self.loop.run_until_complete(self._get(url, conditional))
+
+    async def _worker(self, queue, results, retries, conditional):
+        ''' Downloads URLs from the queue until it receives None.
+
+        Args:
+            queue(asyncio.Queue): URLs waiting to be downloaded
+            results(asyncio.Queue): Finished downloads as (url, html, error).
+                The html is None for unchanged pages.
+            retries(RetryScheduler): Holds pages that failed for a passing
+                reason until they are due to be tried again
+            conditional(bool): Send the cached validators of each page
+        '''
+
+        while True:
+            url = await queue.get()
+            if url is None:
+                queue.task_done()
+                return
+            try:
+                html = await self.fetch(url, conditional)
+                retries.done(url)
+                await results.put((url, html, None))
+            except FetchError as error:
+                # The page is put back on the queue once its wait is over
+                if retries.schedule(url, error):
+                    self.counters['retries'] += 1
+                # Errors are returned to the caller rather than stopping the
+                # crawl
+                else:
+                    self.counters['failed'] += 1
+                    await results.put((url, None, error.code or error.reason))
+            # Anything else, such as a failure to save the page to the
+            # archive or cache, fails the page rather than the worker.  A
+            # worker that stopped would leave the crawl waiting forever for
+            # the queue to empty.
+            except Exception as error:
+                retries.done(url)
+                self.counters['failed'] += 1
+                await results.put((url, None, repr(error)))
+            finally:
+                queue.task_done()
+
+    async def _parser(self, pages, results, parse):
+        ''' Parses pages from the queue until it receives None.
+
+        Args:
+            pages(asyncio.Queue): Downloaded pages as (url, html, error)
+            results(asyncio.Queue): Parsed pages as (url, result, error)
+            parse(fn): Called with (url, html) in the parse pool
+        '''
+
+        loop = asyncio.get_running_loop()
+        while True:
+            item = await pages.get()
+            if item is None:
+                return
+            url, html, error = item
+            # Unchanged pages are passed on without being parsed
+            if error is None and html is not None:
+                try:
+                    html, parse_time = await loop.run_in_executor(
+                        self.parse_pool, timed_parse, parse, url, html)
+                    self.counters['parsed'] += 1
+                    self.counters['parse_time'] += parse_time
+                # A page that cannot be parsed is treated as a failed page
+                except Exception as parse_error:
+                    html, error = None, ParseError(repr(parse_error))
+            await results.put((url, html, error))
+
+    async def _extender(self, pages, results, extend):
+        ''' Extends parsed pages from the queue until it receives None.
+
+        Args:
+            pages(asyncio.Queue): Parsed pages as (url, result, error)
+            results(asyncio.Queue): Extended pages as (url, result, error)
+            extend(fn): Coroutine function called with (url, result)
+        '''
+
+        while True:
+            item = await pages.get()
+            if item is None:
+                return
+            url, result, error = item
+            if error is None and result is not None:
+                start = time.perf_counter()
+                try:
+                    result = await extend(url, result)
+                # Extending only adds to a page, so the page is passed on as
+                # it was parsed
+                except Exception as extend_error:
+                    self.counters['extend_failed'] += 1
+                    print(f'    Could not extend {url}: {extend_error!r}')
+                self.counters['extended'] += 1
+                self.counters['extend_time'] += time.perf_counter() - start
+            await results.put((url, result, error))
+
+    async def _crawl(self, urls, handler, on_error, parse, on_unchanged,
+                     conditional, extend=None):
+        ''' Feeds URLs to the workers and passes results to the handler.
+
+        Args:
+            urls(iterable): URLs to download
+            handler(fn): Called with (url, html) for each downloaded page, or
+                (url, result) if the pages are parsed
+            on_error(fn): Called with (url, error) for each failed page
+            parse(fn): Called with (url, html) for each downloaded page, or
+                None to pass on the raw HTML
+            on_unchanged(fn): Called with (url) for each unchanged page
+            conditional(bool): Send the cached validators of each page
+            extend(fn): Optional. Coroutine function called with
+                (url, result) for each page, returning the result to pass on
+        '''
+
+        await self._open()
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        results = asyncio.Queue(maxsize=self.queue_size)
+        retries = RetryScheduler(self.retries, self.backoff, self.max_backoff)
+        if extend is None:
+            extended = results
+            extenders = []
+        else:
+            extended = asyncio.Queue(maxsize=self.queue_size)
+            # Extending mostly waits on downloads, which are limited by the
+            # connection pool
+            extenders = [
+                asyncio.create_task(
+                    self._extender(extended, results, extend))
+                for _ in range(self.concurrency)]
+        if parse is None:
+            pages = extended
+            parsers = []
+        else:
+            pages = asyncio.Queue(maxsize=self.queue_size)
+            # Two tasks per process keep every process busy while results
+            # are being passed back
+            parsers = [
+                asyncio.create_task(self._parser(pages, extended, parse))
+                for _ in range(2 * self.parse_workers)]
+        workers = [
+            asyncio.create_task(
+                self._worker(queue, pages, retries, conditional))
+            for _ in range(self.concurrency)]
+        self.queue_sizes = {
+            'download': queue.qsize,
+            'retry': retries.__len__,
+            'handle': results.qsize}
+        if parsers:
+            self.queue_sizes['parse'] = pages.qsize
+        if extenders:
+            self.queue_sizes['extend'] = extended.qsize
+
+        async def produce():
+            # Blocks whenever the queue is full, bounding the number of URLs
+            # in flight.  Pages due to be retried go ahead of new pages.
+            for url in urls:
+                for retry_url in retries.due():
+                    await queue.put(retry_url)
+                await queue.put(url)
+            # Keeps feeding in retries until every page has been downloaded
+            # or has run out of retries
+            while True:
+                for retry_url in retries.due():
+                    await queue.put(retry_url)
+                joined = asyncio.ensure_future(queue.join())
+                done, _ = await asyncio.wait(
+                    [joined], timeout=retries.wait_time())
+                if not done:
+                    joined.cancel()
+                    continue
+                if not retries:
+                    break
+                # Nothing is downloading, so waits for the next retry
+                await asyncio.sleep(retries.wait_time())
+            for _ in workers:
+                await queue.put(None)
+
+        async def finish():
+            # Each stage is told to stop once the stage before it is done
+            await asyncio.gather(*workers)
+            for _ in parsers:
+                await pages.put(None)
+            await asyncio.gather(*parsers)
+            for _ in extenders:
+                await extended.put(None)
+            await asyncio.gather(*extenders)
+            await results.put(None)
+
+        tasks = [asyncio.create_task(produce()),
+                 asyncio.create_task(finish())]
+
+        # Handles results as they arrive until every stage has finished
+        try:
+            while True:
+                item = await results.get()
+                if item is None:
+                    break
+                url, html, error = item
+                if error is None and html is None:
+                    if on_unchanged is not None:
+                        on_unchanged(url)
+                elif error is None:
+                    handler(url, html)
+                else:
+                    self.drop([url])
+                    if on_error is not None:
+                        on_error(url, error)
+            await asyncio.gather(*tasks)
+        finally:
+            # Stops the other stages if the handler raised an error
+            for task in tasks + workers + parsers + extenders:
+                task.cancel()
+            self.queue_sizes = {}
+
+    def crawl(self, urls, handler, on_error=None, parse=None,
+              on_unchanged=None, conditional=True, extend=None):
+        ''' Downloads every URL concurrently and hands each page to handler.
+
+        Args:
+            urls(iterable): URLs to download
+            handler(fn): Called with (url, html) for each downloaded page, or
+                with (url, result) if parse is given
+            on_error(fn): Optional. Called with (url, error) for each page
+                that could not be downloaded or parsed, once it has run out
+                of retries.  The error is the HTTP status code for HTTP
+                errors, a ParseError for pages that could not be parsed, and
+                a description otherwise.
+            parse(fn): Optional. Called with (url, html) for each downloaded
+                page, in the parse pool if there is one.  Must be picklable.
+            on_unchanged(fn): Optional. Called with (url) for each page the
+                server reported as unchanged since it was last downloaded
+            conditional(bool): Optional. Send the cached validators of each
+                page.  With False, every page is downloaded in full.
+            extend(fn): Optional. Coroutine function called with
+                (url, result) for each page that was downloaded, and parsed
+                if parse is given, which returns the result to pass to
+                handler.  If it raises an error, the page is passed to
+                handler as it was before it was extended.
+        '''
+
+        self.loop.run_until_complete(
+            self._crawl(urls, handler, on_error, parse, on_unchanged,
+                        conditional, extend))
+
+    def stats(self):
+        ''' Summarizes the timing counters.
+
+        Returns:
+            stats(dict): Raw counters, plus the average time per request and
+                per new connection, per parsed page and per extended page,
+                the 50th and 99th percentile request times, the share of
+                requests that reused an open connection, and the number of
+                times a host pushed back.
+        '''
+
+        stats = dict(self.counters)
+        stats['throttled'] = self.limiter.counters['throttled']
+        requests = stats['requests'] or 1
+        opened = stats['connections_opened'] or 1
+        reused = stats['connections_reused']
+        stats['avg_request_time'] = stats['request_time'] / requests
+        stats['avg_connect_time'] = stats['connect_time'] / opened
+        stats['avg_parse_time'] = stats['parse_time'] / (stats['parsed'] or 1)
+        stats['avg_extend_time'] = (stats['extend_time']
+                                    / (stats['extended'] or 1))
+        stats['p50_request_time'] = stats['p99_request_time'] = 0.0
+        # Copied first, since metrics are read from another thread
+        latencies = list(self.latencies)
+        if len(latencies) > 1:
+            cuts = statistics.quantiles(latencies, n=100)
+            stats['p50_request_time'] = cuts[49]
+            stats['p99_request_time'] = cuts[98]
+        stats['reuse_rate'] = reused / (reused + stats['connections_opened']
+                                        or 1)
+        return stats
+
+    def queue_depths(self):
+        ''' Counts the pages waiting at each stage of the running crawl.
+
+        Returns:
+            depths(dict): Pages waiting to be downloaded, retried, parsed,
+                extended and handled, or an empty dict between crawls
+        '''
+
+        return {name: size() for name, size in list(self.queue_sizes.items())}
+
+    def report(self):
+        ''' Prints a short summary of connection reuse and timing.'''
+
+        stats = self.stats()
+        print(f"{stats['requests']} requests, "
+              f"{stats['connections_opened']} new connections, "
+              f"{stats['reuse_rate']:.1%} reused")
+        print(f"    Handshake time: {stats['connect_time']:.1f}s total, "
+              f"{stats['avg_connect_time'] * 1000:.0f}ms per connection")
+        print(f"    Request time: {stats['avg_request_time'] * 1000:.0f}ms "
+              f"per request")
+        if stats['parsed']:
+            print(f"    Parse time: {stats['avg_parse_time'] * 1000:.0f}ms "
+                  f"per page")
+        if stats['extended']:
+            print(f"    Extend time: "
+                  f"{stats['avg_extend_time'] * 1000:.0f}ms per page")
+        if stats['retries'] or stats['failed']:
+            print(f"    {stats['retries']} retries, {stats['failed']} pages "
+                  f"failed, slowed down {stats['throttled']} times")
+        if self.cache is not None:
+            self.cache.report()
+
+    def keep(self, urls):
+        ''' Stores the validators of pages once they have been written, so
+        they are requested conditionally next time.
+
+        Args:
+            urls(list): URLs of the written pages
+        '''
+
+        if self.cache is not None:
+            self.cache.keep(urls)
+
+    def drop(self, urls):
+        ''' Forgets the validators of pages that were not written.
+
+        Args:
+            urls(list): URLs of the pages
+        '''
+
+        if self.cache is not None:
+            self.cache.drop(urls)
+
+    def close(self):
+        ''' Closes the pooled connections and the event loop.'''
+
+        if self.session is not None:
+            self.loop.run_until_complete(self.session.close())
+            self.session = None
+        self.loop.close()
+        if self.archive is not None:
+            self.archive.commit()
+        if self.cache is not None:
+            self.cache.commit()
@@ -0,0 +1,909 @@
+# -*- coding: utf-8 -*-
+"""
+Summary:
+Crawl frontier shared by every crawler process.
+
+Details:
+The frontier is the list of every area and route page that still has to be
+crawled.  Each page is one row in the 'Frontier' table:
+
+    id - a unique identifier for the page
+    url - URL on Mountain Project
+    kind - 'area' or 'route'
+    area_id - for areas, the id of the area in the Areas table.  For routes,
+        the id of the parent area
+    status - 'pending' until a worker claims it, 'leased' while a worker is
+        crawling it, then 'done' or 'error'
+    priority - pages with a higher priority are claimed first.  Set by
+        prioritize, and passed down from an area to the pages found on it.
+    attempts - number of times the page has been claimed
+    leased_until - time at which a lease runs out.  If a worker crashes, its
+        pages become available again once their leases have expired
+    error - HTTP status code of the last failed attempt
+    not_before - a page that failed is not claimed again before this time.
+        The wait doubles with every attempt, with some randomness so that
+        pages that failed together are not all claimed again together.
+    fetched - last time the page was crawled
+    session_id - crawl session that last claimed the page
+    updated - last time the row changed
+
+Workers claim a batch of pages at a time with 'FOR UPDATE SKIP LOCKED', so
+any number of crawler processes can work through the frontier at once without
+ever claiming the same page.
+
+Each worker also keeps a row up to date in the 'Workers' table, so that the
+supervisor in MPWorker can report on workers running on any machine:
+
+    worker_id - a unique name for the worker
+    host, pid - where the worker process is running
+    started - time the worker started
+    heartbeat - last time the worker reported in
+    areas, routes - number of areas and routes the worker has claimed
+    status - 'running', 'done' once the frontier is empty, or 'failed'
+
+A crawl session can be stopped and resumed any number of times.  Every page
+a session claims is tagged with its session_id, and stays tagged once it is
+done, so the progress of a session is counted exactly from the frontier
+rather than from counters that are lost in a crash.  Each session has a row
+in the 'Sessions' table:
+
+    session_id - a unique name for the session
+    worker_id - the worker that last ran it
+    started - time the session first started
+    resumed - time the session was last started or resumed
+    checkpoint - last time progress was recorded
+    elapsed - seconds spent crawling, over every run of the session
+    runs - number of times the session has been started
+    status - 'running', 'done', 'stopped' or 'failed'
+
+When a session is resumed, the pages it still had leased were in flight when
+it stopped.  They are released straight away rather than once their leases
+run out.
+
+Pages that have run out of attempts, or failed in a way that will not go away,
+are marked as an error and listed in the 'DeadLetters' table, so they can be
+looked at and queued again without stopping the crawl:
+
+    url - URL on Mountain Project
+    kind - 'area' or 'route'
+    error - description of the last failure
+    failures - number of times the page has been listed
+    failed - last time the page was listed
+
+Routes found or changed by an incremental crawl are listed in the
+'Reanalysis' table, so that MPAnalyzer can update just those routes:
+
+    route_id - id of the route in the Routes table
+    reason - why the route was queued, such as 'new'
+    queued - last time the route was queued
+    tfidf, terrain, clusters - whether each step of MPAnalyzer still has to
+        update the route
+
+Each step of MPAnalyzer reads the routes it still has to update with
+reanalysis_queue, and marks them as done with finish_reanalysis in the same
+transaction that writes its results.  A route leaves the queue once every
+step has updated it.  Terrain scores are built from TFIDF, so routes are
+only scored once their TFIDF is up to date.  A route queued again by a
+crawler while a step is running keeps its place in the queue, since the
+step only marks routes that have not been queued since it read them.
+"""
+
+from psycopg2.extras import execute_values
+import socket
+import os
+
+
+# Steps of MPAnalyzer that update queued routes, each a column of the
+# Reanalysis table
+ANALYSIS_STEPS = ('tfidf', 'terrain', 'clusters')
+
+
+def create_frontier(cursor):
+    ''' Creates the Frontier table and the index used to claim pages.
+
+    Args:
+        cursor(psycopg2 cursor): Cursor on the routes database
+    '''
+
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS Frontier(
+            id SERIAL PRIMARY KEY,
+            url TEXT UNIQUE,
+            kind TEXT,
+            area_id INTEGER,
+            status TEXT DEFAULT 'pending',
+            priority FLOAT DEFAULT 0,
+            attempts INTEGER DEFAULT 0,
+            leased_until TIMESTAMP,
+            error INTEGER,
+            not_before TIMESTAMP,
+            fetched TIMESTAMP,
+            session_id TEXT,
+            updated TIMESTAMP DEFAULT now())''')
+    # Frontiers created before these columns were added
+    cursor.execute('''
+    ALTER TABLE Frontier
+        ADD COLUMN IF NOT EXISTS not_before TIMESTAMP,
+        ADD COLUMN IF NOT EXISTS fetched TIMESTAMP,
+        ADD COLUMN IF NOT EXISTS session_id TEXT''')
+
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS DeadLetters(
+            url TEXT PRIMARY KEY,
+            kind TEXT,
+            error TEXT,
+            failures INTEGER DEFAULT 1,
+            failed TIMESTAMP DEFAULT now())''')
+
+    # Lets workers find the next pages to claim without a table scan
+    cursor.execute('''
+    CREATE INDEX IF NOT EXISTS frontier_claim
+        ON Frontier(kind, status, priority DESC, id DESC)''')
+    # Lets a session count its progress and find its leases
+    cursor.execute('''
+    CREATE INDEX IF NOT EXISTS frontier_session
+        ON Frontier(session_id, status)''')
+    # Lets an unchanged area find the pages that were found on it
+    cursor.execute('''
+    CREATE INDEX IF NOT EXISTS frontier_area
+        ON Frontier(area_id)''')
+
+
+def seed_frontier(cursor):
+    ''' Adds every area that has not been crawled yet to the frontier.
+
+    Areas found before the frontier existed, and regions added by
+    get_regions, are picked up here.  Areas already in the frontier are
+    left alone.
+
+    Args:
+        cursor(psycopg2 cursor): Cursor on the routes database
+    '''
+
+    cursor.execute('''
+        INSERT INTO Frontier(url, kind, area_id)
+        SELECT url, 'area', id
+        FROM Areas
+        WHERE complete IS FALSE
+        AND error IS NULL
+        ON CONFLICT DO NOTHING''')
+
+
+def add_to_frontier(cursor, urls, kind, area_id, priority=0):
+    ''' Adds pages to the frontier.
+
+    Args:
+        cursor(psycopg2 cursor): Cursor on the routes database
+        urls(list): URLs of the pages
+        kind(str): 'area' or 'route'
+        area_id(int): For areas, the id of the area.  For routes, the id of
+            the parent area
+        priority(float): Optional. Pages with higher priority are claimed
+            first
+    '''
+
+    cursor.executemany('''
+        INSERT INTO Frontier(url, kind, area_id, priority)
+        VALUES(%s, %s, %s, %s)
+        ON CONFLICT DO NOTHING''',
+        [(url, kind, area_id, priority) for url in urls])
+
+
+def has_children(cursor, area_id):
+    ''' Checks whether the sub-areas or routes of an area are in the
+    frontier, so the area does not need to be expanded again.
+
+    Args:
+        cursor(psycopg2 cursor): Cursor on the routes database
+        area_id(int): Id of the area in the Areas table
+
+    Returns:
+        has_children(bool): True if a route of the area, or the page of one
+            of its sub-areas, is in the frontier
+    '''
+
+    cursor.execute('''
+        SELECT
+            EXISTS(
+                SELECT 1
+                FROM Frontier
+                WHERE kind = 'route'
+                AND area_id = %s)
+            OR EXISTS(
+                SELECT 1
+                FROM Areas
+                JOIN Frontier
+                    ON Frontier.area_id = Areas.id
+                    AND Frontier.kind = 'area'
+                WHERE Areas.from_id = %s)''', (area_id, area_id))
+    return cursor.fetchone()[0]
+
+
+def claim_batch(conn, kind, batch_size=50, lease=600, max_attempts=5,
+                session_id=None):
+    ''' Leases a batch of pages to the calling worker.
+
+    Pages are claimed if they are pending, or if they were leased to a worker
+    whose lease has run out.  Failed pages are not claimed until their
+    not_before time has passed.  Rows locked by another worker's claim are
+    skipped rather than waited on.  The claim is committed straight away so
+    other workers can see it.
+
+    Pages whose lease ran out on their last attempt are given up on and
+    added to the dead letters, rather than being left leased forever.
+
+    Args:
+        conn(psycopg2 connection): Connection to the routes database
+        kind(str): 'area' or 'route'
+        batch_size(int): Maximum number of pages to claim
+        lease(int): Seconds before the lease runs out
+        max_attempts(int): Pages that have been claimed this many times are
+            not claimed again
+        session_id(str): Optional. Crawl session the pages are claimed for
+
+    Returns:
+        batch(list): (id, url, area_id, priority) for each claimed page
+    '''
+
+    cursor = conn.cursor()
+    cursor.execute('''
+        WITH expired AS (
+            UPDATE Frontier
+            SET status = 'error', leased_until = NULL, updated = now()
+            WHERE kind = %s
+            AND status = 'leased'
+            AND leased_until < now()
+            AND attempts >= %s
+            RETURNING url, kind)
+        INSERT INTO DeadLetters(url, kind, error)
+        SELECT url, kind, 'Lease ran out on the last attempt'
+        FROM expired
+        ON CONFLICT (url) DO UPDATE
+        SET
+            error = EXCLUDED.error,
+            failures = DeadLetters.failures + 1,
+            failed = now()''', (kind, max_attempts))
+    cursor.execute('''
+        UPDATE Frontier
+        SET
+            status = 'leased',
+            attempts = Frontier.attempts + 1,
+            leased_until = now() + %s * interval '1 second',
+            session_id = %s,
+            updated = now()
+        FROM (
+            SELECT id
+            FROM Frontier
+            WHERE kind = %s
+            AND attempts < %s
+            AND (status = 'pending'
+                 OR (status = 'leased' AND leased_until < now()))
+            AND (not_before IS NULL OR not_before <= now())
+            ORDER BY priority DESC, id DESC
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED) AS claimed
+        WHERE Frontier.id = claimed.id
+        RETURNING
+            Frontier.id, Frontier.url, Frontier.area_id, Frontier.priority''',
+        (lease, session_id, kind, max_attempts, batch_size))
+    batch = cursor.fetchall()
+    conn.commit()
+    return batch
+
+
+def complete(cursor, frontier_ids):
+    ''' Marks pages as crawled.
+
+    Args:
+        cursor(psycopg2 cursor): Cursor on the routes database
+        frontier_ids(list): Frontier ids of the finished pages
+    '''
+
+    if not frontier_ids:
+        return
+    cursor.execute('''
+        UPDATE Frontier
+        SET
+            status = 'done',
+            leased_until = NULL,
+            fetched = now(),
+            updated = now()
+        WHERE id IN %s''', (tuple(frontier_ids),))
+
+
+def fail(cursor, frontier_id, error=None, max_attempts=5, backoff=60,
+         max_backoff=3600):
+    ''' Records a failed attempt at a page.
+
+    HTTP errors such as 404 Page Not Found will not go away on their own, so
+    the page is marked as an error.  Otherwise the page goes back to pending
+    to be tried again once its backoff has passed, until it runs out of
+    attempts.  Pages marked as an error are added to the dead letters.
+
+    Args:
+        cursor(psycopg2 cursor): Cursor on the routes database
+        frontier_id(int): Frontier id of the failed page
+        error(int or str): Optional. HTTP status code of the failure, or a
+            description of it
+        max_attempts(int): Pages that have been claimed this many times are
+            marked as an error
+        backoff(float): Longest wait in seconds after the first attempt.  It
+            doubles with every attempt after that.
+        max_backoff(float): Longest wait in seconds after any attempt
+    '''
+
+    code = error if isinstance(error, int) else None
+    # 429 Too Many Requests goes away once the crawl slows down
+    if code is not None and 400 <= code < 500 and code != 429:
+        status = 'error'
+    else:
+        status = 'pending'
+    # Waits somewhere between half and all of the backoff
+    cursor.execute('''
+        UPDATE Frontier
+        SET
+            status = CASE WHEN attempts >= %s THEN 'error' ELSE %s END,
+            error = %s,
+            leased_until = NULL,
+            not_before = now() + LEAST(%s, %s * 2 ^ (attempts - 1))
+                * (0.5 + random() / 2) * interval '1 second',
+            updated = now()
+        WHERE id = %s
+        RETURNING status, url, kind''',
+        (max_attempts, status, code, max_backoff, backoff, frontier_id))
+    row = cursor.fetchone()
+    if row is not None and row[0] == 'error':
+        dead_letter(cursor, row[1], row[2],
+                    'Out of attempts' if error is None else str(error))
+
+
+def dead_letter(cursor, url, kind, error):
+    ''' Gives up on a page and lists it in the dead letters.
+
+    Args:
+        cursor(psycopg2 cursor): Cursor on the routes database
+        url(str): URL of the page
+        kind(str): 'area' or 'route'
+        error(str): Description of the failure
+    '''
+
+    cursor.execute('''
+        INSERT INTO DeadLetters(url, kind, error)
+        VALUES(%s, %s, %s)
+        ON CONFLICT (url) DO UPDATE
+        SET
+            error = EXCLUDED.error,
+            failures = DeadLetters.failures + 1,
+            failed = now()''', (url, kind, error))
+    cursor.execute('''
+        UPDATE Frontier
+        SET status = 'error', leased_until = NULL, updated = now()
+        WHERE url = %s''', (url,))
+
+
+def dead_letters(cursor, kind=None):
+    ''' Lists the pages that have been given up on.
+
+    Args:
+        cursor(psycopg2 cursor): Cursor on the routes database
+        kind(str): Optional. Only list 'area' or 'route' pages
+
+    Returns:
+        pages(list): (url, kind, error, failures, failed) for each page,
+            most recent first
+    '''
+
+    cursor.execute('''
+        SELECT url, kind, error, failures, failed
+        FROM DeadLetters
+        WHERE %s::TEXT IS NULL OR kind = %s
+        ORDER BY failed DESC''', (kind, kind))
+    return cursor.fetchall()
+
+
+def retry_dead_letters(cursor, kind=None):
+    ''' Puts the dead letters back in the frontier to be tried again.
+
+    Sub-areas that could not be added are not in the frontier, so they are
+    only taken off the list.  Requeueing their parent area finds them again.
+
+    Args:
+        cursor(psycopg2 cursor): Cursor on the routes database
+        kind(str): Optional. Only retry 'area' or 'route' pages
+
+    Returns:
+        num_pages(int): Number of pages put back
+    '''
+
+    cursor.execute('''
+        WITH retried AS (
+            DELETE FROM DeadLetters
+            WHERE %s::TEXT IS NULL OR kind = %s
+            RETURNING url)
+        UPDATE Frontier
+        SET
+            status = 'pending',
+            attempts = 0,
+            error = NULL,
+            not_before = NULL,
+            updated = now()
+        FROM retried
+        WHERE Frontier.url = retried.url''', (kind, kind))
+    return cursor.rowcount
+
+
+def requeue(cursor, kind=None, urls=None):
+    ''' Puts finished pages back in the frontier to be crawled again.
+
+    Used to refresh a finished crawl.  Pages with errors are left alone.
+
+    Args:
+        cursor(psycopg2 cursor): Cursor on the routes database
+        kind(str): Optional. Only requeue 'area' or 'route' pages
+        urls(list): Optional. Only requeue these pages
+
+    Returns:
+        num_pages(int): Number of pages requeued
+    '''
+
+    conditions = ["status = 'done'"]
+    params = []
+    if kind is not None:
+        conditions.append('kind = %s')
+        params.append(kind)
+    if urls is not None:
+        if not urls:
+            return 0
+        conditions.append('url IN %s')
+        params.append(tuple(urls))
+    cursor.execute(f'''
+        UPDATE Frontier
+        SET status = 'pending', attempts = 0, updated = now()
+        WHERE {' AND '.join(conditions)}''', params)
+    return cursor.rowcount
+
+
+# Weight of each part of the priority score.  See prioritize.
+PRIORITY_WEIGHTS = {
+    'region': 1.0,
+    'routes': 1.0,
+    'votes': 1.0,
+    'staleness': 2.0,
+}
+
+
+def prioritize(cursor, weights=None, max_staleness=365):
+    ''' Scores every pending page, so the pages that matter most are claimed
+    first.
+
+    The score adds up four parts, each scaled from 0 for the lowest page to 1
+    for the highest, and multiplied by its weight:
+
+        region - Votes on every route in the page's region, as a measure of
+            how popular the region is
+        routes - Number of routes in the page's area
+        votes - Votes on the route itself, for routes that were crawled
+            before
+        staleness - Days since the page was last crawled, up to
+            max_staleness.  Pages that were never crawled count as
+            max_staleness days old.
+
+    Counts are compared on a log scale, so a handful of very popular areas
+    do not flatten the scores of everywhere else.  A part that is the same
+    for every page adds nothing to any score.  Pages with the same score
+    keep the newest first order, which expands areas depth first.
+
+    Args:
+        cursor(psycopg2 cursor): Cursor on the routes database
+        weights(dict): Optional. Weights that replace those in
+            PRIORITY_WEIGHTS
+        max_staleness(float): Days after which a page is as stale as it gets
+
+    Returns:
+        num_pages(int): Number of pages scored
+    '''
+
+    params = dict(PRIORITY_WEIGHTS, **(weights or {}))
+    params['max_staleness'] = max_staleness
+    cursor.execute('''
+        WITH RECURSIVE regions AS (
+            SELECT id, id AS region_id
+            FROM Areas
+            WHERE from_id IS NULL
+            UNION ALL
+            SELECT Areas.id, regions.region_id
+            FROM Areas
+            JOIN regions ON Areas.from_id = regions.id),
+        region_votes AS (
+            SELECT regions.region_id, SUM(Routes.votes) AS votes
+            FROM Routes
+            JOIN regions ON regions.id = Routes.area_id
+            GROUP BY regions.region_id),
+        area_routes AS (
+            SELECT area_id, COUNT(*) AS routes
+            FROM Frontier
+            WHERE kind = 'route'
+            GROUP BY area_id),
+        parts AS (
+            SELECT
+                Frontier.id,
+                ln(1 + COALESCE(region_votes.votes, 0)::FLOAT) AS region,
+                ln(1 + COALESCE(area_routes.routes, 0)::FLOAT) AS routes,
+                ln(1 + COALESCE(Routes.votes, 0)::FLOAT) AS votes,
+                LEAST(
+                    COALESCE(EXTRACT(EPOCH FROM now() - Frontier.fetched)
+                             / 86400, %(max_staleness)s),
+                    %(max_staleness)s)::FLOAT AS staleness
+            FROM Frontier
+            LEFT JOIN regions ON regions.id = Frontier.area_id
+            LEFT JOIN region_votes
+                ON region_votes.region_id = regions.region_id
+            LEFT JOIN area_routes ON area_routes.area_id = Frontier.area_id
+            LEFT JOIN Routes
+                ON Routes.url = Frontier.url AND Frontier.kind = 'route'
+            WHERE Frontier.status = 'pending'),
+        scores AS (
+            SELECT
+                id,
+                %(region)s * COALESCE(
+                    (region - MIN(region) OVER ())
+                    / NULLIF(MAX(region) OVER () - MIN(region) OVER (), 0), 0)
+                + %(routes)s * COALESCE(
+                    (routes - MIN(routes) OVER ())
+                    / NULLIF(MAX(routes) OVER () - MIN(routes) OVER (), 0), 0)
+                + %(votes)s * COALESCE(
+                    (votes - MIN(votes) OVER ())
+                    / NULLIF(MAX(votes) OVER () - MIN(votes) OVER (), 0), 0)
+                + %(staleness)s * COALESCE(
+                    (staleness - MIN(staleness) OVER ())
+                    / NULLIF(MAX(staleness) OVER ()
+                             - MIN(staleness) OVER (), 0), 0) AS priority
+            FROM parts)
+        UPDATE Frontier
+        SET priority = scores.priority
+        FROM scores
+        WHERE Frontier.id = scores.id''', params)
+    return cursor.rowcount
+
+
+def frontier_size(cursor):
+    ''' Counts the pages in the frontier for each kind and status.
+
+    Args:
+        cursor(psycopg2 cursor): Cursor on the routes database
+
+    Returns:
+        counts(dict): Number of pages keyed by (kind, status)
+    '''
+
+    cursor.execute('''
+        SELECT kind, status, COUNT(*)
+        FROM Frontier
+        GROUP BY kind, status''')
+    return {(kind, status): count for kind, status, count in cursor.fetchall()}
+
+
+def create_reanalysis(cursor):
+    ''' Creates the Reanalysis table.
+
+    Args:
+        cursor(psycopg2 cursor): Cursor on the routes database
+    '''
+
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS Reanalysis(
+            route_id INTEGER PRIMARY KEY,
+            reason TEXT,
+            queued TIMESTAMP DEFAULT now(),
+            tfidf BOOLEAN DEFAULT TRUE,
+            terrain BOOLEAN DEFAULT TRUE,
+            clusters BOOLEAN DEFAULT TRUE)''')
+    # Queues created before these columns were added
+    cursor.execute('''
+    ALTER TABLE Reanalysis
+        ADD COLUMN IF NOT EXISTS tfidf BOOLEAN DEFAULT TRUE,
+        ADD COLUMN IF NOT EXISTS terrain BOOLEAN DEFAULT TRUE,
+        ADD COLUMN IF NOT EXISTS clusters BOOLEAN DEFAULT TRUE''')
+
+
+def queue_reanalysis(cursor, route_ids, reason='new'):
+    ''' Lists routes to be updated by the next run of MPAnalyzer.
+
+    A route that is already queued has to be updated by every step again.
+
+    Args:
+        cursor(psycopg2 cursor): Cursor on the routes database
+        route_ids(list): Route ids of the new or changed routes
+        reason(str): Why the routes were queued
+    '''
+
+    if not route_ids:
+        return
+    execute_values(cursor, '''
+        INSERT INTO Reanalysis(route_id, reason)
+        VALUES %s
+        ON CONFLICT (route_id) DO UPDATE
+        SET
+            reason = EXCLUDED.reason,
+            queued = now(),
+            tfidf = TRUE,
+            terrain = TRUE,
+            clusters = TRUE''',
+        [(route_id, reason) for route_id in route_ids])
+
+
+def reanalysis_queue(cursor, step, after=None):
+    ''' Lists the queued routes a step of MPAnalyzer still has to update.
+
+    Args:
+        cursor(psycopg2 cursor): Cursor on the routes database
+        step(str): Step of MPAnalyzer, one of ANALYSIS_STEPS
+        after(str): Optional. Step that has to update a route first.  Routes
+            still waiting on it are left out.
+
+    Returns:
+        queued(dict): Time each route waiting on the step was queued, by
+            route id in order
+    '''
+
+    if step not in ANALYSIS_STEPS or after not in ANALYSIS_STEPS + (None,):
+        raise ValueError(f'Unknown analysis step: {step}, {after}')
+    waiting = f'AND NOT {after}' if after is not None else ''
+    cursor.execute(f'''
+        SELECT route_id, queued
+        FROM Reanalysis
+        WHERE {step} {waiting}
+        ORDER BY route_id''')
+    return dict(cursor.fetchall())
+
+
+def finish_reanalysis(cursor, step, queued):
+    ''' Marks queued routes as updated by a step of MPAnalyzer, and removes
+    routes every step has updated from the queue.
+
+    Routes that were queued again after the step read them are left for
+    the next run, since the step worked from their old data.
+
+    Does not commit, so that the routes are only marked once the results of
+    the step are committed with them.
+
+    Args:
+        cursor(psycopg2 cursor): Cursor on the routes database
+        step(str): Step of MPAnalyzer, one of ANALYSIS_STEPS
+        queued(dict): Time each route the step has updated was queued, from
+            reanalysis_queue
+
+    Returns:
+        num_routes(int): Number of routes removed from the queue
+    '''
+
+    if step not in ANALYSIS_STEPS:
+        raise ValueError(f'Unknown analysis step: {step}')
+    cursor.execute(f'''
+        UPDATE Reanalysis
+        SET {step} = FALSE
+        FROM unnest(%s::INTEGER[], %s::TIMESTAMP[]) AS listed(route_id, queued)
+        WHERE Reanalysis.route_id = listed.route_id
+        AND Reanalysis.queued <= listed.queued''',
+        (list(queued), list(queued.values())))
+    cursor.execute(f'''
+        DELETE FROM Reanalysis
+        WHERE NOT ({' OR '.join(ANALYSIS_STEPS)})''')
+    return cursor.rowcount
+
+
+def create_workers(cursor):
+    ''' Creates the Workers table.
+
+    Args:
+        cursor(psycopg2 cursor): Cursor on the routes database
+    '''
+
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS Workers(
+            worker_id TEXT PRIMARY KEY,
+            host TEXT,
+            pid INTEGER,
+            started TIMESTAMP DEFAULT now(),
+            heartbeat TIMESTAMP DEFAULT now(),
+            areas INTEGER DEFAULT 0,
+            routes INTEGER DEFAULT 0,
+            status TEXT DEFAULT 'running')''')
+
+
+def register_worker(cursor, worker_id):
+    ''' Adds a worker to the Workers table, or resets it after a restart.
+
+    Args:
+        cursor(psycopg2 cursor): Cursor on the routes database
+        worker_id(str): Unique name for the worker
+    '''
+
+    cursor.execute('''
+        INSERT INTO Workers(worker_id, host, pid)
+        VALUES(%s, %s, %s)
+        ON CONFLICT (worker_id) DO UPDATE
+        SET
+            host = EXCLUDED.host,
+            pid = EXCLUDED.pid,
+            started = now(),
+            heartbeat = now(),
+            status = 'running'
+        ''', (worker_id, socket.gethostname(), os.getpid()))
+
+
+def heartbeat(cursor, worker_id, areas=0, routes=0, status='running'):
+    ''' Records that a worker is still alive and how much it has done.
+
+    Args:
+        cursor(psycopg2 cursor): Cursor on the routes database
+        worker_id(str): Unique name for the worker
+        areas(int): Number of areas claimed since the last heartbeat
+        routes(int): Number of routes claimed since the last heartbeat
+        status(str): 'running', 'done' or 'failed'
+    '''
+
+    cursor.execute('''
+        UPDATE Workers
+        SET
+            heartbeat = now(),
+            areas = areas + %s,
+            routes = routes + %s,
+            status = %s
+        WHERE worker_id = %s''', (areas, routes, status, worker_id))
+
+
+def create_sessions(cursor):
+    ''' Creates the Sessions table.
+
+    Args:
+        cursor(psycopg2 cursor): Cursor on the routes database
+    '''
+
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS Sessions(
+            session_id TEXT PRIMARY KEY,
+            worker_id TEXT,
+            started TIMESTAMP DEFAULT now(),
+            resumed TIMESTAMP DEFAULT now(),
+            checkpoint TIMESTAMP DEFAULT now(),
+            elapsed FLOAT DEFAULT 0,
+            runs INTEGER DEFAULT 1,
+            status TEXT DEFAULT 'running')''')
+
+
+def start_session(cursor, session_id, worker_id=None, max_attempts=5):
+    ''' Starts a crawl session, or resumes it if it has run before.
+
+    Pages the session still has leased were in flight when it last stopped,
+    so they are put back to pending to be claimed again straight away.  The
+    attempt stays counted, so a page that keeps stopping the crawler still
+    runs out of attempts.  Pages already on their last attempt are left for
+    claim_batch to give up on once their lease runs out.
+
+    Args:
+        cursor(psycopg2 cursor): Cursor on the routes database
+        session_id(str): Unique name for the session
+        worker_id(str): Optional. Worker running the session
+        max_attempts(int): Pages that have been claimed this many times are
+            not released
+
+    Returns:
+        num_pages(int): Number of pages released
+    '''
+
+    cursor.execute('''
+        INSERT INTO Sessions(session_id, worker_id)
+        VALUES(%s, %s)
+        ON CONFLICT (session_id) DO UPDATE
+        SET
+            worker_id = EXCLUDED.worker_id,
+            resumed = now(),
+            checkpoint = now(),
+            runs = Sessions.runs + 1,
+            status = 'running'
+        ''', (session_id, worker_id))
+    cursor.execute('''
+        UPDATE Frontier
+        SET status = 'pending', leased_until = NULL, updated = now()
+        WHERE session_id = %s
+        AND status = 'leased'
+        AND attempts < %s''', (session_id, max_attempts))
+    return cursor.rowcount
+
+
+def checkpoint(cursor, session_id, elapsed, status='running'):
+    ''' Records the time a session has spent crawling since its last
+    checkpoint.
+
+    Args:
+        cursor(psycopg2 cursor): Cursor on the routes database
+        session_id(str): Unique name for the session
+        elapsed(float): Seconds since the last checkpoint
+        status(str): 'running', 'done', 'stopped' or 'failed'
+    '''
+
+    cursor.execute('''
+        UPDATE Sessions
+        SET
+            elapsed = elapsed + %s,
+            checkpoint = now(),
+            status = %s
+        WHERE session_id = %s''', (elapsed, status, session_id))
+
+
+def session_progress(cursor, session_id):
+    ''' Counts what a session has done and estimates the time left.
+
+    Pages are counted from the frontier, so the counts are exact however
+    many times the session was stopped and resumed.  The estimate assumes the
+    pages left are crawled at the rate the session has managed so far, and
+    grows as areas are expanded and their routes are found.
+
+    Args:
+        cursor(psycopg2 cursor): Cursor on the routes database
+        session_id(str): Unique name for the session
+
+    Returns:
+        progress(dict): Pages done by the session for each kind under
+            'done', pages still to crawl by any session for each kind under
+            'remaining', seconds spent crawling, pages per second and the
+            estimated seconds left under 'eta', which is None until a page
+            has been done
+    '''
+
+    cursor.execute('''
+        SELECT elapsed
+        FROM Sessions
+        WHERE session_id = %s''', (session_id,))
+    row = cursor.fetchone()
+    elapsed = row[0] if row is not None else 0.0
+    cursor.execute('''
+        SELECT kind, COUNT(*)
+        FROM Frontier
+        WHERE session_id = %s
+        AND status = 'done'
+        GROUP BY kind''', (session_id,))
+    done = dict(cursor.fetchall())
+    cursor.execute('''
+        SELECT kind, COUNT(*)
+        FROM Frontier
+        WHERE status IN ('pending', 'leased')
+        GROUP BY kind''')
+    remaining = dict(cursor.fetchall())
+
+    num_done = sum(done.values())
+    rate = num_done / elapsed if elapsed else 0.0
+    return {
+        'session_id': session_id,
+        'done': done,
+        'remaining': remaining,
+        'elapsed': elapsed,
+        'pages_per_sec': rate,
+        'eta': sum(remaining.values()) / rate if rate else None}
+
+
+def list_sessions(cursor):
+    ''' Lists every crawl session with the pages it has done.
+
+    Args:
+        cursor(psycopg2 cursor): Cursor on the routes database
+
+    Returns:
+        sessions(list): (session_id, worker_id, status, runs, elapsed,
+            areas, routes, checkpoint) for each session, most recent first
+    '''
+
+    cursor.execute('''
+        SELECT
+            Sessions.session_id, worker_id, Sessions.status, runs, elapsed,
+            COUNT(*) FILTER (WHERE kind = 'area'),
+            COUNT(*) FILTER (WHERE kind = 'route'),
+            checkpoint
+        FROM Sessions
+        LEFT JOIN Frontier
+            ON Frontier.session_id = Sessions.session_id
+            AND Frontier.status = 'done'
+        GROUP BY Sessions.session_id
+        ORDER BY checkpoint DESC''')
+    return cursor.fetchall()
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+"""
+Summary:
+Fills in the location of routes that have none, from their nearest area.
+
+Details:
+Not every route page gives coordinates, so such routes take the latitude and
+longitude of the lowest area above them that has both.  MPAnalyzer used to
+find them one route at a time: a query for the next route without a
+location, one query for each area above it until one had coordinates, then
+an UPDATE and a commit.  Over the whole database that is millions of round
+trips.
+
+Instead, the tree of areas is read once as (id, from_id, latitude,
+longitude), and the nearest area with coordinates is found for every area in
+one walk.  Each area is only walked through once, since the areas below it
+reuse its answer.  The locations are then copied into a temporary table, and
+every route is filled in by one UPDATE ... FROM.
+
+Routes whose areas have no coordinates all the way to the top are left
+empty, where the route at a time walk would have stopped with an error.
+
+See MPBenchmark for timing both ways against the routes database.
+"""
+
+import io
+
+
+def nearest_locations(areas):
+    ''' Finds the nearest area with coordinates at or above each area.
+
+    Args:
+        areas(dict): (from_id, latitude, longitude) of each area id
+
+    Returns:
+        locations(dict): (latitude, longitude) for each area id, without the
+            areas that have no area with coordinates above them
+    '''
+
+    found = {}
+    for area_id in areas:
+        path = []
+        current = area_id
+        # Walks up until it reaches an area it already has an answer for,
+        # an area with coordinates, or the top of the tree
+        while current in areas and current not in found:
+            from_id, lat, long = areas[current]
+            if lat is not None and long is not None:
+                found[current] = (lat, long)
+                break
+            path.append(current)
+            # Marked as it is walked through, so a loop in the tree ends
+            found[current] = None
+            current = from_id
+        location = found.get(current)
+        for area in path:
+            found[area] = location
+    return {area_id: location for area_id, location in found.items()
+            if location is not None}
+
+
+def fill_null_locations(conn, commit=True):
+    ''' Gives every route without a location that of its nearest area.
+
+    Args:
+        conn(psycopg2 connection): Connection to the routes database
+        commit(bool): Optional. Commits the routes once they are filled in
+
+    Returns:
+        num_routes(int): Number of routes filled in
+    '''
+
+    cursor = conn.cursor()
+    cursor.execute('SELECT id, from_id, latitude, longitude FROM Areas')
+    areas = {area_id: (from_id, lat, long)
+             for area_id, from_id, lat, long in cursor.fetchall()}
+    locations = nearest_locations(areas)
+
+    # Only the areas of routes without a location are written
+    cursor.execute('''
+        SELECT DISTINCT area_id
+        FROM Routes
+        WHERE latitude IS NULL OR longitude IS NULL''')
+    rows = io.StringIO()
+    for area_id, in cursor.fetchall():
+        if area_id in locations:
+            lat, long = locations[area_id]
+            rows.write(f'{area_id}\t{lat!r}\t{long!r}\n')
+    rows.seek(0)
+
+    cursor.execute('''
+        CREATE TEMP TABLE AreaLocations(
+            area_id INTEGER PRIMARY KEY,
+            latitude FLOAT,
+            longitude FLOAT)
+        ON COMMIT DROP''')
+    cursor.copy_expert(
+        'COPY AreaLocations(area_id, latitude, longitude) FROM STDIN', rows)
+    cursor.execute('''
+        UPDATE Routes
+        SET
+            latitude = AreaLocations.latitude,
+            longitude = AreaLocations.longitude
+        FROM AreaLocations
+        WHERE Routes.area_id = AreaLocations.area_id
+        AND (Routes.latitude IS NULL OR Routes.longitude IS NULL)''')
+    num_routes = cursor.rowcount
+    if commit:
+        conn.commit()
+    return num_routes
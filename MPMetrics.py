@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+"""
+Summary:
+Live metrics for a running crawl.
+
+Details:
+A crawl spends its time in three stages: downloading pages, parsing them and
+writing them to the database.  Over a crawl of several days, the stage that
+holds the others up can change, so the crawler keeps a snapshot of its
+counters up to date while it runs.  Every interval, a background thread
+collects:
+
+    fetch - Counters from the fetcher: requests, bytes, retries, failed
+        pages, times a host pushed back, and request and parse times
+    write - Counters from the writer: batches, routes, words and write time
+    rates - Pages, bytes and routes per second over the last interval
+    stages - Share of the last interval each stage was busy.  Downloads and
+        extra comment pages are divided by the concurrency and parsing by
+        the number of parser processes, so a stage near 1.0 is the one
+        holding up the crawl.
+    bottleneck - The busiest stage
+    queues - Pages waiting for each stage, and routes held by the writer
+    hosts - Requests per second currently allowed for each host
+    frontier - Pages in the frontier for each kind and status, and the number
+        of dead letters
+    session - Pages done by the crawl session over all of its runs, pages
+        left and the estimated time to finish.  See
+        MPFrontier.session_progress.
+
+The snapshot is written to a JSON file, served from a local HTTP endpoint, or
+both:
+
+    python MPWorker.py work --metrics-file metrics.json --metrics-port 9100
+    curl http://127.0.0.1:9100/metrics
+
+The frontier is counted over a connection of its own, so the metrics thread
+never shares a cursor with the crawler.
+"""
+
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+from MPFrontier import frontier_size
+from MPFrontier import session_progress
+import threading
+import psycopg2
+import json
+import time
+import os
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    ''' Answers every GET request with the latest snapshot as JSON.'''
+
+    def do_GET(self):
+        body = json.dumps(self.server.metrics.latest, indent=2).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Keeps the crawler's own output readable
+        pass
+
+
+class CrawlMetrics:
+    ''' Collects crawl statistics in the background and publishes them.
+
+    Args:
+        fetcher(AsyncFetcher): Fetcher of the crawl
+        writer(RouteWriter): Writer of the crawl
+        db_params(dict): Optional. Connection parameters for the database.
+            Without them, the frontier is not counted.
+        path(str): Optional. JSON file the latest snapshot is written to
+        port(int): Optional. Port of a local HTTP endpoint serving the latest
+            snapshot
+        interval(float): Seconds between snapshots
+        worker_id(str): Optional. Name of the crawler, included in the
+            snapshot
+        session_id(str): Optional. Crawl session whose progress is included
+            in the snapshot
+    '''
+
+    def __init__(self, fetcher, writer, db_params=None, path=None, port=None,
+                 interval=30, worker_id=None, session_id=None):
+        self.fetcher = fetcher
+        self.writer = writer
+        self.db_params = db_params
+        self.path = path
+        self.port = port
+        self.interval = interval
+        self.worker_id = worker_id
+        self.session_id = session_id
+        self.started = time.time()
+        self.latest = {}
+        self.last = None
+        self.conn = None
+        self.server = None
+        self.thread = None
+        self.stopped = threading.Event()
+
+    def frontier(self):
+        ''' Counts the frontier and the dead letters.
+
+        Returns:
+            frontier(dict): Number of pages for each kind and status, and
+                the number of dead letters under 'dead_letters'
+        '''
+
+        if self.db_params is None:
+            return {}
+        if self.conn is None:
+            self.conn = psycopg2.connect(**self.db_params)
+            self.conn.autocommit = True
+        cursor = self.conn.cursor()
+        counts = {}
+        for (kind, status), count in frontier_size(cursor).items():
+            counts.setdefault(kind, {})[status] = count
+        cursor.execute('SELECT COUNT(*) FROM DeadLetters')
+        counts['dead_letters'] = cursor.fetchone()[0]
+        return counts
+
+    def session(self):
+        ''' Counts the progress of the crawl session.
+
+        Returns:
+            progress(dict): See MPFrontier.session_progress
+        '''
+
+        if self.db_params is None or self.session_id is None:
+            return {}
+        if self.conn is None:
+            self.conn = psycopg2.connect(**self.db_params)
+            self.conn.autocommit = True
+        return session_progress(self.conn.cursor(), self.session_id)
+
+    def snapshot(self):
+        ''' Collects the current counters and the rates since the last
+        snapshot.
+
+        Returns:
+            snapshot(dict): Metrics described at the top of this module
+        '''
+
+        now = time.time()
+        fetch = self.fetcher.stats()
+        write = self.writer.stats()
+        snapshot = {
+            'time': now,
+            'worker_id': self.worker_id,
+            'uptime': now - self.started,
+            'fetch': fetch,
+            'write': write,
+            'queues': dict(self.fetcher.queue_depths(),
+                           write=len(self.writer.routes)),
+            'hosts': self.fetcher.limiter.rates(),
+        }
+        try:
+            snapshot['frontier'] = self.frontier()
+            snapshot['session'] = self.session()
+        # Metrics are not worth stopping the crawl over
+        except psycopg2.Error as error:
+            snapshot['frontier'] = {'error': repr(error)}
+            self.conn = None
+
+        # Rates and stage use over the last interval
+        last = self.last or {'time': self.started, 'fetch': {}, 'write': {}}
+        elapsed = (now - last['time']) or 1
+
+        def change(stage, counter):
+            return snapshot[stage][counter] - last[stage].get(counter, 0)
+
+        snapshot['rates'] = {
+            'pages_per_sec': change('fetch', 'requests') / elapsed,
+            'bytes_per_sec': change('fetch', 'bytes') / elapsed,
+            'routes_per_sec': change('write', 'routes') / elapsed,
+            'retries_per_sec': change('fetch', 'retries') / elapsed}
+        snapshot['stages'] = {
+            'fetch': change('fetch', 'request_time')
+            / (elapsed * self.fetcher.concurrency),
+            'parse': change('fetch', 'parse_time')
+            / (elapsed * self.fetcher.parse_workers),
+            'extend': change('fetch', 'extend_time')
+            / (elapsed * self.fetcher.concurrency),
+            'write': change('write', 'write_time') / elapsed}
+        snapshot['bottleneck'] = max(snapshot['stages'],
+                                     key=snapshot['stages'].get)
+        self.last = snapshot
+        return snapshot
+
+    def publish(self):
+        ''' Takes a snapshot and writes it to the snapshot file.'''
+
+        self.latest = self.snapshot()
+        if self.path is not None:
+            # Written in full before it replaces the old file, so a reader
+            # never sees half a snapshot
+            temp_path = self.path + '.tmp'
+            with open(temp_path, 'w') as f:
+                json.dump(self.latest, f, indent=2)
+            os.replace(temp_path, self.path)
+
+    def _run(self):
+        ''' Publishes a snapshot every interval until stopped.'''
+
+        while not self.stopped.wait(self.interval):
+            try:
+                self.publish()
+            except Exception as error:
+                print(f'Could not publish metrics: {error!r}')
+
+    def start(self):
+        ''' Starts the metrics thread, and the endpoint if there is a port.'''
+
+        if self.port is not None:
+            self.server = ThreadingHTTPServer(('127.0.0.1', self.port),
+                                              MetricsHandler)
+            self.server.metrics = self
+            threading.Thread(target=self.server.serve_forever,
+                             daemon=True).start()
+            print(f'Metrics at http://127.0.0.1:{self.port}/metrics')
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        ''' Publishes a final snapshot and stops the thread and endpoint.'''
+
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.publish()
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+        if self.conn is not None:
+            self.conn.close()
@@ -0,0 +1,709 @@
+# -*- coding: utf-8 -*-
+"""
+Summary:
+Parses Mountain Project area and route pages.
+
+Details:
+Parsing HTML takes up most of the crawler's processing time once many pages
+are downloaded at once.  Each page is read through a 'page' object, which
+answers the handful of questions the crawler asks of a page (the name of the
+area or route, its star rating, its grades, and so on).  Two interchangeable
+page types are available:
+
+    lxml - Parses with the lxml C library, and finds elements with XPath
+        expressions that are compiled once when this module is loaded.  This
+        is the default, and is much faster.
+    html.parser - Parses with BeautifulSoup and Python's built-in parser.
+        This is how pages were originally parsed, and is kept to check that
+        the lxml page gives the same results.
+
+The XPath expressions match classes the same way BeautifulSoup does: a single
+class matches any element that has that class, while a string of several
+classes must match the element's class attribute exactly.
+
+The parity command checks both page types against a folder of saved pages,
+such as the ones the tests check:
+
+    python MPParser.py parity tests/pages/
+
+Grades are found by GradeParser, which is shared with the analyzer.  See
+MPBenchmark for timing it against get_route_diff as it was before.
+
+Busy routes have more comments than fit on the route page.  The rest are
+served a page at a time, and a CommentStream picks the comments out of each
+page while it is still downloading, dropping each one from the tree once its
+text has been read.  add_words adds their words to the route's word counts.
+
+Route pages are parsed into a RouteRecord, which has a slot for each column
+of the Routes table.
+"""
+
+from mpproj.routefinder.GradeParser import grade_ordinal
+from mpproj.routefinder.GradeParser import fill_grades
+from mpproj.routefinder.RouteRecord import RouteRecord
+from mpproj.routefinder.TextSplitter import text_splitter
+from mpproj.routefinder.TextSplitter import split_texts
+from lxml import etree
+from lxml import html as lxml_html
+from bs4 import BeautifulSoup
+from collections import Counter
+import click
+import sys
+import os
+import re
+
+
+def has_class(name):
+    ''' XPath test for an element that has a class.
+
+    Args:
+        name(str): CSS class name
+
+    Returns:
+        test(str): XPath predicate
+    '''
+
+    return f"contains(concat(' ', normalize-space(@class), ' '), ' {name} ')"
+
+
+def class_is(names):
+    ''' XPath test for an element whose class attribute is exactly names.
+
+    Args:
+        names(str): Space separated CSS class names
+
+    Returns:
+        test(str): XPath predicate
+    '''
+
+    return f"normalize-space(@class) = '{names}'"
+
+
+# Class of the element holding each user comment
+COMMENT_CLASS = 'comment-body max-height max-height-md-300 max-height-xs-150'
+
+# Compiled once and shared by every lxml page
+XPATHS = {
+    'title': etree.XPath('(//body//h1)[1]'),
+    'details': etree.XPath(
+        f"(//table[{has_class('description-details')}])[1]"),
+    'cells': etree.XPath('.//td'),
+    'empty': etree.XPath(f"(//div[{has_class('my-1')}])[1]"),
+    'route_score': etree.XPath(f"(//td[{has_class('route-score')}])[1]"),
+    'sidebar': etree.XPath(f"(//div[{has_class('mp-sidebar')}])[1]"),
+    'sub_areas': etree.XPath(
+        f".//div[{has_class('lef-nav-row')}]/descendant::a[1]/@href"),
+    'route_table': etree.XPath('(.//div[{}]//table)[1]'.format(class_is(
+        'max-height max-height-md-0 max-height-xs-150'))),
+    'route_links': etree.XPath(
+        './/tr[not(@id)]/descendant::a[1]/@href'),
+    'stats': etree.XPath(
+        f"(//a[{has_class('show-tooltip')}][@title='View Stats'])[1]"),
+    'grades': etree.XPath(f"(//h2[{class_is('inline-block mr-2')}])[1]"),
+    'description': etree.XPath(f"(//div[{has_class('fr-view')}])[1]"),
+    'comments': etree.XPath(f'//div[{class_is(COMMENT_CLASS)}]'),
+    'regions': etree.XPath(
+        f"(//div[@id='route-guide'])[1]//div[{has_class('mb-half')}]"
+        "/descendant::a[1]"),
+    'breadcrumbs': etree.XPath(
+        f"(//div[{has_class('mb-half')} and {has_class('text-warm')}])[1]"
+        "/a/@href"),
+    'feed_links': etree.XPath("//a[contains(@href, '/route/')]/@href"),
+}
+
+
+class LxmlPage:
+    ''' Area or route page parsed with lxml.
+
+    Both page types answer the same questions of a page:
+        title - Area or route name
+        details_text, details_cell - Text of the details table, which holds
+            an area's location and a route's type and length
+        is_empty, has_routes - Whether an area holds nothing, or routes
+        sub_area_urls, route_urls - Links to the sub-areas or routes
+        stats_text - Star rating and number of votes
+        grades_text - Route grades in every grading system
+        description_text, comment_texts - Route description and comments
+        regions - (url, name) of each region in the route guide
+        breadcrumb_urls - Links to the areas above a route or area, starting
+            with the region
+
+    Args:
+        html(bytes): Raw page HTML
+    '''
+
+    def __init__(self, html):
+        self.root = lxml_html.fromstring(html)
+
+    def _first(self, name, element=None):
+        found = XPATHS[name](self.root if element is None else element)
+        return found[0] if found else None
+
+    def title(self):
+        return self._first('title').text_content().strip()
+
+    def details_text(self):
+        details = self._first('details')
+        return None if details is None else details.text_content()
+
+    def details_cell(self, i):
+        return XPATHS['cells'](self._first('details'))[i].text_content()
+
+    def is_empty(self):
+        return self._first('empty') is not None
+
+    def has_routes(self):
+        return self._first('route_score') is not None
+
+    def sub_area_urls(self):
+        sidebar = self._first('sidebar')
+        return [str(url) for url in XPATHS['sub_areas'](sidebar)]
+
+    def route_urls(self):
+        table = self._first('route_table', self._first('sidebar'))
+        return [str(url) for url in XPATHS['route_links'](table)]
+
+    def stats_text(self):
+        return self._first('stats').text_content()
+
+    def grades_text(self):
+        return self._first('grades').text_content()
+
+    def description_text(self):
+        return self._first('description').text_content()
+
+    def comment_texts(self):
+        return [comment.text_content()
+                for comment in XPATHS['comments'](self.root)]
+
+    def regions(self):
+        return [(link.get('href'), link.text_content())
+                for link in XPATHS['regions'](self.root)]
+
+    def breadcrumb_urls(self):
+        return [str(url) for url in XPATHS['breadcrumbs'](self.root)
+                if '/area/' in url]
+
+
+class SoupPage:
+    ''' Area or route page parsed with BeautifulSoup's html.parser.
+
+    Args:
+        html(bytes): Raw page HTML
+    '''
+
+    def __init__(self, html):
+        self.soup = BeautifulSoup(html, 'html.parser')
+
+    def title(self):
+        return self.soup.body.find('h1').get_text().strip()
+
+    def details_text(self):
+        details = self.soup.find('table', class_='description-details')
+        return None if details is None else details.get_text()
+
+    def details_cell(self, i):
+        details = self.soup.find('table', class_='description-details')
+        return details.find_all('td')[i].get_text()
+
+    def is_empty(self):
+        return self.soup.find('div', class_="my-1") is not None
+
+    def has_routes(self):
+        return self.soup.find('td', class_="route-score") is not None
+
+    def sub_area_urls(self):
+        sidebar = self.soup.body.find('div', class_='mp-sidebar')
+        areas = sidebar.find_all('div', class_='lef-nav-row')
+        return [area.find('a')['href'] for area in areas]
+
+    def route_urls(self):
+        sidebar = self.soup.body.find('div', class_='mp-sidebar')
+        class_ = 'max-height max-height-md-0 max-height-xs-150'
+        table = sidebar.find('div', class_=class_).find('table')
+        routes = table.find_all('tr', id=None)
+        return [route.find('a')['href'] for route in routes]
+
+    def stats_text(self):
+        return self.soup.find('a', class_='show-tooltip',
+                              title='View Stats').get_text()
+
+    def grades_text(self):
+        return self.soup.find('h2', class_="inline-block mr-2").get_text()
+
+    def description_text(self):
+        return self.soup.find('div', class_="fr-view").get_text()
+
+    def comment_texts(self):
+        comments = self.soup.find_all('div', class_=COMMENT_CLASS)
+        return [comment.get_text() for comment in comments]
+
+    def regions(self):
+        regions = self.soup.find('div', id='route-guide')\
+                           .find_all('div', class_='mb-half')
+        return [(region.find('a')['href'], region.find('a').get_text())
+                for region in regions]
+
+    def breadcrumb_urls(self):
+        for div in self.soup.find_all('div', class_='mb-half'):
+            if 'text-warm' in div['class']:
+                links = div.find_all('a', recursive=False)
+                return [link['href'] for link in links
+                        if '/area/' in link['href']]
+        return []
+
+
+BACKENDS = {'lxml': LxmlPage, 'html.parser': SoupPage}
+
+
+def make_page(html, backend='lxml'):
+    ''' Parses a page with the chosen backend.
+
+    Args:
+        html(bytes): Raw page HTML
+        backend(str): 'lxml' or 'html.parser'
+
+    Returns:
+        page(LxmlPage or SoupPage): Parsed page
+    '''
+
+    return BACKENDS[backend](html)
+
+
+def parse_area_page(area_html, backend='lxml'):
+    """ Parses everything the crawler needs from an area page.
+
+    Only the few values that are needed are kept, rather than the whole
+    parsed page, so that many pages can be held in area_cache at once.
+
+    Args:
+        area_html(bytes): HTML of the area page
+        backend(str): 'lxml' or 'html.parser'
+
+    Returns:
+        area_page(dict): Holds the area name, latitude and longitude,
+            whether the area is empty, whether it holds routes, and the
+            URLs of its sub-areas or routes.
+    """
+
+    page = make_page(area_html, backend)
+
+    # Finds area name
+    area_name = page.title()
+    # Finds latitude and longitude.  Region pages have no location table
+    map_table = page.details_text() or ''
+    # Uses regular expressions to find numbers that look like latitude and
+    # longitude numbers
+    lat_long = re.findall('[\-0-9]+\.[0-9]+', map_table)
+    # Ensures that both latitude and longitude are found, and helps guard
+    # against false-positives
+    if len(lat_long) == 2:
+        lat = lat_long[0]
+        long = lat_long[1]
+    # Otherwise gives a generic lat, long
+    else:
+        lat, long = None, None
+
+    # Determines if the area is empty of route and sub-area information
+    is_empty = page.is_empty()
+    # Searches for routes in the area
+    routes_in_area = page.has_routes()
+
+    area_urls, route_urls = [], []
+    # Lists all sub-areas or routes in an area
+    if not routes_in_area and not is_empty:
+        area_urls = page.sub_area_urls()
+    elif routes_in_area and not is_empty:
+        route_urls = page.route_urls()
+
+    area_page = {
+        'name': area_name,
+        'latitude': lat,
+        'longitude': long,
+        'is_empty': is_empty,
+        'routes_in_area': routes_in_area,
+        'area_urls': area_urls,
+        'route_urls': route_urls}
+
+    return area_page
+
+
+# Patterns for the route details cell, compiled once
+LENGTH = re.compile(r'(\d+) ft')
+PITCHES = re.compile(r'(\d+) pitches')
+NCCS = re.compile(r'Grade ([VI]+)')
+
+# Every route type listed on Mountain Project, and its column
+ROUTE_TYPES = [
+    ('Trad', 'trad'),
+    ('TR', 'tr'),
+    ('Sport', 'sport'),
+    ('Aid', 'aid'),
+    ('Snow', 'snow'),
+    ('Ice', 'ice'),
+    ('Mixed', 'mixed'),
+    ('Boulder', 'boulder'),
+    ('Alpine', 'alpine'),
+]
+
+
+def get_route_metadata(record, page):
+    ''' Fills in the route name and quality.
+
+    Route URL has already been found, while the name and quality of the route
+    can be found in the HTML.  The location comes from the parent area, and
+    is added by the crawler.
+    Mountain Project (MP) measures route quality on a four star rating
+    system, with 4 being the maximum.  There is also a 'bomb' rating,
+    which is rarely used - these routes are often not worth posting.
+    MP uses the following guide to the five ratings:
+
+                            Bomb = "Avoid"
+                            1 Star = "OK"
+                            2 Stars = "Good"
+                            3 Stars = "Great"
+                            4 Stars = "Classic"
+
+    Fortunately, MP averages these ratings numerically, which is what we
+    will retrieve.
+
+    Args:
+        record(RouteRecord): Record of the route, which already holds its URL
+        page(LxmlPage or SoupPage): Parsed route page
+    Returns:
+        Sets the name, stars, and votes of the record
+    '''
+
+    record.name = page.title()
+
+    # Star rating and number of votes, e.g. 'Avg: 3.5 from 120 votes'
+    stats = page.stats_text().strip().split()
+
+    # Average number of stars awarded out of 4
+    record.stars = stats[1]
+
+    # Number of votes cast
+    record.votes = stats[3].replace(',', '')
+
+
+def get_route_type(record, page):
+    ''' Fills in the route type (e.g. sport, trad, boulder, etc)
+
+    This function gathers data on what types of climbing can be done on a
+    specific route. Mountain Project (MP) hosts trad, top rope, sport, aid,
+    mixed, snow, ice, boulder, and alpine routes, and there is no limit to
+    the number of types of different climbing styles that can apply to a
+    route. Some combinations (e.g. alpine and snow, aid and mixed) are
+    common, but there are uncommon combinations, too.  Often, this seems
+    to be a user input error, for example, a boulder/alpine route seems
+    unlikely.
+
+    Out of convenience, because the NCCS rating is stored in the same place
+    as route type on MP, this function grabs that too.  NCCS ratings refer
+    to the level of commitment required, usually for alpine routes.  NCCS
+    is graded out of 7 (I - VII).
+
+    Similarly, the route length and number of pitches are gathered from
+    this part of the page.  Note that while route length refers to the
+    length of the climb, it seems that some users have put in route
+    elevation instead. This is most often apparent when, for example,
+    boulder problem is listed as being 2000 feet long.
+
+    Args:
+        record(RouteRecord): Record of the route
+        page(LxmlPage or SoupPage): Parsed route page
+    Returns:
+        Sets a boolean value for each route type 'Trad', 'TR', 'Sport',
+        'Aid', 'Snow', 'Ice', 'Mixed', 'Boulder', 'Alpine', and the length,
+        pitches, and NCCS rating of the record
+    '''
+
+    # Grab relevent web data
+    route_info = page.details_cell(1).strip()
+
+    # Matches a string of digits of any length followed by 'ft'
+    length = LENGTH.search(route_info)
+    # If there is no match, the length is None
+    record.length = length.group(1) if length else None
+
+    # Matches a string of digits of any length followed by 'pitches'
+    pitches = PITCHES.search(route_info)
+    # If there is no match, there are 0 pitches
+    record.pitches = pitches.group(1) if pitches else 0
+
+    # Matches a string starting with 'Grade', then any combination of
+    # 'V', 'I' of any length, then returns the 'V', 'I' characters
+    nccs = NCCS.search(route_info)
+    if nccs:
+        record.nccs_rating = nccs.group(1)
+        record.nccs_conv = grade_ordinal('nccs_conv', record.nccs_rating)
+    else:
+        record.nccs_rating = None
+        record.nccs_conv = 0
+
+    # Creates a list of types for the route in question
+    route_types = route_info.split(', ')
+
+    # Searches through the list of route types for the route in question
+    # and matches them to the list of all route types.  Each type is set to
+    # True if it is listed, and False otherwise
+    for route_type, column in ROUTE_TYPES:
+        setattr(record, column, route_type in route_types)
+
+
+def get_route_diff(record, page):
+    ''' Fills in the route difficulty.
+
+    There are a number of different ways to grade routes based on the style
+    of climbing and the location.  Each system is organized in a different
+    way, and the system is often not logical.  This function finds the
+    ratings for the route in any form they may appear, and sets the grade
+    in every rating system on the record.
+
+    Args:
+        record(RouteRecord): Record of the route
+        page(LxmlPage or SoupPage): Parsed route page
+    Returns:
+        Sets the route difficulty in hueco, Fontaine, YDS, French, Ewbanks,
+        UIAA, South African, British, aid, mixed, snow, and ice, as well as
+        the danger rating.
+    '''
+
+    # Selects the relevant part of the HTML data, and finds the grade in
+    # each system with patterns compiled once in GradeParser
+    fill_grades(record, page.grades_text())
+
+
+def get_text(page, route_name):
+    ''' Gathers and analyzes text data from route name and description and,
+    user comments.
+    
+    Route data is stored in three places in the HTML, and must be joined
+    into one string to fully process. After creating a master list of the
+    text, it passes the text to the splitter.  The splitter returns a list
+    of processed words, which are counted and passed on to the writer.  The
+    term-frequency for each word is calculated as well, which will be used
+    later to categorize routes.
+
+                        Term-Frequency = t / L
+
+                t = Number of appearances for a word in a document
+                L = Number of total words in the document
+    
+    Args:
+        page(LxmlPage or SoupPage): Parsed route page
+        route_name(str): name of route
+        
+    Returns:
+        words(list): (word, word_count, tf) for each unique word
+    '''
+
+    # Finds description of the route
+    description = page.description_text()
+    text = route_name + ' ' + description
+
+    # Finds comment section of the page
+    comments = page.comment_texts()
+
+    # Creates a single text that combines the description, route name and
+    # user comments that can be searched for keywords
+    for comment in comments:
+        text += ' ' + first_line(comment)
+        
+    text = text_splitter(text)
+    doc_length = len(text)
+    # Counts words
+    word_counts = Counter(text)
+    words = [(word, word_count, word_count / doc_length)
+             for word, word_count in word_counts.items()]
+
+    return words
+
+
+def first_line(comment):
+    ''' Text of a comment without the date and name of the poster.
+
+    Args:
+        comment(str): Text of the comment element
+
+    Returns:
+        text(str): First line of the comment
+    '''
+
+    return comment.strip().split('\n')[0].strip()
+
+
+def add_words(words, texts):
+    ''' Adds the words of more text to the word counts of a route.
+
+    Args:
+        words(list): (word, word_count, tf) for each word in the route text
+        texts(list): Further texts about the route, such as comments
+
+    Returns:
+        words(list): (word, word_count, tf) for each word in all of the text
+    '''
+
+    word_counts = Counter({word: word_count for word, word_count, _ in words})
+    for text in split_texts(texts):
+        word_counts.update(text)
+    doc_length = sum(word_counts.values())
+    return [(word, word_count, word_count / doc_length)
+            for word, word_count in word_counts.items()]
+
+
+class CommentStream:
+    ''' Picks the comments out of a page of comments while it downloads.
+
+    Each piece of the page is fed in as it arrives.  Comments are read as
+    soon as their element is complete, and are then removed from the tree,
+    so the whole page is never held at once.
+    '''
+
+    def __init__(self):
+        self.parser = etree.HTMLPullParser(events=('end',), tag='div')
+
+    def _comments(self):
+        comments = []
+        for _, element in self.parser.read_events():
+            if ' '.join(element.get('class', '').split()) != COMMENT_CLASS:
+                continue
+            comments.append(first_line(''.join(element.itertext())))
+            # Drops the comment, and everything before it
+            element.clear(keep_tail=True)
+            parent = element.getparent()
+            if parent is not None:
+                while element.getprevious() is not None:
+                    del parent[0]
+        return comments
+
+    def feed(self, chunk):
+        ''' Reads the next piece of the page.
+
+        Args:
+            chunk(bytes): The next part of the HTML
+
+        Returns:
+            comments(list): Text of each comment completed by this piece
+        '''
+
+        self.parser.feed(chunk)
+        return self._comments()
+
+    def close(self):
+        ''' Finishes the page.
+
+        Returns:
+            comments(list): Text of each comment left at the end of the page
+        '''
+
+        self.parser.close()
+        return self._comments()
+
+
+def parse_route(route_url, route_html, backend='lxml'):
+    ''' Gathers everything stored about a route from its page.
+
+    This is the CPU-heavy part of the crawl, and is run in a pool of parser
+    processes, so it only depends on the page itself.  The location and
+    parent area are added by the crawler.
+
+    Args:
+        route_url(str): URL for route
+        route_html(bytes): HTML of the route page
+        backend(str): 'lxml' or 'html.parser'
+
+    Returns:
+        record(RouteRecord): Route data for every column of the Routes
+            table, except for latitude, longitude and area_id.  Also holds
+            the URLs of the areas above the route in breadcrumbs, and the
+            number of comments on the page in comments.
+        words(list): (word, word_count, tf) for each word in the route text
+    '''
+
+    page = make_page(route_html, backend)
+    record = RouteRecord(route_url)
+
+    # metadata includes name, stars, and votes
+    get_route_metadata(record, page)
+    # Includes sport, trad, tr, etc.
+    get_route_type(record, page)
+    # Includes route difficulty according to different grading systems
+    get_route_diff(record, page)
+    # Used to find the parent area of routes found outside of an area page
+    record.breadcrumbs = page.breadcrumb_urls()
+    # Busy routes have more comments on pages of their own
+    record.comments = len(page.comment_texts())
+
+    # Includes output from analysis of the route description and comments
+    words = get_text(page, record.name)
+
+    return record, words
+
+
+def parse_feed(feed_html):
+    ''' Finds the routes listed on a page of the "what's new" feed.
+
+    Args:
+        feed_html(bytes): HTML of one page of the feed
+
+    Returns:
+        route_urls(list): URL of each route, newest first, without repeats
+    '''
+
+    if not feed_html.strip():
+        return []
+    root = lxml_html.fromstring(feed_html)
+    route_urls = []
+    for url in XPATHS['feed_links'](root):
+        url = str(url).split('#')[0].split('?')[0]
+        if url not in route_urls:
+            route_urls.append(url)
+    return route_urls
+
+
+@click.group()
+def cli():
+    pass
+
+
+@cli.command()
+@click.argument('folder')
+def parity(folder):
+    ''' Checks that every backend parses the saved pages in FOLDER the same.
+
+    Pages are sorted into area and route pages by their file names, which
+    should hold 'route' for route pages, e.g. 'route-105717310.html'.
+    '''
+
+    mismatches = 0
+    files = sorted(name for name in os.listdir(folder)
+                   if name.endswith('.html'))
+    for name in files:
+        with open(os.path.join(folder, name), 'rb') as file:
+            html = file.read()
+
+        results = {}
+        for backend in BACKENDS:
+            try:
+                if 'route' in name:
+                    results[backend] = parse_route(name, html, backend)
+                else:
+                    results[backend] = parse_area_page(html, backend)
+            except Exception as error:
+                results[backend] = repr(error)
+
+        expected = results.pop('html.parser')
+        for backend, result in results.items():
+            if result != expected:
+                mismatches += 1
+                print(f'{name}: {backend} differs from html.parser')
+                print(f'    html.parser: {expected}')
+                print(f'    {backend}: {result}')
+
+    print(f'{len(files)} pages checked, {mismatches} mismatches')
+    sys.exit(1 if mismatches else 0)
+
+
+if __name__ == '__main__':
+    cli()
@@ -0,0 +1,392 @@
+# -*- coding: utf-8 -*-
+"""
+Summary:
+Local stand-in for Mountain Project, used to test and benchmark the crawler.
+
+Details:
+Measuring the crawler against the real website is slow, impolite and never
+gives the same result twice.  This server answers the same requests as
+Mountain Project with pages that use the same markup the crawler looks for
+(mp-sidebar, lef-nav-row, description-details, fr-view and so on), so a
+whole crawl can be run offline:
+
+    /route-guide - the climbing directory, listing every region
+    /area/<id>/<slug> - an area holding either sub-areas or routes
+    /route/<id>/<slug> - a route with its grades, stats, type, description
+        and first comments
+    /comments/forObject/Climb-Lib-Models-Route/<id>?offset=<n>&size=<n> -
+        a page of the comments on a busy route that do not fit on its page
+    /whats-new-more-data?offset=<n> - 36 routes, newest first
+
+The pages come from one of two places:
+
+    synthetic - A tree of regions, areas and routes generated from a seed.
+        The same options always give the same tree.
+    recorded - Pages saved in a PageArchive by an earlier crawl.  Links to
+        Mountain Project are rewritten to point at this server.
+
+Slow or unreliable servers can be imitated with added latency and randomly
+injected errors.  Responses carry an ETag and honour If-None-Match, so
+conditional requests can be tested too.
+
+    python MPTestServer.py serve --regions 3 --depth 2 --latency 0.05
+
+See MPBenchmark for timing a crawl against this server.
+"""
+
+from aiohttp import web
+from MPArchive import PageArchive
+from urllib.parse import urlencode
+import hashlib
+import asyncio
+import random
+import click
+
+
+MP_URL = 'https://www.mountainproject.com'
+
+# Words used to build route descriptions
+VOCABULARY = [
+    'crack', 'slab', 'overhang', 'jug', 'crimp', 'roof', 'arete', 'chimney',
+    'dihedral', 'pocket', 'sloper', 'flake', 'finger', 'hand', 'offwidth',
+    'traverse', 'mantle', 'bolt', 'anchor', 'ledge', 'corner', 'face',
+    'steep', 'thin', 'juggy', 'sustained', 'runout', 'classic', 'pump',
+    'start', 'climb', 'follow', 'left', 'right', 'top', 'great', 'route']
+
+ROPE_GRADES = ['5.6', '5.7', '5.8', '5.9', '5.10a', '5.10c', '5.11a', '5.11d',
+               '5.12b', '5.13a']
+BOULDER_GRADES = ['V0', 'V1', 'V2', 'V3', 'V4', 'V5', 'V6', 'V8', 'V10']
+
+# Number of routes on each page of the "what's new" feed
+FEED_PAGE_SIZE = 36
+# Most comments shown on a route page
+ROUTE_PAGE_COMMENTS = 5
+
+
+class SyntheticSite:
+    ''' Tree of regions, areas and routes generated from a seed.
+
+    Every region holds areas nested depth levels deep, each holding
+    branching sub-areas.  The areas at the bottom each hold a number of
+    routes.  A few busy routes have long comment threads.
+
+    Args:
+        regions(int): Number of regions in the route guide
+        branching(int): Number of sub-areas in each area
+        depth(int): Number of levels of areas below each region
+        routes(int): Number of routes in each area at the bottom
+        seed(int): Seed for the random names, grades and text
+    '''
+
+    def __init__(self, regions=3, branching=3, depth=2, routes=25, seed=0):
+        self.random = random.Random(seed)
+        # Kept apart, so the rest of the site is the same as before busy
+        # routes were added
+        self.thread_random = random.Random(seed + 1)
+        self.areas = {}
+        self.routes = {}
+        self.regions = []
+        for _ in range(regions):
+            self.regions.append(self._add_area(None, branching, depth, routes))
+
+    def _add_area(self, parent, branching, depth, routes):
+        area_id = len(self.areas) + 1
+        lat = round(self.random.uniform(25, 49), 5)
+        long = round(self.random.uniform(-124, -67), 5)
+        area = {
+            'name': f'Area {area_id}',
+            'parent': parent,
+            'latitude': lat,
+            'longitude': long,
+            'areas': [],
+            'routes': []}
+        self.areas[area_id] = area
+        if depth > 0:
+            for _ in range(branching):
+                area['areas'].append(
+                    self._add_area(area_id, branching, depth - 1, routes))
+        else:
+            for _ in range(routes):
+                area['routes'].append(self._add_route(area_id))
+        return area_id
+
+    def _add_route(self, area_id):
+        route_id = len(self.routes) + 1
+        rand = self.random
+        boulder = rand.random() < 0.3
+        if boulder:
+            types = 'Boulder'
+            grade = f'{rand.choice(BOULDER_GRADES)} YDS'
+        else:
+            types = ', '.join(rand.sample(['Trad', 'Sport', 'TR'],
+                                          rand.randint(1, 2)))
+            grade = f'{rand.choice(ROPE_GRADES)} YDS'
+            if rand.random() < 0.1:
+                grade += ' R'
+        pitches = rand.choice([1, 1, 1, 2, 3])
+        length = rand.randint(1, 30) * (10 if not boulder else 1)
+        details = f'{types}, {length} ft'
+        if pitches > 1:
+            details += f', {pitches} pitches'
+        self.routes[route_id] = {
+            'name': f'Route {route_id}',
+            'area': area_id,
+            'details': details,
+            'grade': grade,
+            'stars': round(rand.uniform(0, 4), 1),
+            'votes': rand.randint(0, 2000),
+            'description': ' '.join(rand.choices(VOCABULARY, k=60)),
+            'comments': [' '.join(rand.choices(VOCABULARY, k=15))
+                         for _ in range(rand.randint(0, 5))]}
+        if self.thread_random.random() < 0.05:
+            self.routes[route_id]['comments'] += [
+                ' '.join(self.thread_random.choices(VOCABULARY, k=15))
+                for _ in range(self.thread_random.randint(1, 100))]
+        return route_id
+
+    def area_url(self, base, area_id):
+        return f'{base}/area/{area_id}/area-{area_id}'
+
+    def route_url(self, base, route_id):
+        return f'{base}/route/{route_id}/route-{route_id}'
+
+    def breadcrumbs(self, base, area_id):
+        links = []
+        while area_id is not None:
+            area = self.areas[area_id]
+            links.insert(0, f'<a href="{self.area_url(base, area_id)}">'
+                            f'{area["name"]}</a>')
+            area_id = area['parent']
+        links.insert(0, f'<a href="{base}/route-guide">All Locations</a>')
+        return ('<div class="mb-half small text-warm">'
+                + ' &gt; '.join(links) + '</div>')
+
+    def route_guide(self, base):
+        rows = ''.join(
+            f'<div class="mb-half"><a href="{self.area_url(base, area_id)}">'
+            f'{self.areas[area_id]["name"]}</a></div>'
+            for area_id in self.regions)
+        return (f'<html><body><h1>Route Guide</h1>'
+                f'<div id="route-guide">{rows}</div></body></html>')
+
+    def area_page(self, base, area_id):
+        area = self.areas.get(area_id)
+        if area is None:
+            return None
+        if area['areas']:
+            rows = ''.join(
+                f'<div class="lef-nav-row"><a href="'
+                f'{self.area_url(base, sub_id)}">'
+                f'{self.areas[sub_id]["name"]}</a></div>'
+                for sub_id in area['areas'])
+            sidebar = f'<div class="mp-sidebar">{rows}</div>'
+        else:
+            rows = ''.join(
+                f'<tr><td><a href="{self.route_url(base, route_id)}">'
+                f'{self.routes[route_id]["name"]}</a></td>'
+                f'<td class="route-score">*</td></tr>'
+                for route_id in area['routes'])
+            sidebar = (
+                '<div class="mp-sidebar"><div class="max-height '
+                'max-height-md-0 max-height-xs-150"><table>'
+                f'{rows}</table></div></div>')
+        # Regions have no location
+        details = ''
+        if area['parent'] is not None:
+            details = (
+                '<table class="description-details"><tr><td>GPS:</td>'
+                f'<td>{area["latitude"]}, {area["longitude"]} Google Map'
+                '</td></tr></table>')
+        crumbs = self.breadcrumbs(base, area['parent'])
+        return (f'<html><body>{crumbs}<h1>{area["name"]}</h1>{details}'
+                f'{sidebar}</body></html>')
+
+    def route_page(self, base, route_id):
+        route = self.routes.get(route_id)
+        if route is None:
+            return None
+        comments = self.comment_divs(
+            route['comments'][:ROUTE_PAGE_COMMENTS])
+        return (
+            f'<html><body>{self.breadcrumbs(base, route["area"])}'
+            f'<h1>{route["name"]}</h1>'
+            f'<h2 class="inline-block mr-2">{route["grade"]}</h2>'
+            '<table><tr><td class="show-for-small">'
+            '<a class="show-tooltip" title="View Stats">'
+            f'Avg: {route["stars"]} from {route["votes"]} votes</a>'
+            '</td></tr></table>'
+            '<table class="description-details"><tr><td>Type:</td>'
+            f'<td>{route["details"]}</td></tr></table>'
+            f'<div class="fr-view">{route["description"]}</div>'
+            f'{comments}</body></html>')
+
+    def comment_divs(self, comments):
+        return ''.join(
+            '<div class="comment-body max-height max-height-md-300 '
+            f'max-height-xs-150">{comment}\n Jan 1, 2019</div>'
+            for comment in comments)
+
+    def comments_page(self, route_id, offset, size):
+        route = self.routes.get(route_id)
+        if route is None:
+            return None
+        comments = route['comments'][offset:offset + size]
+        return f'<div class="comments">{self.comment_divs(comments)}</div>'
+
+    def feed_page(self, base, offset):
+        newest = sorted(self.routes, reverse=True)
+        rows = ''.join(
+            f'<div><a href="{self.route_url(base, route_id)}">'
+            f'{self.routes[route_id]["name"]}</a></div>'
+            for route_id in newest[offset:offset + FEED_PAGE_SIZE])
+        return f'<html><body>{rows}</body></html>'
+
+    def page(self, base, path, query):
+        ''' Builds the page at a path.
+
+        Args:
+            base(str): URL of this server, used in links
+            path(str): Path of the request
+            query(Mapping): Query string of the request
+
+        Returns:
+            html(str): The page, or None if there is no such page
+        '''
+
+        parts = path.strip('/').split('/')
+        try:
+            if parts == ['route-guide']:
+                return self.route_guide(base)
+            if parts[0] == 'area':
+                return self.area_page(base, int(parts[1]))
+            if parts[0] == 'route':
+                return self.route_page(base, int(parts[1]))
+            if parts == ['whats-new-more-data']:
+                return self.feed_page(base, int(query.get('offset', 0)))
+            if parts[:3] == ['comments', 'forObject',
+                             'Climb-Lib-Models-Route']:
+                return self.comments_page(
+                    int(parts[3]), int(query.get('offset', 0)),
+                    int(query.get('size', 20)))
+        except (IndexError, ValueError):
+            pass
+        return None
+
+
+class RecordedSite:
+    ''' Pages recorded in a PageArchive by an earlier crawl.
+
+    Args:
+        path(str): Location of the archive
+    '''
+
+    def __init__(self, path):
+        self.archive = PageArchive(path)
+
+    def page(self, base, path, query):
+        url = MP_URL + path
+        if query:
+            url += '?' + urlencode(list(query.items()))
+        html = self.archive.get(url)
+        if html is None:
+            return None
+        return html.replace(MP_URL.encode(), base.encode())
+
+
+def make_app(site, base, latency=0.0, jitter=0.0, error_rate=0.0,
+             missing_rate=0.0, seed=0):
+    ''' Creates the web application serving a site.
+
+    Args:
+        site(SyntheticSite or RecordedSite): Pages to serve
+        base(str): URL of this server, used in links
+        latency(float): Average seconds added to every response
+        jitter(float): Standard deviation of the added latency
+        error_rate(float): Share of requests answered with 503
+        missing_rate(float): Share of requests answered with 404
+        seed(int): Seed for the latency and injected errors
+
+    Returns:
+        app(aiohttp Application): The server application
+    '''
+
+    rand = random.Random(seed)
+    counts = {'requests': 0, 'errors': 0, 'not_modified': 0}
+
+    async def handle(request):
+        counts['requests'] += 1
+        delay = max(0.0, rand.gauss(latency, jitter)) if latency else 0.0
+        if delay:
+            await asyncio.sleep(delay)
+
+        roll = rand.random()
+        if roll < error_rate:
+            counts['errors'] += 1
+            return web.Response(status=503, text='Service Unavailable')
+        if roll < error_rate + missing_rate:
+            counts['errors'] += 1
+            return web.Response(status=404, text='Not Found')
+
+        html = site.page(base, request.path, request.query)
+        if html is None:
+            return web.Response(status=404, text='Not Found')
+        if isinstance(html, str):
+            html = html.encode()
+        etag = '"' + hashlib.md5(html).hexdigest() + '"'
+        if request.headers.get('If-None-Match') == etag:
+            counts['not_modified'] += 1
+            return web.Response(status=304, headers={'ETag': etag})
+        return web.Response(body=html, content_type='text/html',
+                            headers={'ETag': etag})
+
+    async def stats(request):
+        return web.json_response(counts)
+
+    app = web.Application()
+    app.router.add_get('/_stats', stats)
+    app.router.add_get('/{tail:.*}', handle)
+    return app
+
+
+@click.group()
+def cli():
+    pass
+
+
+@cli.command()
+@click.option('--host', default='127.0.0.1')
+@click.option('--port', default=8765)
+@click.option('--regions', default=3, help='Number of regions.')
+@click.option('--branching', default=3, help='Sub-areas in each area.')
+@click.option('--depth', default=2, help='Levels of areas below a region.')
+@click.option('--routes', default=25, help='Routes in each bottom area.')
+@click.option('--seed', default=0, help='Seed for the generated site.')
+@click.option('--archive', default=None,
+              help='Serve pages recorded in this PageArchive instead.')
+@click.option('--latency', default=0.0,
+              help='Average seconds added to each response.')
+@click.option('--jitter', default=0.0,
+              help='Standard deviation of the added latency.')
+@click.option('--error-rate', default=0.0,
+              help='Share of requests answered with 503.')
+@click.option('--missing-rate', default=0.0,
+              help='Share of requests answered with 404.')
+def serve(host, port, regions, branching, depth, routes, seed, archive,
+          latency, jitter, error_rate, missing_rate):
+    ''' Serves a synthetic or recorded copy of Mountain Project.'''
+
+    base = f'http://{host}:{port}'
+    if archive:
+        site = RecordedSite(archive)
+        print(f'Serving pages from {archive}')
+    else:
+        site = SyntheticSite(regions, branching, depth, routes, seed)
+        print(f'Serving {len(site.areas)} areas and {len(site.routes)} '
+              f'routes')
+    app = make_app(site, base, latency, jitter, error_rate, missing_rate,
+                   seed)
+    web.run_app(app, host=host, port=port, print=None)
+
+
+if __name__ == '__main__':
+    cli()
@@ -0,0 +1,424 @@
+# -*- coding: utf-8 -*-
+"""
+Summary:
+Term-Frequency-Inverse-Document-Frequency of route text with sparse
+matrices.
+
+Details:
+The words of every route are stored in the Words table as
+(route_id, word_id, tf), with the word itself in the Vocabulary (see
+MPVocabulary).  MPAnalyzer used to turn them into TFIDF with three
+passes of pandas groupby, handling one group at a time: dropping words that
+are too rare or too common, finding the IDF of each word, and normalizing
+each route.  At the size of the whole corpus, each pass took hours.
+
+Here the routes and word ids are first numbered, and the table becomes a
+sparse term-frequency matrix with one row per route and one column per word.
+Each pass is then a single operation on the whole matrix:
+
+    document frequency - Number of values stored in each column
+    IDF - 1 + log(N / document frequency), for words found in more than
+        min_occur and fewer than max_occur routes.  Other words are dropped.
+    TFIDF - Each value times the IDF of its column
+    normalization - Each row divided by its length, so every route is a unit
+        vector
+
+The results are the same as those of the groupby passes, which MPBenchmark
+keeps to check the two against each other.
+
+Routes are scored against the archetype of each climbing style the same way.
+With the routes as a sparse route x word matrix and the archetypes as a dense
+word x style matrix, the cosine similarity of every route with every style is
+one matrix product, worked out a chunk of routes at a time.  See MPBenchmark
+for checking it against scoring one route at a time.
+
+Only integers and floats are read from the database, streamed with COPY, and
+only integers and floats are written back: the TFIDF table holds
+(route_id, word_id, tfidfn), and the IDF of each word is kept once in the
+Vocabulary rather than on every row.  The term-frequency matrix can also be
+saved to a compressed NumPy file holding just its arrays and the word of each
+column, for analysis away from the database:
+
+    python MPTfidf.py export --output terms.npz
+"""
+
+from scipy import sparse
+import pandas as pd
+import numpy as np
+import psycopg2
+import click
+import time
+import io
+
+
+def read_words(conn, route_ids=None):
+    ''' Reads the term-frequency of every word of every route.
+
+    The rows are streamed with COPY and parsed by pandas, which is much
+    faster than building a Python tuple for each of them.
+
+    Args:
+        conn(psycopg2 connection): Connection to the routes database
+        route_ids(list): Optional. Only the words of these routes are read
+
+    Returns:
+        words(pandas Dataframe): Columns route_id, word_id and tf, with a
+            row for each word of each route
+    '''
+
+    cursor = conn.cursor()
+    query = 'SELECT route_id, word_id, tf FROM Words'
+    if route_ids is not None:
+        query = cursor.mogrify(
+            query + ' WHERE route_id = ANY(%s)',
+            (list(route_ids),)).decode()
+    rows = io.StringIO()
+    cursor.copy_expert(
+        f'COPY ({query}) TO STDOUT WITH (FORMAT csv)', rows)
+    rows.seek(0)
+    return pd.read_csv(
+        rows, names=['route_id', 'word_id', 'tf'],
+        dtype={'route_id': np.int64, 'word_id': np.int32, 'tf': np.float64})
+
+
+def term_matrix(route_ids, words, tf):
+    ''' Builds a sparse term-frequency matrix from the rows of Words.
+
+    Args:
+        route_ids(array): Route id of each row
+        words(array): Word id of each row
+        tf(array): Term-frequency of each row
+
+    Returns:
+        matrix(csr_matrix): Term-frequency with one row per route and one
+            column per word.  A word stored twice for a route is kept twice,
+            as it was by the groupby passes.
+        routes(array): Route id of each row of the matrix
+        vocabulary(array): Word id of each column of the matrix
+    '''
+
+    rows, routes = pd.factorize(np.asarray(route_ids))
+    columns, vocabulary = pd.factorize(np.asarray(words))
+    # Sorted by route, keeping the order of the words within each route
+    order = np.argsort(rows, kind='stable')
+    indptr = np.zeros(len(routes) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=len(routes)), out=indptr[1:])
+    matrix = sparse.csr_matrix(
+        (np.asarray(tf, dtype=float)[order], columns[order], indptr),
+        shape=(len(routes), len(vocabulary)))
+    return matrix, routes, vocabulary
+
+
+def tfidf_matrix(matrix, num_docs, min_occur, max_occur):
+    ''' Finds the normalized TFIDF of every word in every route.
+
+    Args:
+        matrix(csr_matrix): Term-frequency from term_matrix
+        num_docs(int): Number of routes in the corpus
+        min_occur(float): Words must be found in more than this many routes
+        max_occur(float): Words must be found in fewer than this many routes
+
+    Returns:
+        tfidfn(csr_matrix): Normalized TFIDF, without the dropped words
+        idf(array): IDF of each column, or 0 for the dropped words
+    '''
+
+    # Counts the values stored for each word, so a word stored twice for a
+    # route counts twice, as it did in the groupby passes
+    doc_freq = np.bincount(matrix.indices, minlength=matrix.shape[1])
+    keep = (min_occur < doc_freq) & (doc_freq < max_occur)
+    idf = np.zeros(matrix.shape[1])
+    idf[keep] = 1 + np.log(num_docs / doc_freq[keep])
+    return scale_tfidf(matrix, idf), idf
+
+
+def scale_tfidf(matrix, idf):
+    ''' Weights every word by its IDF and normalizes each route.
+
+    Args:
+        matrix(csr_matrix): Term-frequency from term_matrix
+        idf(array): IDF of each column, or 0 for words that are dropped
+
+    Returns:
+        tfidfn(csr_matrix): Normalized TFIDF, without the dropped words
+    '''
+
+    tfidfn = matrix.copy()
+    tfidfn.data = matrix.data * idf[matrix.indices]
+    tfidfn.eliminate_zeros()
+    lengths = np.sqrt(np.asarray(tfidfn.power(2).sum(axis=1)).ravel())
+    # Routes left without any words have no values to divide
+    tfidfn.data /= np.repeat(lengths, np.diff(tfidfn.indptr))
+    return tfidfn
+
+
+def tfidf_frame(tfidfn, idf, routes, vocabulary):
+    ''' Lists the normalized TFIDF of each word in each route.
+
+    Args:
+        tfidfn(csr_matrix): Normalized TFIDF from tfidf_matrix
+        idf(array): IDF of each column
+        routes(array): Route id of each row
+        vocabulary(array): Word id of each column
+
+    Returns:
+        routes(pandas Dataframe): Index route_id and columns word_id, idf and
+            tfidfn, with a row for each word of each route
+    '''
+
+    rows = np.repeat(np.arange(tfidfn.shape[0]), np.diff(tfidfn.indptr))
+    return pd.DataFrame(
+        {'word_id': np.asarray(vocabulary)[tfidfn.indices],
+         'idf': idf[tfidfn.indices],
+         'tfidfn': tfidfn.data},
+        index=pd.Index(np.asarray(routes)[rows], name='route_id'))
+
+
+def cosine_scores(routes, archetypes, chunk_size=50000):
+    ''' Finds the cosine similarity of every route with every archetype.
+
+    Both the routes and the archetypes are unit vectors of normalized TFIDF,
+    so their cosine similarity is their dot product:
+
+                    Cosine Similarity = Σ(ai * bi)
+
+                    ai = TFIDF for a word in the route description
+                    bi = TFIDF for the same word in the archetype document
+
+    Words that are not in any archetype add nothing, so they are left out of
+    the route matrix.
+
+    Args:
+        routes(pandas Series): Normalized TFIDF with index route_id and
+            word_id
+        archetypes(pandas Dataframe): Normalized TFIDF with index word_id and
+            a column for each style
+        chunk_size(int): Number of routes multiplied at a time, which bounds
+            the memory used by the dense results of each product
+
+    Returns:
+        scores(pandas Dataframe): Index route_id and a column of cosine
+            similarity for each style.  Routes that share no words with the
+            archetypes score 0.
+    '''
+
+    route_ids = routes.index.get_level_values('route_id')
+    words = routes.index.get_level_values('word_id')
+    rows, route_index = pd.factorize(route_ids)
+    columns = archetypes.index.get_indexer(words)
+    shared = columns >= 0
+    matrix = sparse.csr_matrix(
+        (routes.values[shared], (rows[shared], columns[shared])),
+        shape=(len(route_index), len(archetypes)))
+    # A word missing from the description of a style adds nothing to it
+    styles = archetypes.fillna(0).values
+
+    scores = np.empty((matrix.shape[0], styles.shape[1]))
+    for start in range(0, matrix.shape[0], chunk_size):
+        stop = start + chunk_size
+        scores[start:stop] = matrix[start:stop] @ styles
+    return pd.DataFrame(
+        scores, columns=archetypes.columns,
+        index=pd.Index(route_index, name='route_id'))
+
+
+def read_idf(conn, vocabulary):
+    ''' Reads the IDF stored in the Vocabulary by the last full TFIDF run.
+
+    Args:
+        conn(psycopg2 connection): Connection to the routes database
+        vocabulary(array): Word id of each column
+
+    Returns:
+        idf(array): IDF of each column, or 0 for words that were not scored
+    '''
+
+    cursor = conn.cursor()
+    cursor.execute('''
+        SELECT word_id, idf
+        FROM Vocabulary
+        WHERE word_id = ANY(%s)
+        AND idf IS NOT NULL''', ([int(word_id) for word_id in vocabulary],))
+    stored = dict(cursor.fetchall())
+    return np.array([stored.get(word_id, 0.0) for word_id in vocabulary])
+
+
+def copy_tfidf(cursor, routes, chunk_size=1000000):
+    ''' Writes rows of the TFIDF table with COPY.
+
+    Args:
+        cursor(psycopg2 cursor): Cursor on the routes database
+        routes(pandas Dataframe): Normalized TFIDF from tfidf_frame
+        chunk_size(int): Number of rows held as text at a time
+    '''
+
+    routes = routes[['word_id', 'tfidfn']]
+    for start in range(0, len(routes), chunk_size):
+        rows = io.StringIO()
+        routes.iloc[start:start + chunk_size].to_csv(rows, header=False)
+        rows.seek(0)
+        cursor.copy_expert(
+            'COPY "TFIDF"(route_id, word_id, tfidfn) '
+            'FROM STDIN WITH (FORMAT csv)', rows)
+
+
+def write_tfidf(conn, routes, commit=True):
+    ''' Replaces the TFIDF table, writing it with COPY.
+
+    The table keeps the name and index that pandas' to_sql gave it, but only
+    holds ids and the normalized TFIDF.  The IDF of each word is written to
+    the Vocabulary by write_idf.
+
+    Args:
+        conn(psycopg2 connection): Connection to the routes database
+        routes(pandas Dataframe): Normalized TFIDF from tfidf_frame
+        commit(bool): Optional. Commits the table once it is written
+    '''
+
+    cursor = conn.cursor()
+    cursor.execute('DROP TABLE IF EXISTS "TFIDF"')
+    cursor.execute('''
+        CREATE TABLE "TFIDF"(
+            route_id INTEGER,
+            word_id INTEGER,
+            tfidfn FLOAT)''')
+    copy_tfidf(cursor, routes)
+    # Built once the rows are in, which is faster than keeping it up to date
+    cursor.execute('CREATE INDEX "ix_TFIDF_route_id" ON "TFIDF"(route_id)')
+    if commit:
+        conn.commit()
+
+
+def replace_tfidf(conn, routes, route_ids):
+    ''' Replaces the TFIDF of some routes, leaving the other routes alone.
+
+    Does not commit, so the routes can be marked as updated in the same
+    transaction.
+
+    Args:
+        conn(psycopg2 connection): Connection to the routes database
+        routes(pandas Dataframe): Normalized TFIDF from tfidf_frame
+        route_ids(list): Routes whose rows are replaced, including routes
+            that no longer have any words
+    '''
+
+    cursor = conn.cursor()
+    cursor.execute('DELETE FROM "TFIDF" WHERE route_id = ANY(%s)',
+                   (list(route_ids),))
+    copy_tfidf(cursor, routes)
+
+
+def write_idf(conn, idf, vocabulary, commit=True):
+    ''' Stores the IDF of each word in the Vocabulary.
+
+    Words that were dropped for being too rare or too common are left with
+    no IDF, as they are left out of the TFIDF table.
+
+    Args:
+        conn(psycopg2 connection): Connection to the routes database
+        idf(array): IDF of each column, from tfidf_matrix
+        vocabulary(array): Word id of each column
+        commit(bool): Optional. Commits the IDF once it is written
+    '''
+
+    scored = idf > 0
+    rows = io.StringIO()
+    pd.DataFrame({'word_id': np.asarray(vocabulary)[scored],
+                  'idf': idf[scored]}).to_csv(rows, header=False, index=False)
+    rows.seek(0)
+
+    cursor = conn.cursor()
+    cursor.execute('''
+        CREATE TEMP TABLE WordIdf(
+            word_id INTEGER,
+            idf FLOAT)
+        ON COMMIT DROP''')
+    cursor.copy_expert(
+        'COPY WordIdf(word_id, idf) FROM STDIN WITH (FORMAT csv)', rows)
+    cursor.execute('UPDATE Vocabulary SET idf = NULL WHERE idf IS NOT NULL')
+    cursor.execute('''
+        UPDATE Vocabulary
+        SET idf = WordIdf.idf
+        FROM WordIdf
+        WHERE Vocabulary.word_id = WordIdf.word_id''')
+    if commit:
+        conn.commit()
+
+
+def save_term_matrix(path, matrix, routes, vocabulary, words):
+    ''' Saves a term-frequency matrix to a compressed NumPy file.
+
+    Args:
+        path(str): File to write, ending in .npz
+        matrix(csr_matrix): Term-frequency from term_matrix
+        routes(array): Route id of each row
+        vocabulary(array): Word id of each column
+        words(list): Word of each column
+    '''
+
+    np.savez_compressed(
+        path,
+        data=matrix.data,
+        indices=matrix.indices.astype(np.int32),
+        indptr=matrix.indptr,
+        shape=np.array(matrix.shape),
+        routes=np.asarray(routes, dtype=np.int64),
+        vocabulary=np.asarray(vocabulary, dtype=np.int32),
+        words=np.asarray(words, dtype=str))
+
+
+def load_term_matrix(path):
+    ''' Loads a term-frequency matrix saved by save_term_matrix.
+
+    Args:
+        path(str): File written by save_term_matrix
+
+    Returns:
+        matrix(csr_matrix): Term-frequency with one row per route and one
+            column per word
+        routes(array): Route id of each row
+        vocabulary(array): Word id of each column
+        words(array): Word of each column
+    '''
+
+    with np.load(path) as saved:
+        matrix = sparse.csr_matrix(
+            (saved['data'], saved['indices'], saved['indptr']),
+            shape=tuple(saved['shape']))
+        return matrix, saved['routes'], saved['vocabulary'], saved['words']
+
+
+@click.group()
+def cli():
+    pass
+
+
+@cli.command()
+@click.option('--output', default='terms.npz',
+              help='File the term-frequency matrix is written to.')
+def export(output):
+    ''' Writes the term-frequency matrix of every route to a compressed
+    file.'''
+
+    # Only needed to connect, so the helpers above can be imported without
+    # a local config
+    from config import config
+    conn = psycopg2.connect(**config.config())
+    cursor = conn.cursor()
+    start = time.perf_counter()
+    words = read_words(conn)
+    matrix, routes, vocabulary = term_matrix(
+        words['route_id'], words['word_id'], words['tf'])
+    del words
+    cursor.execute('SELECT word_id, word FROM Vocabulary')
+    text = dict(cursor.fetchall())
+    save_term_matrix(output, matrix, routes, vocabulary,
+                     [text[word_id] for word_id in vocabulary])
+    conn.close()
+    click.echo(f'{matrix.shape[0]:,} routes x {matrix.shape[1]:,} words, '
+               f'{matrix.nnz:,} values written to {output} in '
+               f'{time.perf_counter() - start:.1f}s')
+
+
+if __name__ == '__main__':
+    cli()
@@ -0,0 +1,316 @@
+# -*- coding: utf-8 -*-
+"""
+Summary:
+Numbers every stemmed word, so the Words and TFIDF tables store integers.
+
+Details:
+The Words and TFIDF tables hold a row for every word of every route, tens of
+millions of rows in all, and each row used to repeat the word itself as
+text.  The text took up most of the space of each table, and every query
+that matched words compared strings.  Instead, each word is stored once in
+the 'Vocabulary' table:
+
+    word_id - a unique number for the word
+    word - the stemmed word
+    idf - Inverse-Document-Frequency of the word, written by MPAnalyzer.
+        NULL for words that were too rare or too common to be scored.
+
+Words and TFIDF only hold the word_id.  The crawler looks the ids up through
+a VocabularyCache, so each word is looked up in the database once per
+process rather than once per route, and adds the words it has not seen
+before as it writes them.
+
+Tables written before the Vocabulary existed have to be converted before
+the crawler will write to them.  Converting rewrites the whole of both
+tables while holding their locks, so it is only done by hand, with the
+crawlers stopped, and the size of the tables can be checked before and
+after:
+
+    python MPVocabulary.py sizes
+    python MPVocabulary.py migrate
+    python MPVocabulary.py sizes
+
+The term-frequency matrix of the whole corpus can be exported to one
+compressed file of integer and float arrays, for analysis away from the
+database (see MPTfidf.save_term_matrix):
+
+    python MPTfidf.py export --output terms.npz
+"""
+
+import psycopg2
+import click
+import time
+
+
+# Tables holding a row for every word of every route, as they are named in
+# to_regclass
+WORD_TABLES = ('Words', '"TFIDF"', 'Vocabulary')
+# Tables that stored words as text, as they are named in information_schema
+TEXT_TABLES = ('words', 'TFIDF', 'tfidf')
+
+
+def create_vocabulary(cursor):
+    ''' Creates the Vocabulary table if it does not exist.
+
+    Args:
+        cursor(psycopg2 cursor): Cursor on the routes database
+    '''
+
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS Vocabulary(
+            word_id SERIAL PRIMARY KEY,
+            word TEXT UNIQUE NOT NULL,
+            idf FLOAT)''')
+
+
+def check_vocabulary(cursor):
+    ''' Makes sure no table still stores words as text, so routes can be
+    written by word_id.
+
+    Args:
+        cursor(psycopg2 cursor): Cursor on the routes database
+
+    Raises:
+        RuntimeError: If a table has to be converted with
+            'python MPVocabulary.py migrate' first
+    '''
+
+    tables = [table for table in TEXT_TABLES
+              if has_column(cursor, table, 'word')]
+    if tables:
+        raise RuntimeError(
+            f'{", ".join(tables)} still store words as text.  Stop every '
+            'crawler and run "python MPVocabulary.py migrate" first.')
+
+
+def has_column(cursor, table, column):
+    ''' Checks whether a table has a column.
+
+    Args:
+        cursor(psycopg2 cursor): Cursor on the routes database
+        table(str): Name of the table as it is stored, such as 'words' or
+            'TFIDF'
+        column(str): Name of the column
+
+    Returns:
+        has_column(bool): True if the table exists and has the column
+    '''
+
+    cursor.execute('''
+        SELECT EXISTS(
+            SELECT 1
+            FROM information_schema.columns
+            WHERE table_schema = current_schema()
+            AND table_name = %s
+            AND column_name = %s)''', (table, column))
+    return cursor.fetchone()[0]
+
+
+def migrate_words(cursor):
+    ''' Replaces the words stored as text in the Words and TFIDF tables with
+    their word_id.
+
+    Each table is copied into a new one holding word ids, which is much
+    faster than updating every row in place and leaves no dead rows behind.
+    The IDF of each word moves from TFIDF to the Vocabulary.  Tables that
+    already hold word ids are left alone.
+
+    Args:
+        cursor(psycopg2 cursor): Cursor on the routes database
+
+    Returns:
+        tables(list): Names of the tables converted, quoted if their name is
+            not in lower case
+    '''
+
+    migrated = []
+    if has_column(cursor, 'words', 'word'):
+        cursor.execute('''
+            INSERT INTO Vocabulary(word)
+            SELECT DISTINCT word FROM Words
+            WHERE word IS NOT NULL
+            ORDER BY word
+            ON CONFLICT DO NOTHING''')
+        cursor.execute('''
+            CREATE TABLE WordIds AS
+            SELECT route_id, word_id, word_count, tf
+            FROM Words
+            JOIN Vocabulary USING (word)''')
+        cursor.execute('DROP TABLE Words')
+        cursor.execute('ALTER TABLE WordIds RENAME TO Words')
+        # The index MPWriter.create_words_index adds, dropped with the table
+        cursor.execute(
+            'CREATE INDEX IF NOT EXISTS words_route_id ON Words(route_id)')
+        migrated.append('Words')
+
+    if has_column(cursor, 'TFIDF', 'word'):
+        cursor.execute('''
+            UPDATE Vocabulary
+            SET idf = scored.idf
+            FROM (SELECT DISTINCT ON (word) word, idf FROM "TFIDF") scored
+            WHERE Vocabulary.word = scored.word''')
+        cursor.execute('''
+            CREATE TABLE "TFIDFIds" AS
+            SELECT route_id, word_id, tfidfn
+            FROM "TFIDF"
+            JOIN Vocabulary USING (word)''')
+        cursor.execute('DROP TABLE "TFIDF"')
+        cursor.execute('ALTER TABLE "TFIDFIds" RENAME TO "TFIDF"')
+        cursor.execute(
+            'CREATE INDEX "ix_TFIDF_route_id" ON "TFIDF"(route_id)')
+        migrated.append('"TFIDF"')
+
+    # The crawler's own TFIDF table is created empty and never written
+    if has_column(cursor, 'tfidf', 'word'):
+        cursor.execute('''
+            ALTER TABLE TFIDF
+                DROP COLUMN word,
+                ADD COLUMN word_id INTEGER''')
+    return migrated
+
+
+def lookup_words(cursor, words):
+    ''' Finds the word_id of each word that is in the Vocabulary.
+
+    Args:
+        cursor(psycopg2 cursor): Cursor on the routes database
+        words(list): Stemmed words
+
+    Returns:
+        word_ids(dict): word_id of each word, without the words that are not
+            in the Vocabulary
+    '''
+
+    cursor.execute(
+        'SELECT word, word_id FROM Vocabulary WHERE word = ANY(%s)',
+        (list(words),))
+    return dict(cursor.fetchall())
+
+
+class VocabularyCache:
+    ''' Word ids already looked up, so each word only goes to the database
+    once.
+
+    New words are added to the Vocabulary in the transaction that writes
+    them.  Until that transaction is committed, their ids are held as
+    pending, so they can be forgotten if it is rolled back.
+
+    Args:
+        cursor(psycopg2 cursor): Cursor on the routes database
+    '''
+
+    def __init__(self, cursor):
+        self.cursor = cursor
+        self.ids = {}
+        self.pending = set()
+
+    def lookup(self, words):
+        ''' Makes sure every word has an id in ids, adding new words to the
+        Vocabulary.
+
+        Args:
+            words(set): Stemmed words
+        '''
+
+        missing = [word for word in words if word not in self.ids]
+        if not missing:
+            return
+        # Added in order, so crawlers adding the same words at once lock
+        # them in the same order and cannot deadlock
+        self.cursor.execute('''
+            INSERT INTO Vocabulary(word)
+            SELECT word FROM unnest(%s::text[]) AS word
+            ORDER BY word
+            ON CONFLICT DO NOTHING''', (missing,))
+        found = lookup_words(self.cursor, missing)
+        self.ids.update(found)
+        self.pending.update(found)
+
+    def keep(self):
+        ''' Keeps the pending ids once their transaction is committed.'''
+
+        self.pending = set()
+
+    def discard(self):
+        ''' Forgets the pending ids once their transaction is rolled back.'''
+
+        for word in self.pending:
+            del self.ids[word]
+        self.pending = set()
+
+
+def table_sizes(cursor, tables=WORD_TABLES):
+    ''' Measures the space used by tables and their indexes.
+
+    Args:
+        cursor(psycopg2 cursor): Cursor on the routes database
+        tables(tuple): Names of the tables, quoted if their name is not in
+            lower case
+
+    Returns:
+        sizes(dict): (rows, table bytes, index bytes) for each table that
+            exists.  The number of rows is PostgreSQL's estimate.
+    '''
+
+    sizes = {}
+    for table in tables:
+        cursor.execute('''
+            SELECT
+                reltuples::BIGINT,
+                pg_table_size(oid),
+                pg_indexes_size(oid)
+            FROM pg_class
+            WHERE oid = to_regclass(%s)''', (table,))
+        row = cursor.fetchone()
+        if row is not None:
+            sizes[table] = row
+    return sizes
+
+
+@click.group()
+def cli():
+    pass
+
+
+@cli.command()
+def sizes():
+    ''' Prints the size of the Words, TFIDF and Vocabulary tables.'''
+
+    # Only needed to connect, so the helpers above can be imported without
+    # a local config
+    from config import config
+    conn = psycopg2.connect(**config.config())
+    cursor = conn.cursor()
+    click.echo(f'{"table":<12}{"rows":>14}{"table MB":>12}{"index MB":>12}')
+    for table, (rows, size, index_size) in table_sizes(cursor).items():
+        name = table.strip('"')
+        click.echo(f'{name:<12}{rows:>14,}'
+                   f'{size / 2 ** 20:>12,.1f}{index_size / 2 ** 20:>12,.1f}')
+    conn.close()
+
+
+@cli.command()
+def migrate():
+    ''' Converts Words and TFIDF tables that store words as text.  Stop
+    every crawler first.'''
+
+    from config import config
+    conn = psycopg2.connect(**config.config())
+    cursor = conn.cursor()
+    start = time.perf_counter()
+    create_vocabulary(cursor)
+    migrated = migrate_words(cursor)
+    conn.commit()
+    # Reclaims the space and refreshes the row estimates used by sizes
+    conn.autocommit = True
+    cursor.execute('VACUUM ANALYZE Vocabulary')
+    for table in migrated:
+        cursor.execute(f'VACUUM ANALYZE {table}')
+    migrated = [table.strip('"') for table in migrated]
+    click.echo(f'Converted {", ".join(migrated) or "nothing"} in '
+               f'{time.perf_counter() - start:.1f}s')
+    conn.close()
+
+
+if __name__ == '__main__':
+    cli()
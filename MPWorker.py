@@ -0,0 +1,406 @@
+# -*- coding: utf-8 -*-
+"""
+Summary:
+Runs many crawlers at once, on one machine or several.
+
+Details:
+Crawlers only coordinate through the database.  Each one claims batches of
+areas and routes from the shared frontier (see MPFrontier), so a crawl can be
+sped up by starting more crawlers on the same machine or on other machines
+pointed at the same PostgreSQL database.
+
+Starting a single crawler:
+
+    python MPWorker.py work --worker-id laptop-1
+
+Starting and watching four crawlers on this machine:
+
+    python MPWorker.py supervise --workers 4
+
+Rebuilding the Routes and Words tables from the pages saved by earlier crawls,
+after a change to the parser:
+
+    python MPWorker.py work --reparse
+
+Refreshing a finished crawl.  Pages that have not changed since they were
+last downloaded are skipped (see MPCache).  The requeued pages are scored so
+that popular regions and pages that have not been crawled for longest come
+first (see MPFrontier.prioritize), so a crawl with a time limit refreshes the
+data that matters most:
+
+    python MPWorker.py refresh
+    python MPWorker.py work --time-limit 3600
+
+Route pages that changed are written over the stored routes and their
+words as they are crawled.
+
+Listing the pages that were given up on, and queueing them to be crawled
+again once the problem has passed:
+
+    python MPWorker.py dead-letters
+    python MPWorker.py dead-letters --retry
+
+Every crawler runs as part of a session, named after the worker unless
+--session-id is given.  A session that was stopped carries on where it left
+off when a crawler is started with the same name, and the pages it had in
+flight are claimed again at once.  Listing the sessions, with the pages each
+has done and, for the latest, the estimated time to finish:
+
+    python MPWorker.py work --session-id full-crawl
+    python MPWorker.py sessions
+
+The words of busy routes can be filled out with the comments that do not fit
+on the route page, up to a number of comment pages for each route:
+
+    python MPWorker.py work --comment-pages 3
+
+Adding only the routes posted since the last crawl (see
+MPRouteCrawler.whats_new):
+
+    python MPWorker.py whats-new
+
+The supervisor restarts any crawler that dies, and every interval prints the
+throughput of every crawler in the Workers table, including those started on
+other machines.  It stops once all of its crawlers have finished.
+
+Each crawler can also publish detailed metrics, such as pages per second,
+queue depths and the time spent in each stage (see MPMetrics).  With
+--metrics-dir, the supervisor has every crawler write them to a JSON file
+named after the crawler:
+
+    python MPWorker.py supervise --workers 4 --metrics-dir metrics
+"""
+
+from MPRouteCrawler import MPScraper
+from MPRouteCrawler import reparse
+from MPRouteCrawler import whats_new as crawl_whats_new
+from MPFrontier import create_workers
+from MPFrontier import create_sessions
+from MPFrontier import list_sessions
+from MPFrontier import session_progress
+from MPFrontier import requeue
+from MPFrontier import prioritize as prioritize_frontier
+from MPFrontier import dead_letters as list_dead_letters
+from MPFrontier import retry_dead_letters
+from config import config
+import subprocess
+import datetime
+import psycopg2
+import socket
+import os
+import click
+import time
+import sys
+
+
+@click.group()
+def cli():
+    pass
+
+
+@cli.command()
+@click.option('--worker-id', default=None,
+              help='Unique name for the worker. Defaults to host-pid.')
+@click.option('--concurrency', default=16,
+              help='Maximum number of pages downloaded at once.')
+@click.option('--delay', default=0.1,
+              help='Minimum seconds between requests from this worker.')
+@click.option('--batch-size', default=50,
+              help='Number of areas or routes claimed at a time.')
+@click.option('--parse-workers', default=None, type=int,
+              help='Number of parser processes. Defaults to the CPU count.')
+@click.option('--archive', default='pages.sqlite',
+              help='SQLite file downloaded pages are saved to. Empty to '
+                   'turn off.')
+@click.option('--reparse', 'reparse_only', is_flag=True,
+              help='Rebuild routes from the archive instead of crawling.')
+@click.option('--cache', default='pages.sqlite',
+              help='SQLite file of page validators for conditional requests. '
+                   'Empty to turn off.')
+@click.option('--cache-size', default=None, type=int,
+              help='Maximum number of pages kept in the cache.')
+@click.option('--metrics-file', default=None,
+              help='JSON file a snapshot of the crawl metrics is written to.')
+@click.option('--metrics-port', default=None, type=int,
+              help='Port of a local HTTP endpoint serving the metrics.')
+@click.option('--metrics-interval', default=30,
+              help='Seconds between metrics snapshots.')
+@click.option('--time-limit', default=None, type=float,
+              help='Seconds after which no more pages are claimed.')
+@click.option('--session-id', default=None,
+              help='Crawl session to start or resume. Defaults to the '
+                   'worker id.')
+@click.option('--comment-pages', default=0,
+              help='Most pages of further comments read for each busy '
+                   'route.')
+def work(worker_id, concurrency, delay, batch_size, parse_workers, archive,
+         reparse_only, cache, cache_size, metrics_file, metrics_port,
+         metrics_interval, time_limit, session_id, comment_pages):
+    ''' Runs one crawler until the frontier is empty.'''
+
+    if reparse_only:
+        reparse(archive=archive, parse_workers=parse_workers)
+        return
+    if worker_id is None:
+        worker_id = f'{socket.gethostname()}-{os.getpid()}'
+    MPScraper(
+        concurrency=concurrency,
+        delay=delay,
+        batch_size=batch_size,
+        worker_id=worker_id,
+        parse_workers=parse_workers,
+        archive=archive or None,
+        cache=cache or None,
+        cache_size=cache_size,
+        metrics_file=metrics_file,
+        metrics_port=metrics_port,
+        metrics_interval=metrics_interval,
+        time_limit=time_limit,
+        session_id=session_id,
+        comment_pages=comment_pages)
+
+
+def start_worker(worker_id, options, metrics_dir=None):
+    ''' Starts a crawler in a new process.
+
+    Args:
+        worker_id(str): Unique name for the worker
+        options(list): Command line options passed on to the worker
+        metrics_dir(str): Optional. Folder the worker writes its metrics to,
+            in a file named after the worker
+
+    Returns:
+        process(Popen): The running worker
+    '''
+
+    print(f'Starting {worker_id}')
+    if metrics_dir is not None:
+        options = options + [
+            '--metrics-file', os.path.join(metrics_dir, f'{worker_id}.json')]
+    return subprocess.Popen(
+        [sys.executable, __file__, 'work', '--worker-id', worker_id]
+        + options)
+
+
+def report(cursor, last_counts, interval):
+    ''' Prints the throughput of every worker in the Workers table.
+
+    Args:
+        cursor(psycopg2 cursor): Cursor on the routes database
+        last_counts(dict): Routes done by each worker at the last report.
+            Updated in place.
+        interval(float): Seconds since the last report
+    '''
+
+    cursor.execute('''
+        SELECT worker_id, host, status, heartbeat, areas, routes
+        FROM Workers
+        ORDER BY worker_id''')
+    now = datetime.datetime.now()
+
+    print()
+    print(f'{"worker":<24}{"host":<16}{"status":<9}{"areas":>8}'
+          f'{"routes":>9}{"routes/min":>12}{"last seen":>11}')
+    for worker_id, host, status, beat, areas, routes in cursor.fetchall():
+        rate = (routes - last_counts.get(worker_id, routes)) * 60 / interval
+        last_counts[worker_id] = routes
+        seen = int((now - beat).total_seconds())
+        print(f'{worker_id:<24}{host:<16}{status:<9}{areas:>8}'
+              f'{routes:>9}{rate:>12.1f}{seen:>10}s')
+
+
+@cli.command('whats-new')
+@click.option('--max-pages', default=50,
+              help='Maximum number of feed pages of 36 routes to read.')
+@click.option('--concurrency', default=16,
+              help='Maximum number of pages downloaded at once.')
+@click.option('--delay', default=0.1,
+              help='Minimum seconds between requests.')
+@click.option('--parse-workers', default=None, type=int,
+              help='Number of parser processes. Defaults to the CPU count.')
+@click.option('--archive', default='pages.sqlite',
+              help='SQLite file downloaded pages are saved to. Empty to '
+                   'turn off.')
+def whats_new(max_pages, concurrency, delay, parse_workers, archive):
+    ''' Adds routes posted since the last crawl and queues them for analysis.'''
+
+    crawl_whats_new(
+        max_pages=max_pages,
+        concurrency=concurrency,
+        delay=delay,
+        parse_workers=parse_workers,
+        archive=archive or None)
+
+
+@cli.command()
+@click.option('--kind', type=click.Choice(['area', 'route']), default=None,
+              help='Only requeue areas or routes.')
+def refresh(kind):
+    ''' Queues every finished page to be crawled again, most important
+    first.'''
+
+    params = config.config()
+    conn = psycopg2.connect(**params)
+    cursor = conn.cursor()
+    num_pages = requeue(cursor, kind)
+    prioritize_frontier(cursor)
+    conn.commit()
+    conn.close()
+    print(f'{num_pages} pages queued to be refreshed')
+
+
+@cli.command()
+@click.option('--region', default=None, type=float,
+              help='Weight of the popularity of the region.')
+@click.option('--routes', default=None, type=float,
+              help='Weight of the number of routes in the area.')
+@click.option('--votes', default=None, type=float,
+              help='Weight of the votes on the route.')
+@click.option('--staleness', default=None, type=float,
+              help='Weight of the time since the page was last crawled.')
+def prioritize(region, routes, votes, staleness):
+    ''' Scores the pending pages so the most important are crawled first.'''
+
+    weights = {name: weight for name, weight in [
+        ('region', region), ('routes', routes), ('votes', votes),
+        ('staleness', staleness)] if weight is not None}
+    params = config.config()
+    conn = psycopg2.connect(**params)
+    cursor = conn.cursor()
+    num_pages = prioritize_frontier(cursor, weights)
+    conn.commit()
+    conn.close()
+    print(f'{num_pages} pages scored')
+
+
+@cli.command('dead-letters')
+@click.option('--kind', type=click.Choice(['area', 'route']), default=None,
+              help='Only areas or routes.')
+@click.option('--retry', is_flag=True,
+              help='Queue the pages to be crawled again.')
+def dead_letters(kind, retry):
+    ''' Lists the pages that could not be crawled.'''
+
+    params = config.config()
+    conn = psycopg2.connect(**params)
+    cursor = conn.cursor()
+    if retry:
+        num_pages = retry_dead_letters(cursor, kind)
+        conn.commit()
+        print(f'{num_pages} pages queued to be crawled again')
+    else:
+        for url, page_kind, error, failures, failed in \
+                list_dead_letters(cursor, kind):
+            print(f'{failed:%Y-%m-%d %H:%M} {page_kind:5} {url} '
+                  f'({failures}x): {error}')
+    conn.close()
+
+
+@cli.command()
+def sessions():
+    ''' Lists the crawl sessions and estimates when the latest will finish.'''
+
+    params = config.config()
+    conn = psycopg2.connect(**params)
+    cursor = conn.cursor()
+    create_sessions(cursor)
+    rows = list_sessions(cursor)
+    print(f'{"session":<24}{"status":<9}{"runs":>5}{"hours":>8}'
+          f'{"areas":>8}{"routes":>9}{"last checkpoint":>18}')
+    for session_id, worker_id, status, runs, elapsed, areas, routes, \
+            last in rows:
+        print(f'{session_id:<24}{status:<9}{runs:>5}{elapsed / 3600:>8.1f}'
+              f'{areas:>8}{routes:>9}  {last:%Y-%m-%d %H:%M}')
+    if rows:
+        progress = session_progress(cursor, rows[0][0])
+        remaining = sum(progress['remaining'].values())
+        if progress['eta'] is None:
+            print(f'{remaining} pages left')
+        else:
+            print(f"{remaining} pages left at "
+                  f"{progress['pages_per_sec']:.1f} pages/s, about "
+                  f"{progress['eta'] / 3600:.1f} hours to go")
+    conn.close()
+
+
+@cli.command()
+@click.option('--workers', default=4,
+              help='Number of crawlers to run on this machine.')
+@click.option('--interval', default=60,
+              help='Seconds between throughput reports.')
+@click.option('--concurrency', default=16,
+              help='Maximum number of pages downloaded at once per worker.')
+@click.option('--delay', default=0.1,
+              help='Minimum seconds between requests from each worker.')
+@click.option('--batch-size', default=50,
+              help='Number of areas or routes claimed at a time.')
+@click.option('--parse-workers', default=None, type=int,
+              help='Number of parser processes per worker. Defaults to '
+                   'sharing the CPUs between the workers.')
+@click.option('--archive', default='pages.sqlite',
+              help='SQLite file downloaded pages are saved to. Empty to '
+                   'turn off.')
+@click.option('--cache', default='pages.sqlite',
+              help='SQLite file of page validators for conditional requests. '
+                   'Empty to turn off.')
+@click.option('--metrics-dir', default=None,
+              help='Folder each worker writes a JSON metrics snapshot to.')
+@click.option('--comment-pages', default=0,
+              help='Most pages of further comments read for each busy '
+                   'route.')
+def supervise(workers, interval, concurrency, delay, batch_size,
+              parse_workers, archive, cache, metrics_dir, comment_pages):
+    ''' Starts crawlers, restarts any that die and reports throughput.'''
+
+    params = config.config()
+    conn = psycopg2.connect(**params)
+    conn.autocommit = True
+    cursor = conn.cursor()
+    create_workers(cursor)
+
+    options = [
+        '--concurrency', str(concurrency),
+        '--delay', str(delay),
+        '--batch-size', str(batch_size),
+        '--archive', archive,
+        '--cache', cache,
+        '--comment-pages', str(comment_pages)]
+    # Keeps the parser processes of all the workers to about one per CPU
+    if parse_workers is None:
+        parse_workers = max(1, (os.cpu_count() or 1) // workers)
+    options += ['--parse-workers', str(parse_workers)]
+    if metrics_dir is not None:
+        os.makedirs(metrics_dir, exist_ok=True)
+    host = socket.gethostname()
+    processes = {}
+    for i in range(workers):
+        worker_id = f'{host}-{i}'
+        processes[worker_id] = start_worker(worker_id, options, metrics_dir)
+
+    last_counts = {}
+    try:
+        while processes:
+            time.sleep(interval)
+            report(cursor, last_counts, interval)
+            for worker_id, process in list(processes.items()):
+                code = process.poll()
+                # Still running
+                if code is None:
+                    continue
+                # Finished because nothing is left to crawl
+                if code == 0:
+                    print(f'{worker_id} finished')
+                    del processes[worker_id]
+                # Died, so is started again
+                else:
+                    print(f'{worker_id} exited with code {code}')
+                    processes[worker_id] = start_worker(
+                        worker_id, options, metrics_dir)
+    finally:
+        for process in processes.values():
+            process.terminate()
+    print('Complete')
+
+
+if __name__ == '__main__':
+    cli()
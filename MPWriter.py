@@ -0,0 +1,254 @@
+# -*- coding: utf-8 -*-
+"""
+Summary:
+Buffered database writes for the Mountain Project crawler.
+
+Details:
+Writing each route as it is found costs a transaction for the route, a
+second query to find the new route_id, and another transaction for the words
+in the route text.  At the scale of a full crawl, these round trips take up
+much of the crawl time.  Instead, routes and their words are held in memory
+and written in batches, either once enough routes have been gathered or once
+enough time has passed since the last write:
+
+    - Routes are streamed with COPY into a temporary staging table, straight
+      from their RouteRecords, then moved into Routes with one
+      INSERT ... SELECT.  Its RETURNING clause gives the route_id of every
+      new route.
+    - Words are streamed into the Words table with COPY, as the word_id
+      of each word in the Vocabulary (see MPVocabulary).  Ids are cached,
+      so only words the writer has not seen before are looked up.
+    - Routes taken from the frontier are marked as done in the same
+      transaction, so a route is only finished once its data is saved.
+
+When a route page has changed since it was crawled, or is parsed again from
+the page archive, the writer replaces the stored route and its words instead
+of skipping it.  The old words are found through an index on
+Words(route_id), created by create_words_index.  A location filled in by
+MPLocations.fill_null_locations is kept if the page still gives none.
+Routes written by an incremental crawl can also be queued for reanalysis in
+the same transaction.
+"""
+
+from mpproj.routefinder.RouteRecord import ROUTE_COLUMNS
+from MPFrontier import complete
+from MPFrontier import queue_reanalysis
+from MPVocabulary import VocabularyCache
+import io
+import time
+
+
+# Columns MPLocations.fill_null_locations fills in when the route page leaves
+# them empty, so a replaced route keeps its stored value unless the page now
+# gives one
+FILLED_COLUMNS = ('latitude', 'longitude')
+
+
+def create_words_index(cursor):
+    ''' Creates the index used to find the words of a route, without which
+    replacing a route scans the whole Words table.
+
+    Args:
+        cursor(psycopg2 cursor): Cursor on the routes database
+    '''
+
+    cursor.execute('''
+    CREATE INDEX IF NOT EXISTS words_route_id
+        ON Words(route_id)''')
+
+
+def update_column(column):
+    ''' Sets a column of a route from the new copy of the route.
+
+    Args:
+        column(str): Column of the Routes table
+
+    Returns:
+        update(str): Assignment for an ON CONFLICT DO UPDATE clause
+    '''
+
+    if column in FILLED_COLUMNS:
+        return f'{column} = COALESCE(EXCLUDED.{column}, Routes.{column})'
+    return f'{column} = EXCLUDED.{column}'
+
+
+class RouteWriter:
+    ''' Holds routes and their words until they are written in a batch.
+
+    Args:
+        conn(psycopg2 connection): Connection to the routes database
+        batch_size(int): Number of routes held before they are written
+        interval(float): Seconds between writes, even if the batch is not
+            full
+        replace(bool): Optional. Overwrite routes that are already in the
+            database, along with their words, rather than skipping them
+        reanalyze(str): Optional. Queues every written route in the
+            Reanalysis table, giving this as the reason
+        cache(ValidatorCache): Optional. Cache holding the validators of
+            the route pages, which are stored once the routes are written
+            and dropped for routes that are skipped or fail
+    '''
+
+    def __init__(self, conn, batch_size=500, interval=30, replace=False,
+                 reanalyze=None, cache=None):
+        self.conn = conn
+        self.cursor = conn.cursor()
+        self.batch_size = batch_size
+        self.interval = interval
+        self.replace = replace
+        self.reanalyze = reanalyze
+        self.cache = cache
+        self.vocabulary = VocabularyCache(self.cursor)
+        # Totals across every batch
+        self.counters = {
+            'batches': 0,
+            'routes': 0,
+            'words': 0,
+            'write_time': 0.0}
+        self.routes = []
+        self.last_flush = time.monotonic()
+
+    def add(self, record, words, frontier_id=None):
+        ''' Adds a route to the batch, writing the batch if it is due.
+
+        Args:
+            record(RouteRecord): Route data for every column in ROUTE_COLUMNS
+            words(list): (word, word_count, tf) for each word in the route
+                text
+            frontier_id(int): Optional. Frontier id of the route, marked as
+                done once the route is written
+        '''
+
+        self.routes.append((record, words, frontier_id))
+        if (len(self.routes) >= self.batch_size
+                or time.monotonic() - self.last_flush >= self.interval):
+            self.flush()
+
+    def _write(self):
+        ''' Writes the held routes and words, and marks them as done.
+
+        Returns:
+            num_routes(int): Number of routes written
+        '''
+
+        # A route can only be inserted once per statement, so only the
+        # latest copy of each route is kept
+        latest = {record.url: (record, words)
+                  for record, words, _ in self.routes}
+        columns = ', '.join(ROUTE_COLUMNS)
+
+        # The staging table has the same columns as Routes, but no keys or
+        # defaults, and is emptied when the transaction ends
+        self.cursor.execute(f'''
+            CREATE TEMP TABLE IF NOT EXISTS RouteStage
+            ON COMMIT DELETE ROWS
+            AS SELECT {columns} FROM Routes
+            WITH NO DATA''')
+        stage = io.StringIO()
+        for record, _ in latest.values():
+            stage.write(record.copy_line())
+        stage.seek(0)
+        self.cursor.copy_expert(
+            f'COPY RouteStage({columns}) FROM STDIN', stage)
+
+        if self.replace:
+            updates = ', '.join(
+                update_column(column)
+                for column in ROUTE_COLUMNS if column != 'url')
+            conflict = f'ON CONFLICT (url) DO UPDATE SET {updates}'
+        # Routes that are already in the database are skipped, and so are
+        # not returned
+        else:
+            conflict = 'ON CONFLICT DO NOTHING'
+        self.cursor.execute(f'''
+            INSERT INTO Routes({columns})
+            SELECT {columns} FROM RouteStage
+            {conflict}
+            RETURNING route_id, url''')
+        route_ids = {url: route_id for route_id, url in self.cursor.fetchall()}
+
+        # Replaced routes lose their old words
+        if self.replace and route_ids:
+            self.cursor.execute(
+                'DELETE FROM Words WHERE route_id IN %s',
+                (tuple(route_ids.values()),))
+
+        # Words are only written for new or replaced routes
+        written = [(route_ids[url], route_words)
+                   for url, (_, route_words) in latest.items()
+                   if url in route_ids]
+        self.vocabulary.lookup({word for _, route_words in written
+                                for word, _, _ in route_words})
+        word_ids = self.vocabulary.ids
+        words = io.StringIO()
+        num_words = 0
+        for route_id, route_words in written:
+            num_words += len(route_words)
+            for word, word_count, tf in route_words:
+                words.write(
+                    f'{route_id}\t{word_ids[word]}\t{word_count}\t{tf!r}\n')
+        words.seek(0)
+        self.cursor.copy_expert(
+            'COPY Words(route_id, word_id, word_count, tf) FROM STDIN', words)
+
+        if self.reanalyze is not None:
+            queue_reanalysis(
+                self.cursor, list(route_ids.values()), self.reanalyze)
+
+        frontier_ids = [frontier_id for _, _, frontier_id in self.routes
+                        if frontier_id is not None]
+        complete(self.cursor, frontier_ids)
+        self.conn.commit()
+        self.vocabulary.keep()
+        # An unchanged page can only stand in for a route that was written
+        if self.cache is not None:
+            self.cache.keep(list(route_ids))
+            self.cache.drop([url for url in latest if url not in route_ids])
+
+        num_routes = len(self.routes)
+        self.routes = []
+        self.counters['batches'] += 1
+        self.counters['routes'] += num_routes
+        self.counters['words'] += num_words
+        return num_routes
+
+    def flush(self):
+        ''' Writes every held route and its words in one transaction.
+
+        If the write fails, the batch is dropped and the transaction is
+        rolled back.  Routes from the frontier stay leased, and are crawled
+        again once their leases run out.
+
+        Returns:
+            num_routes(int): Number of routes written
+        '''
+
+        self.last_flush = time.monotonic()
+        if not self.routes:
+            return 0
+        start = time.perf_counter()
+        try:
+            return self._write()
+        except Exception:
+            self.conn.rollback()
+            self.vocabulary.discard()
+            if self.cache is not None:
+                self.cache.drop([record.url for record, _, _ in self.routes])
+            self.routes = []
+            raise
+        finally:
+            self.counters['write_time'] += time.perf_counter() - start
+
+    def stats(self):
+        ''' Summarizes the write counters.
+
+        Returns:
+            stats(dict): Raw counters, plus the number of routes and words
+                written per second spent writing
+        '''
+
+        stats = dict(self.counters)
+        write_time = stats['write_time'] or 1
+        stats['routes_per_sec'] = stats['routes'] / write_time
+        stats['words_per_sec'] = stats['words'] / write_time
+        return stats
@@ -0,0 +1,184 @@
+"""
+Summary:
+Finds route grades in the grade header of a Mountain Project route page.
+
+Details:
+Every route page lists its grades in one header, such as
+'5.10a YDS 6a French 18 Ewbanks VI+ UIAA 19 ZA E1 5b British PG13'.  Each
+grading system has its own pattern, compiled once when the module is loaded.
+A pattern is only searched for if the text holds the keyword that it needs,
+such as 'French' or 'UIAA', so most routes only run a few of the patterns.
+
+The grade in each system is also converted to its position in the ordered
+lists of StyleInformation, which the analyzer uses to compare routes across
+systems.  The conversions are looked up in dictionaries built once from
+those lists.  Grades that are not in the list are converted to -1.
+
+fill_grades sets the grades straight onto a RouteRecord, while parse_grades
+returns them as a dictionary.
+"""
+
+from .StyleInformation import yds_rating
+from .StyleInformation import hueco_rating
+from .StyleInformation import mixed_rating
+from .StyleInformation import aid_rating
+from .StyleInformation import ice_rating
+from .StyleInformation import snow_rating
+from .StyleInformation import nccs_rating
+from .StyleInformation import danger_rating
+from types import SimpleNamespace
+import re
+
+
+# (rating, keywords, pattern) for each grading system, in the order they are
+# stored.  A pattern is only searched for if the text holds one of its
+# keywords.  Each pattern has one group, which holds the grade.
+GRADE_PATTERNS = [
+    # 'V' followed by any combination of digits, the word 'easy', and the
+    # characters '-', and '+' if followed by whitespace and 'YDS'
+    ('hueco_rating', ('YDS',), r'(V[\+\-\deasy]+)\s+YDS'),
+    # Any combination of digits, the letters 'A', 'B', and 'C', and the
+    # characters '-' and '+' if followed by whitespace and 'Font'
+    ('font_rating', ('Font',), r'([\d\-\+ABC]+)\s+Font'),
+    # '5.' followed by any digits, the letters 'a' through 'd', and the
+    # characters '-' and '+' OR '3rd' OR 4th OR 'Easy 5th' if followed by
+    # whitespace and 'YDS'
+    ('yds_rating', ('YDS',), r'(5\.[\d\+\-a-d/]+|3rd|4th|Easy 5th)\s+YDS'),
+    # Any digit followed by any combination of '-', '+', and the letters 'a'
+    # through 'd' if it is followed by whitespace and 'French'
+    ('french_rating', ('French',), r'(\d[\-\+a-d]+)\s+French'),
+    # Any two consecutive digits if they are followed by whitespace and
+    # 'Ewbanks'
+    ('ewbanks_rating', ('Ewbanks',), r'(\d\d)\s+Ewbanks'),
+    # Any Roman Numeral using XVI and '-' and '+' if it is followed by
+    # whitespace and 'UIAA'
+    ('uiaa_rating', ('UIAA',), r'([XVI\+\-]+)\s+UIAA'),
+    # Any number if it is followed by whitespace and 'ZA'
+    ('za_rating', ('ZA',), r'(\d+)\s+ZA'),
+    # Any combination of the letters 'MDVSHE' and any digit then a space,
+    # then any digit and the letters 'abc', if they are followed by
+    # whitespace and 'British'
+    ('british_rating', ('British',), r'([MDVSHE\d]+ [\dabc]+)\s+British'),
+    # 'WI' or 'AI' followed by any number
+    ('ice_rating', ('AI', 'WI'), r'(AI[\d\+-]+|WI[\d\+-]+)'),
+    # Any word if it is followed by 'Snow'
+    ('snow_rating', ('Snow',), r'([A-Za-z]+)\s+Snow'),
+    # 'A' OR 'C' and any number or '-'
+    ('aid_rating', ('A', 'C'), r'[^\d](A[\d\+\-]+|C[\d\+\-]+)'),
+    # 'M' followed by any number
+    ('mixed_rating', ('M',), r'(M[0-6\+\-]+)'),
+    # X OR R OR PG13 as long as they aren't followed by UIAA
+    ('danger_rating', ('X', 'R', 'PG13'), r'(X|R|PG13)(?![\s\+UIVX-]+)'),
+]
+
+COMPILED_PATTERNS = [(rating, keywords, re.compile(pattern))
+                     for rating, keywords, pattern in GRADE_PATTERNS]
+
+
+def ordinal_table(grades):
+    ''' Maps each grade in an ordered list to its position.
+
+    Args:
+        grades(list): Grades from easiest to hardest
+
+    Returns:
+        table(dict): Position of the first appearance of each grade
+    '''
+
+    table = {}
+    for i, grade in enumerate(grades):
+        table.setdefault(grade, i)
+    return table
+
+
+# Conversion from a grade to its position, for each conversion column
+ORDINALS = {
+    'rope_conv': ordinal_table(yds_rating),
+    'boulder_conv': ordinal_table(hueco_rating),
+    'mixed_conv': ordinal_table(mixed_rating),
+    'aid_conv': ordinal_table(aid_rating),
+    'ice_conv': ordinal_table(ice_rating),
+    'snow_conv': ordinal_table(snow_rating),
+    'nccs_conv': ordinal_table(nccs_rating),
+    'danger_conv': ordinal_table(danger_rating),
+}
+
+# Conversion column filled in from each rating, and the part of the rating
+# that is looked up
+CONVERSIONS = {
+    'yds_rating': ('rope_conv', lambda grade: grade),
+    'hueco_rating': ('boulder_conv', lambda grade: grade),
+    'ice_rating': ('ice_conv', lambda grade: grade.split('I')[1]),
+    'snow_rating': ('snow_conv', lambda grade: grade),
+    'aid_rating': ('aid_conv', lambda grade: grade[1:]),
+    'mixed_rating': ('mixed_conv', lambda grade: grade),
+    'danger_rating': ('danger_conv', lambda grade: grade),
+}
+
+
+# Value of each conversion column if the route has no grade for it
+CONVERSION_DEFAULTS = (
+    ('boulder_conv', None),
+    ('rope_conv', None),
+    ('ice_conv', None),
+    ('snow_conv', None),
+    ('aid_conv', None),
+    ('mixed_conv', None),
+    ('danger_conv', 0),
+)
+
+
+def grade_ordinal(conversion, grade):
+    ''' Finds the position of a grade in its grading system.
+
+    Args:
+        conversion(str): Conversion column, such as 'rope_conv'
+        grade(str): Grade, such as '5.10a'
+
+    Returns:
+        ordinal(int): Position of the grade, or -1 if it is not known
+    '''
+
+    return ORDINALS[conversion].get(grade, -1)
+
+
+def fill_grades(record, grades):
+    ''' Sets the grade of a route in every grading system on a record.
+
+    Args:
+        record(RouteRecord): Record of the route
+        grades(str): Text of the grade header of a route page
+    '''
+
+    for rating, keywords, pattern in COMPILED_PATTERNS:
+        match = None
+        for keyword in keywords:
+            if keyword in grades:
+                match = pattern.search(grades)
+                break
+        setattr(record, rating, match.group(1) if match else None)
+
+    for column, default in CONVERSION_DEFAULTS:
+        setattr(record, column, default)
+    for rating, (column, part) in CONVERSIONS.items():
+        grade = getattr(record, rating)
+        if grade:
+            setattr(record, column, grade_ordinal(column, part(grade)))
+
+
+def parse_grades(grades):
+    ''' Finds the grade of a route in every grading system.
+
+    Args:
+        grades(str): Text of the grade header of a route page
+
+    Returns:
+        difficulty(dict): Grade in each system, or None if the route has no
+            grade in that system, and the position of the grade under the
+            matching conversion column.  Conversions of missing grades are
+            None, except for danger_conv, which is 0.
+    '''
+
+    difficulty = SimpleNamespace()
+    fill_grades(difficulty, grades)
+    return vars(difficulty)
@@ -0,0 +1,129 @@
+"""
+Summary:
+Compact record of one route, as the crawler parses and writes it.
+
+Details:
+A full crawl parses close to 200,000 route pages.  Each route used to be
+built up from several dictionaries, one for each part of the page, merged
+together and then read back key by key into a row for the database.  A
+RouteRecord instead has a fixed slot for every column of the Routes table
+filled in by the crawler, so the parser fills in one small object, with no
+dictionary behind it, and the writer reads it straight into a database row:
+
+    row() - Values in the order of ROUTE_COLUMNS, for an INSERT
+    copy_line() - A line of PostgreSQL's COPY text format
+
+Records are sent between processes in the same compact form, as a tuple of
+their values.
+
+The analyzer does not use records.  It reads whole columns of the Routes
+table into DataFrames, and never builds an object for each route.
+"""
+
+from operator import attrgetter
+
+
+# Columns of the Routes table filled in by the crawler, in insert order
+ROUTE_COLUMNS = (
+    'name', 'url', 'stars', 'votes', 'latitude', 'longitude', 'trad', 'tr',
+    'sport', 'aid', 'snow', 'ice', 'mixed', 'boulder', 'alpine', 'pitches',
+    'length', 'nccs_rating', 'nccs_conv', 'hueco_rating', 'font_rating',
+    'boulder_conv', 'yds_rating', 'french_rating', 'ewbanks_rating',
+    'uiaa_rating', 'za_rating', 'british_rating', 'rope_conv', 'ice_rating',
+    'ice_conv', 'snow_rating', 'snow_conv', 'aid_rating', 'aid_conv',
+    'mixed_rating', 'mixed_conv', 'danger_rating', 'danger_conv', 'area_id')
+
+# Styles of climbing a route can be listed under
+TYPE_COLUMNS = (
+    'trad', 'tr', 'sport', 'aid', 'snow', 'ice', 'mixed', 'boulder',
+    'alpine')
+
+# Every field of a record: the Routes columns, plus the URLs of the areas
+# above the route, which are used to find its parent area, and the number of
+# comments shown on the route page
+FIELDS = ROUTE_COLUMNS + ('breadcrumbs', 'comments')
+
+# Value of each field before it is filled in
+DEFAULTS = tuple(
+    (field, False if field in TYPE_COLUMNS else None) for field in FIELDS)
+
+_row = attrgetter(*ROUTE_COLUMNS)
+_state = attrgetter(*FIELDS)
+
+
+def copy_escape(value):
+    ''' Formats a value for PostgreSQL's COPY text format.
+
+    Args:
+        value: Value to be written
+
+    Returns:
+        value(str): Text with backslashes, tabs and newlines escaped, or \\N
+            for None
+    '''
+
+    if value is None:
+        return '\\N'
+    return (str(value)
+            .replace('\\', '\\\\')
+            .replace('\t', '\\t')
+            .replace('\n', '\\n')
+            .replace('\r', '\\r'))
+
+
+class RouteRecord:
+    ''' Everything stored about a route, one slot per column.
+
+    Args:
+        url(str): Optional. URL of the route
+    '''
+
+    __slots__ = FIELDS
+
+    def __init__(self, url=None):
+        for field, default in DEFAULTS:
+            setattr(self, field, default)
+        self.url = url
+
+    def row(self):
+        ''' Values of the record for an INSERT into Routes.
+
+        Returns:
+            row(tuple): Value of each column in ROUTE_COLUMNS
+        '''
+
+        return _row(self)
+
+    def copy_line(self):
+        ''' The record as one line of PostgreSQL's COPY text format.
+
+        Returns:
+            line(str): Tab separated values of ROUTE_COLUMNS, ending in a
+                newline
+        '''
+
+        return '\t'.join(map(copy_escape, _row(self))) + '\n'
+
+    def as_dict(self):
+        ''' The record as a dictionary, for printing or building a table.
+
+        Returns:
+            record(dict): Value of every field
+        '''
+
+        return dict(zip(FIELDS, _state(self)))
+
+    def __getstate__(self):
+        return _state(self)
+
+    def __setstate__(self, state):
+        for field, value in zip(FIELDS, state):
+            setattr(self, field, value)
+
+    def __eq__(self, other):
+        if not isinstance(other, RouteRecord):
+            return NotImplemented
+        return _state(self) == _state(other)
+
+    def __repr__(self):
+        return f'RouteRecord({self.url!r}, name={self.name!r})'
@@ -0,0 +1,124 @@
+"""
+Summary:
+Splits route text into stemmed words, shared by the crawler and analyzer.
+
+Details:
+Route names, descriptions and comments are lowercased, stripped of
+punctuation and accents, tokenized, filtered for stop words and stemmed with
+a Porter stemmer.  The stop words and the stemmer are only created once, and
+because the same words turn up in route after route, the stem of each word is
+remembered rather than worked out again.
+
+Two kinds of punctuation are removed:
+
+    ROUTE_PUNCTUATION - Used for route text by the crawler.  Apostrophes are
+        kept, so "don't" stays one word.
+    ARCHETYPE_PUNCTUATION - Used for the archetype descriptions by the
+        analyzer.  Apostrophes are removed too.
+
+split_texts handles many documents at once, stemming each distinct word in
+the batch only once.
+"""
+
+from nltk.tokenize import word_tokenize
+from nltk.stem import PorterStemmer
+from nltk.corpus import stopwords
+from functools import lru_cache
+import unidecode
+import re
+
+
+ROUTE_PUNCTUATION = re.compile(r"[^\w\s']")
+ARCHETYPE_PUNCTUATION = re.compile(r"[^\w\s]")
+
+stemmer = PorterStemmer()
+
+
+@lru_cache(maxsize=None)
+def stop_words():
+    ''' English stop words, loaded the first time they are needed.
+
+    Returns:
+        stop_words(frozenset): Words that are left out of the text
+    '''
+
+    return frozenset(stopwords.words('english'))
+
+
+@lru_cache(maxsize=100000)
+def stem(word):
+    ''' Stems a word, remembering the most recent results.
+
+    Args:
+        word(str): Lowercase word
+
+    Returns:
+        stem(str): Word with its suffixes removed, e.g. 'walking' -> 'walk'
+    '''
+
+    return stemmer.stem(word)
+
+
+def tokenize(text, punctuation=ROUTE_PUNCTUATION):
+    ''' Splits text into lowercase words without punctuation or accents.
+
+    Args:
+        text(str): Single string of text to be handled
+        punctuation(re.Pattern): Characters to remove
+
+    Returns:
+        words(list): Words in the order they appear
+    '''
+
+    # Converts to lowercase
+    text = text.lower()
+    # Strips punctuation and converts accented characters to unaccented
+    text = punctuation.sub('', text)
+    text = unidecode.unidecode(text)
+    # Tokenizes words and returns a list
+    return word_tokenize(text)
+
+
+def text_splitter(text, punctuation=ROUTE_PUNCTUATION):
+    '''Splits text into words and removes punctuation.
+
+    Once the text has been scraped it must be split into individual
+    words for further processing.  The text is all put in lowercase,
+    then stripped of punctuation and accented letters. Tokenizing helps
+    to further standardize the text, then converts it to a list of
+    words. Each word is then stemmed using a Porter stemmer.  This
+    removes suffixes that make similar words look different, turning,
+    for example, 'walking' or 'walked' into 'walk'.  Stop words are
+    also filtered out at this stage.
+
+    Args:
+        text(str): Single string of text to be handled
+        punctuation(re.Pattern): Characters to remove
+
+    Returns:
+        text(list): List of processed words.'''
+
+    stops = stop_words()
+    return [stem(word) for word in tokenize(text, punctuation)
+            if word not in stops]
+
+
+def split_texts(texts, punctuation=ROUTE_PUNCTUATION):
+    ''' Splits many documents into processed words at once.
+
+    Args:
+        texts(iterable): Strings of text to be handled
+        punctuation(re.Pattern): Characters to remove
+
+    Returns:
+        texts(list): List of processed words for each document, in order
+    '''
+
+    stops = stop_words()
+    documents = [tokenize(text, punctuation) for text in texts]
+    # Each distinct word in the batch is only stemmed once
+    stems = {word: stem(word)
+             for document in documents for word in set(document)
+             if word not in stops}
+    return [[stems[word] for word in document if word not in stops]
+            for document in documents]
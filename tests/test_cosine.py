@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+"""
+Checks the matrix cosine similarity in MPTfidf against scoring one route at
+a time, the way MPAnalyzer used to.
+"""
+
+from MPTfidf import term_matrix
+from MPTfidf import tfidf_matrix
+from MPTfidf import tfidf_frame
+from MPTfidf import cosine_scores
+from MPBenchmark import sample_words
+from MPBenchmark import legacy_cosine_scores
+from MPBenchmark import sample_archetypes
+import pandas as pd
+import numpy as np
+import pytest
+
+
+def sample_routes(num_routes):
+    words = sample_words(num_routes, vocabulary_size=400)
+    matrix, routes, vocabulary = term_matrix(
+        words['route_id'], words['word_id'], words['tf'])
+    tfidfn, idf = tfidf_matrix(matrix, num_routes, 0, num_routes)
+    routes = tfidf_frame(tfidfn, idf, routes, vocabulary)
+    return routes.set_index('word_id', append=True)['tfidfn']
+
+
+@pytest.mark.parametrize('chunk_size', [50000, 7])
+def test_scores_match_per_route(chunk_size):
+    routes = sample_routes(60)
+    archetypes = sample_archetypes(
+        routes.index.get_level_values('word_id'), size=40)
+    legacy = legacy_cosine_scores(routes, archetypes)
+    scores = cosine_scores(routes, archetypes, chunk_size=chunk_size)
+
+    assert list(scores.columns) == list(legacy.columns)
+    assert sorted(scores.index) == sorted(legacy.index)
+    np.testing.assert_allclose(scores.loc[legacy.index].values,
+                               legacy.values, atol=1e-12)
+
+
+def test_scores_values():
+    index = pd.MultiIndex.from_tuples(
+        [(1, 10), (1, 11), (2, 12), (3, 10)], names=['route_id', 'word_id'])
+    routes = pd.Series([0.6, 0.8, 1.0, 1.0], index=index)
+    archetypes = pd.DataFrame(
+        {'crack': [1.0, np.nan], 'slab': [0.6, 0.8]},
+        index=pd.Index([10, 11], name='word_id'))
+    scores = cosine_scores(routes, archetypes)
+
+    np.testing.assert_allclose(scores.loc[1], [0.6, 0.36 + 0.64])
+    # Route 2 shares no words with the archetypes
+    np.testing.assert_allclose(scores.loc[2], [0.0, 0.0])
+    np.testing.assert_allclose(scores.loc[3], [1.0, 0.6])
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+"""
+Checks that the rate limiter of MPFetcher slows a host down by the same
+amount however long the crawl has run, and that parse time is measured in
+the parse worker.
+"""
+
+from MPFetcher import AdaptiveRateLimiter, timed_parse
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import time
+
+
+URL = 'http://127.0.0.1/route/1/test'
+
+
+def test_unlimited_host_builds_no_debt():
+    async def crawl():
+        limiter = AdaptiveRateLimiter(0)
+        for _ in range(1000):
+            await limiter.wait(URL)
+        bucket = limiter.bucket(URL)
+        assert bucket.tokens >= 0
+
+        # One push back waits one request at the starting rate, rather than
+        # paying off every request made so far
+        limiter.throttle(URL)
+        start = time.monotonic()
+        await limiter.wait(URL)
+        assert time.monotonic() - start < 2 / limiter.start_rate
+
+    asyncio.run(crawl())
+
+
+def test_throttle_spends_saved_tokens():
+    async def crawl():
+        limiter = AdaptiveRateLimiter(0.01, burst=5)
+        await limiter.wait(URL)
+        limiter.throttle(URL)
+        bucket = limiter.bucket(URL)
+        assert bucket.tokens == 0
+        assert bucket.rate == 50
+
+    asyncio.run(crawl())
+
+
+def slow_parse(url, html):
+    time.sleep(0.05)
+    return len(html)
+
+
+def test_parse_time_excludes_queueing():
+    # Four pages wait for one worker, so the last waits three parses before
+    # its own starts
+    with ThreadPoolExecutor(1) as pool:
+        futures = [pool.submit(timed_parse, slow_parse, URL, b'page')
+                   for _ in range(4)]
+        results = [future.result() for future in futures]
+    assert all(result == 4 for result, _ in results)
+    assert all(0.05 <= parse_time < 0.1 for _, parse_time in results)
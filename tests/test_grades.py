@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+"""
+Checks GradeParser against get_route_diff as it was before it, kept as
+MPBenchmark.legacy_grades, over a fixed set of grade headers.
+"""
+
+from MPBenchmark import SAMPLE_GRADES
+from MPBenchmark import CORRECTED_CONVERSIONS
+from MPBenchmark import legacy_grades
+from MPBenchmark import same_grades
+from mpproj.routefinder.GradeParser import parse_grades
+from mpproj.routefinder.StyleInformation import aid_rating
+from mpproj.routefinder.StyleInformation import mixed_rating
+import pytest
+
+
+GRADE_HEADERS = SAMPLE_GRADES + [
+    '',
+    '5.7+ YDS X',
+    '5.11- YDS PG13',
+    '5.10b/c YDS A0',
+    '3rd YDS',
+    'V0-1 YDS 4 Font',
+    'V12 YDS 8A Font R',
+    'WI3-4',
+    'WI5+ M7 R',
+    'M12 WI6',
+    'Steep Snow',
+    'Easy Snow AI1',
+    '5.9 YDS A1 C2+',
+    'C3+ A3',
+    'VII UIAA',
+    'E2 5c British',
+]
+
+
+@pytest.mark.parametrize('grades', GRADE_HEADERS)
+def test_grades_match(grades):
+    legacy, parsed = legacy_grades(grades), parse_grades(grades)
+    assert legacy.keys() == parsed.keys()
+    assert same_grades(legacy, parsed)
+
+
+@pytest.mark.parametrize('grades, column, grade, ratings', [
+    ('5.9 YDS A1 C2+', 'aid_conv', '1', aid_rating),
+    ('C3+ A3', 'aid_conv', '3', aid_rating),
+    ('M12 WI6', 'mixed_conv', 'M12', mixed_rating),
+    ('WI5+ M5 R', 'mixed_conv', 'M5', mixed_rating),
+])
+def test_corrected_conversions(grades, column, grade, ratings):
+    assert column in CORRECTED_CONVERSIONS
+    assert parse_grades(grades)[column] == list(ratings).index(grade)
+
+
+def test_grade_values():
+    parsed = parse_grades(SAMPLE_GRADES[0])
+    assert parsed['yds_rating'] == '5.10a'
+    assert parsed['british_rating'] == 'E1 5b'
+    assert parsed['danger_rating'] == 'PG13'
+    assert parse_grades('')['danger_conv'] == 0
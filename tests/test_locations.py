@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+"""
+Checks the walk up the area tree that MPLocations uses to fill in route
+locations.
+"""
+
+from MPLocations import nearest_locations
+
+
+def test_nearest_located_area():
+    areas = {
+        1: (None, 40.0, -105.0),
+        2: (1, None, None),
+        3: (2, None, None),
+        4: (2, 41.0, -106.0),
+        5: (4, None, -107.0),
+    }
+    assert nearest_locations(areas) == {
+        1: (40.0, -105.0),
+        2: (40.0, -105.0),
+        3: (40.0, -105.0),
+        4: (41.0, -106.0),
+        # An area with only a longitude takes both from the area above it
+        5: (41.0, -106.0),
+    }
+
+
+def test_no_located_ancestor():
+    areas = {
+        1: (None, None, None),
+        2: (1, None, None),
+        # Its parent is missing from the tree
+        3: (99, None, None),
+        4: (None, 39.0, -104.0),
+    }
+    assert nearest_locations(areas) == {4: (39.0, -104.0)}
+
+
+def test_loop_in_tree():
+    areas = {
+        1: (2, None, None),
+        2: (3, None, None),
+        3: (1, None, None),
+        4: (1, None, None),
+        5: (6, None, None),
+        6: (5, 38.0, -103.0),
+    }
+    # The walk ends instead of going round the loop forever
+    assert nearest_locations(areas) == {
+        5: (38.0, -103.0),
+        6: (38.0, -103.0),
+    }
+
+
+def test_order_does_not_matter():
+    areas = {
+        3: (2, None, None),
+        2: (1, None, None),
+        1: (None, 40.0, -105.0),
+    }
+    reverse = dict(reversed(list(areas.items())))
+    assert nearest_locations(areas) == nearest_locations(reverse)
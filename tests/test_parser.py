@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""
+Checks that the lxml and BeautifulSoup pages parse the saved pages in
+tests/pages the same way.  Pages holding 'route' in their file name are route
+pages, the rest are area pages, as for 'python MPParser.py parity'.
+"""
+
+from MPParser import LxmlPage
+from MPParser import SoupPage
+from MPParser import parse_area_page
+from MPParser import get_route_metadata
+from MPParser import get_route_type
+from MPParser import get_route_diff
+from MPParser import first_line
+from mpproj.routefinder.RouteRecord import RouteRecord
+import pytest
+import os
+
+
+PAGES = os.path.join(os.path.dirname(__file__), 'pages')
+AREA_PAGES = sorted(name for name in os.listdir(PAGES)
+                    if name.endswith('.html') and 'route' not in name)
+ROUTE_PAGES = sorted(name for name in os.listdir(PAGES)
+                     if name.endswith('.html') and 'route' in name)
+
+
+def read_page(name):
+    with open(os.path.join(PAGES, name), 'rb') as file:
+        return file.read()
+
+
+def route_record(name, page):
+    ''' Fills in every column parse_route finds without splitting the text.'''
+
+    record = RouteRecord(name)
+    get_route_metadata(record, page)
+    get_route_type(record, page)
+    get_route_diff(record, page)
+    return record
+
+
+@pytest.mark.parametrize('name', AREA_PAGES)
+def test_area_pages_match(name):
+    html = read_page(name)
+    assert parse_area_page(html, 'lxml') == \
+        parse_area_page(html, 'html.parser')
+
+
+@pytest.mark.parametrize('name', ROUTE_PAGES)
+def test_route_pages_match(name):
+    html = read_page(name)
+    lxml_page, soup_page = LxmlPage(html), SoupPage(html)
+
+    assert route_record(name, lxml_page) == route_record(name, soup_page)
+    assert lxml_page.breadcrumb_urls() == soup_page.breadcrumb_urls()
+    # The text is only ever split into words, so whitespace between
+    # elements, which the parsers keep differently, does not matter
+    assert lxml_page.description_text().split() == \
+        soup_page.description_text().split()
+    assert [first_line(comment) for comment in lxml_page.comment_texts()] \
+        == [first_line(comment) for comment in soup_page.comment_texts()]
+
+
+def test_area_page_values():
+    area = parse_area_page(read_page('area-crag-105748496.html'))
+    assert (area['latitude'], area['longitude']) == \
+        ('39.93199', '-105.28319')
+    assert area['routes_in_area'] and not area['is_empty']
+    # The header row of the route table is skipped
+    assert len(area['route_urls']) == 3
+
+    region = parse_area_page(read_page('area-region-105708961.html'))
+    assert region['latitude'] is None
+    assert len(region['area_urls']) == 4
+
+    empty = parse_area_page(read_page('area-empty-118302911.html'))
+    assert empty['is_empty'] and empty['area_urls'] == []
+
+
+def test_route_page_values():
+    page = LxmlPage(read_page('route-105748639.html'))
+    record = route_record('route-105748639.html', page)
+    assert (record.stars, record.votes) == ('3.6', '1412')
+    assert record.trad and not record.sport
+    assert (record.length, record.pitches, record.nccs_rating) == \
+        ('350', '5', 'II')
+    assert (record.yds_rating, record.british_rating) == ('5.7', 'S 4a')
+    # Comments with other classes, such as hidden ones, are left out
+    assert len(page.comment_texts()) == 3
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+"""
+Checks the sparse TFIDF and cosine similarity in MPTfidf against the
+groupby passes MPAnalyzer used to run, on small made-up corpora.
+"""
+
+from MPTfidf import term_matrix
+from MPTfidf import tfidf_matrix
+from MPTfidf import scale_tfidf
+from MPTfidf import tfidf_frame
+from MPBenchmark import legacy_tfidf
+from MPBenchmark import sample_words
+import pandas as pd
+import numpy as np
+import pytest
+
+
+def sparse_tfidf(words, num_docs, min_occur, max_occur):
+    matrix, routes, vocabulary = term_matrix(
+        words['route_id'], words['word_id'], words['tf'])
+    tfidfn, idf = tfidf_matrix(matrix, num_docs, min_occur, max_occur)
+    return tfidf_frame(tfidfn, idf, routes, vocabulary)
+
+
+def sorted_rows(routes):
+    return routes.reset_index()\
+                 .sort_values(['route_id', 'word_id'])\
+                 .reset_index(drop=True)[['route_id', 'word_id', 'idf',
+                                          'tfidfn']]
+
+
+@pytest.mark.parametrize('num_routes, min_occur, max_occur', [
+    (50, 0, 50),
+    (200, 2, 150),
+    (200, 0.2, 180),
+])
+def test_tfidf_matches_groupby(num_routes, min_occur, max_occur):
+    words = sample_words(num_routes, vocabulary_size=300)
+    legacy = legacy_tfidf(words.set_index('route_id'), num_routes,
+                          min_occur, max_occur)
+    result = sparse_tfidf(words, num_routes, min_occur, max_occur)
+
+    legacy, result = sorted_rows(legacy), sorted_rows(result)
+    assert len(result) == len(legacy)
+    assert (result['route_id'].values == legacy['route_id'].values).all()
+    assert (result['word_id'].values == legacy['word_id'].values).all()
+    np.testing.assert_allclose(result['idf'], legacy['idf'])
+    np.testing.assert_allclose(result['tfidfn'], legacy['tfidfn'])
+
+
+def test_tfidf_values():
+    # Word 1 is in every route, so it is dropped with max_occur at 3.  Word
+    # 2 is in two of the three routes.
+    words = pd.DataFrame({
+        'route_id': [1, 1, 2, 2, 3],
+        'word_id': [1, 2, 1, 2, 1],
+        'tf': [0.5, 0.5, 0.25, 0.75, 1.0]})
+    result = sparse_tfidf(words, 3, 0, 3)
+    assert list(result['word_id']) == [2, 2]
+    np.testing.assert_allclose(result['idf'], 1 + np.log(3 / 2))
+    # Each route left with one word is a unit vector
+    np.testing.assert_allclose(result['tfidfn'], 1.0)
+    # Route 3 has no words left
+    assert list(result.index) == [1, 2]
+
+
+def test_scale_tfidf_with_stored_idf():
+    words = sample_words(100, vocabulary_size=200)
+    matrix, routes, vocabulary = term_matrix(
+        words['route_id'], words['word_id'], words['tf'])
+    tfidfn, idf = tfidf_matrix(matrix, 100, 1, 90)
+
+    # Scoring a few routes with the IDF of the whole corpus gives the same
+    # rows as scoring every route
+    some = words[words['route_id'].isin([3, 7, 42])]
+    part, part_routes, part_vocabulary = term_matrix(
+        some['route_id'], some['word_id'], some['tf'])
+    stored = pd.Series(idf, index=vocabulary)[part_vocabulary].values
+    result = tfidf_frame(scale_tfidf(part, stored), stored, part_routes,
+                         part_vocabulary)
+    full = tfidf_frame(tfidfn, idf, routes, vocabulary)
+    expected = full[full.index.isin([3, 7, 42])]
+    pd.testing.assert_frame_equal(sorted_rows(result), sorted_rows(expected))